@@ -0,0 +1,245 @@
+import numpy as np
+from flightlog import DEFAULT_PERIOD_IN_MS, HOST_PREFIX, load_flight_log, load_channels
+
+# Helpers shared by the analysis notebooks, e.g.,
+#
+#   from analysis import load_hardware_data
+#   data = load_hardware_data('NOOR_flight_5.json', only_in_flight=True)
+
+
+def _group_by_time(data, variables):
+    # Group variables that were logged in the same log block (and so have
+    # exactly the same timestamps) so that each group can be resampled at
+    # once. Returns a list of (time, [variable, ...]) pairs.
+    groups = []
+    for k in variables:
+        t = data[k]['time']
+        for group_time, group in groups:
+            # (comparing lists from a JSON log is much faster than turning
+            # every one of them into an array first)
+            if len(group_time) == len(t) and (group_time == t if isinstance(t, list) else np.array_equal(group_time, t)):
+                group.append(k)
+                break
+        else:
+            groups.append((t, [k]))
+    return [(np.asarray(t), group) for t, group in groups]
+
+
+def _in_flight_window(values, columns):
+    # Indices i0, i1 such that values[i0:i1] is when o_z_des (or ctrltarget.z,
+    # whichever was positive for longer) was positive - note that, exactly
+    # as in the original notebook helper, the last such sample is excluded
+    best = None
+    for k in ['ae483log.o_z_des', 'ctrltarget.z']:
+        if k in columns:
+            positive = values[:, columns[k]] > 0
+            n = np.count_nonzero(positive)
+            if n > 0 and (best is None or n > best[0]):
+                best = (n, positive)
+    if best is None or best[0] < 2:
+        raise Exception(
+            'Failed to get "only_in_flight" data.\n' + \
+            ' - Did you remember to log "ae483log.o_z_des" and was it ever positive?\n' + \
+            ' - Did you remember to log "ctrltarget.z" and was it ever positive?\n'
+        )
+    positive = best[1]
+    i0 = np.argmax(positive)
+    i1 = len(positive) - 1 - np.argmax(positive[::-1])
+    return i0, i1
+
+
+def resample_flight_data(data, t_min_offset=0, t_max_offset=0, only_in_flight=False, variables=None, period_in_ms=None, span=None):
+    # Resample logged data (in the JSON layout, or a FlightLog) every
+    # period_in_ms by linear interpolation. Only the given variables are
+    # resampled (all of them by default) and the time window is chosen from
+    # those variables. By default, the period is that of the fastest of these
+    # variables (each one carries the period at which it was logged, which is
+    # 10 ms, i.e. 100 Hz, for every log written before log_rates existed).
+    # Host events (see clocksync.py) are only resampled if they are asked
+    # for, since they do not cover the whole flight.
+    #
+    # If data is only part of a flight (see load_channels), span is when the
+    # last of these variables started being logged and the first of them
+    # stopped over the whole flight (drone time in ms), so that the times and
+    # the grid are those the whole flight would be resampled at.
+    #
+    # Returns (t, values, columns), where values has one row per time in t
+    # and one column per variable, and columns maps each variable name to
+    # its column in values.
+    if variables is None:
+        variables = [k for k in data.keys() if not k.startswith(HOST_PREFIX)]
+    groups = _group_by_time(data, variables)
+    if period_in_ms is None:
+        period_in_ms = min([data[k].get('period_in_ms', DEFAULT_PERIOD_IN_MS) for k in variables], default=DEFAULT_PERIOD_IN_MS)
+
+    # create an array of times at which to subsample
+    t_min = -np.inf
+    t_max = np.inf
+    for time, group in groups:
+        t_min = max(t_min, time[0])
+        t_max = min(t_max, time[-1])
+    t_first, t_last = (t_min, t_max) if span is None else span
+    t_first += t_min_offset * 1000
+    t_last -= t_max_offset * 1000
+    nt = int(1 + np.floor((t_last - t_first) / period_in_ms))
+    # (only the part of the grid that data covers, if it is part of a flight)
+    k0 = max(int(np.ceil((t_min - t_first) / period_in_ms)), 0)
+    k1 = min(int(np.floor((t_max - t_first) / period_in_ms)) + 1, nt)
+    t = np.arange(k0, max(k1, k0)) * period_in_ms / 1000.
+
+    # resample raw data with linear interpolation, finding where each new
+    # time falls only once for all the variables that share a timestamp vector
+    # (values is stored one variable per row, so that each column of the
+    # transpose that is returned is contiguous)
+    columns = {k: j for j, k in enumerate(variables)}
+    values = np.empty((len(variables), len(t)))
+    for time, group in groups:
+        x = (time - t_first) / 1000.
+        i = np.clip(np.searchsorted(x, t, side='left'), 1, len(x) - 1)
+        x_lo = x[i - 1]
+        x_hi = x[i]
+        dx = x_hi - x_lo
+        slope = np.divide(t - x_lo, dx, out=np.zeros_like(t), where=(dx != 0))
+        y = np.array([data[k]['data'] for k in group], dtype=np.float64)
+        y_lo = np.take(y, i - 1, axis=1)
+        y_hi = np.take(y, i, axis=1)
+        values[[columns[k] for k in group]] = y_lo + slope * (y_hi - y_lo)
+    values = values.T
+
+    # truncate to times when o_z_des is positive
+    if only_in_flight:
+        i0, i1 = _in_flight_window(values, columns)
+        t = t[i0:i1]
+        values = values[i0:i1]
+
+    return t, values, columns
+
+
+def load_hardware_data(filename, t_min_offset=0, t_max_offset=0, only_in_flight=False, variables=None, time_window=None, period_in_ms=None):
+    # Same as the load_hardware_data helper that used to be copied into each
+    # notebook, except that it also reads binary logs (see flightlog.py) and
+    # can load only some variables, and only some of the time (time_window is
+    # (start, end) in seconds - see load_channels). Data is resampled every
+    # period_in_ms (see resample_flight_data). Returns a dict with 'time' and
+    # one array for each variable (these arrays are columns of one 2-D array).
+    span = None
+    if variables is None and time_window is None:
+        data = load_flight_log(filename)
+    elif time_window is None:
+        # (only the variables that were asked for are read from the file)
+        data = load_channels(filename, variables)
+    else:
+        # (the window is on the axis that is returned, which starts
+        # t_min_offset later than the one load_channels uses)
+        start, end = time_window
+        data, span = load_channels(
+            filename,
+            variables,
+            time_window=(start + t_min_offset, end + t_min_offset),
+            return_span=True,
+        )
+        if only_in_flight:
+            # (when the drone was in flight is found from the whole flight,
+            # not just from the window, and the window is cut down to it)
+            log = load_flight_log(filename, lazy=True)
+            flags = {k: log[k] for k in ['ae483log.o_z_des', 'ctrltarget.z'] if k in log}
+            if period_in_ms is None:
+                period_in_ms = min(val.get('period_in_ms', DEFAULT_PERIOD_IN_MS) for k, val in data.items() if variables is not None or not k.startswith(HOST_PREFIX))
+            t, values, columns = resample_flight_data(
+                flags,
+                t_min_offset=t_min_offset,
+                t_max_offset=t_max_offset,
+                only_in_flight=True,
+                period_in_ms=period_in_ms,
+                span=span,
+            )
+            start = max(start, t[0])
+            end = min(end, t[-1])
+            only_in_flight = False
+    t, values, columns = resample_flight_data(
+        data,
+        t_min_offset=t_min_offset,
+        t_max_offset=t_max_offset,
+        only_in_flight=only_in_flight,
+        variables=variables,
+        period_in_ms=period_in_ms,
+        span=span,
+    )
+    if time_window is not None:
+        # (the same samples that loading the whole flight would give there)
+        keep = (t >= start) & (t <= end)
+        t = t[keep]
+        values = values[keep]
+    resampled_data = {'time': t}
+    for k, j in columns.items():
+        resampled_data[k] = values[:, j]
+    return resampled_data
+
+
+if __name__ == '__main__':
+    # Compare against the helper that used to be copied into each notebook
+    # (one interp1d per variable), e.g.,
+    #
+    #   python Final_Code/analysis.py NOOR_flight_4.json
+    #
+    import os
+    import sys
+    import json
+    import time
+    import tempfile
+    from scipy.interpolate import interp1d
+    from flightlog import read_flight_log, write_flight_log
+
+    def resample_with_interp1d(data, t_min_offset=0, t_max_offset=0, only_in_flight=False):
+        data = {k: {'time': np.array(v['time']), 'data': np.array(v['data'])} for k, v in data.items()}
+        t_min = -np.inf
+        t_max = np.inf
+        for key, val in data.items():
+            t_min = max(t_min, val['time'][0])
+            t_max = min(t_max, val['time'][-1])
+        t_min += t_min_offset * 1000
+        t_max -= t_max_offset * 1000
+        nt = int(1 + np.floor((t_max - t_min) / 10.))
+        t = np.arange(0, 10 * nt, 10) / 1000.
+        resampled_data = {'time': t}
+        for k, v in data.items():
+            f = interp1d((v['time'] - t_min) / 1000., v['data'])
+            resampled_data[k] = f(t)
+        if only_in_flight:
+            i = []
+            for k in ['ae483log.o_z_des', 'ctrltarget.z']:
+                if k in resampled_data.keys():
+                    j = np.argwhere(resampled_data[k] > 0).flatten()
+                    if len(j) > len(i):
+                        i = j
+            for key in resampled_data.keys():
+                resampled_data[key] = resampled_data[key][i[0]:i[-1]]
+        return resampled_data
+
+    def best_time(f, repeat=20):
+        times = []
+        for i in range(repeat):
+            start_time = time.perf_counter()
+            result = f()
+            times.append(time.perf_counter() - start_time)
+        return min(times), result
+
+    for filename in sys.argv[1:] or ['NOOR_flight_4.json']:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        old_time, old = best_time(lambda: resample_with_interp1d(data, only_in_flight=True))
+        new_time, (t, values, columns) = best_time(lambda: resample_flight_data(data, only_in_flight=True))
+        error = max(np.max(np.abs(old[k] - values[:, j])) for k, j in columns.items())
+
+        # Most of the time above goes into turning JSON lists into arrays, so
+        # also time the same thing starting from a binary log
+        with tempfile.TemporaryDirectory() as tmpdir:
+            binary_filename = os.path.join(tmpdir, 'log.aelog')
+            write_flight_log(binary_filename, data)
+            binary_time, result = best_time(lambda: resample_flight_data(read_flight_log(binary_filename), only_in_flight=True))
+            del result
+
+        print(f'{filename} ({len(columns)} variables, {len(t)} samples)')
+        print(f' interp1d per variable:           {old_time * 1e3:8.3f} ms')
+        print(f' batched by log block:            {new_time * 1e3:8.3f} ms ({old_time / new_time:5.1f}x faster, max difference {error:.1e})')
+        print(f' batched by log block (.aelog):   {binary_time * 1e3:8.3f} ms ({old_time / binary_time:5.1f}x faster)')
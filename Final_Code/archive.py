@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from flightlog import EXTENSION, write_flight_log
+from packedlog import EXTENSION as PACKED_EXTENSION, write_packed_log
+
+# Converts every JSON flight log in the repository to the binary format in
+# flightlog.py (using every CPU core) and builds a catalog with one entry per
+# flight, e.g.,
+#
+#   python Final_Code/archive.py
+#
+# from the repository root. Files are only reconverted if they are new or
+# have changed since the last time the catalog was built. With --packed, they
+# are converted to the compressed format in packedlog.py instead, which is
+# much smaller and meant for flights that are kept but rarely read.
+CATALOG_VERSION = 1
+SKIP_DIRS = {'cache', '.ipynb_checkpoints', '.git'}
+
+
+def find_flight_logs(roots, output_dir):
+    # Returns (filename, name) for each JSON file under roots, where name is
+    # its path relative to the root it was found in (or, for roots that are
+    # files, its base name) - outputs go at name in output_dir, so that they
+    # never end up outside it
+    found = []
+    for root in roots:
+        if os.path.isfile(root):
+            found.append((root, os.path.basename(root)))
+            continue
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames[:] = sorted(
+                d for d in dirnames
+                if d not in SKIP_DIRS and os.path.abspath(os.path.join(dirpath, d)) != os.path.abspath(output_dir)
+            )
+            found.extend((os.path.join(dirpath, f), os.path.relpath(os.path.join(dirpath, f), root)) for f in sorted(files) if f.endswith('.json'))
+    result = []
+    for filename, name in found:
+        name = os.path.normpath(name)
+        if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+            raise ValueError(f'{filename} is not inside any of {roots}')
+        result.append((os.path.normpath(filename), name))
+    return result
+
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_flight_log(data):
+    return (
+        isinstance(data, dict) and len(data) > 0 and
+        all(isinstance(val, dict) and 'time' in val and 'data' in val for val in data.values())
+    )
+
+
+def airborne_window(data):
+    # Drone ticks at which the drone was first and last asked to be above the
+    # ground (the same test as only_in_flight in load_hardware_data)
+    best = None
+    for k in ['ae483log.o_z_des', 'ctrltarget.z']:
+        if k in data and len(data[k]['data']) > 0:
+            i = np.flatnonzero(np.asarray(data[k]['data']) > 0)
+            if len(i) > 0 and (best is None or len(i) > best[0]):
+                t = data[k]['time']
+                best = (len(i), k, int(t[i[0]]), int(t[i[-1]]))
+    if best is None:
+        return None
+    return {'variable': best[1], 'start_tick': best[2], 'end_tick': best[3], 'duration': (best[3] - best[2]) / 1000.}
+
+
+def catalog_flight(filename, output_filename, content_hash):
+    # Runs in a worker process: convert one flight log and describe it
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        # (not JSON, e.g., a truncated log)
+        return None
+    if not is_flight_log(data):
+        return None
+    os.makedirs(os.path.dirname(output_filename) or '.', exist_ok=True)
+    if output_filename.endswith(PACKED_EXTENSION):
+        write_packed_log(output_filename, data)
+    else:
+        write_flight_log(output_filename, data)
+    starts = [val['time'][0] for val in data.values() if len(val['time']) > 0]
+    ends = [val['time'][-1] for val in data.values() if len(val['time']) > 0]
+    start_tick = int(min(starts)) if starts else None
+    end_tick = int(max(ends)) if ends else None
+    return {
+        'file': filename,
+        'output': output_filename,
+        'hash': content_hash,
+        'size': os.path.getsize(filename),
+        'mtime': os.path.getmtime(filename),
+        'start_tick': start_tick,
+        'end_tick': end_tick,
+        'duration': (end_tick - start_tick) / 1000. if starts else 0.,
+        'variables': sorted(data.keys()),
+        'samples': {k: len(val['time']) for k, val in data.items()},
+        'airborne': airborne_window(data),
+    }
+
+
+def load_catalog(filename):
+    # Returns the catalog entries by file, and the hashes of files that were
+    # found not to be flight logs
+    if not os.path.exists(filename):
+        return {}, set()
+    with open(filename, 'r') as f:
+        catalog = json.load(f)
+    if catalog.get('version') != CATALOG_VERSION:
+        return {}, set()
+    return {entry['file']: entry for entry in catalog['flights']}, set(catalog['ignored'])
+
+
+def build_catalog(roots, output_dir, catalog_filename, workers=None, packed=False):
+    old_entries, ignored = load_catalog(catalog_filename)
+    entries = {}
+    jobs = []
+    for filename, name in find_flight_logs(roots, output_dir):
+        output_filename = os.path.join(output_dir, os.path.splitext(name)[0] + (PACKED_EXTENSION if packed else EXTENSION))
+        old = old_entries.get(filename)
+        if old is not None and (old['output'] != output_filename or not os.path.exists(output_filename)):
+            old = None
+        stat = os.stat(filename)
+        # Skip hashing files whose size and modification time are unchanged,
+        # and skip converting files whose contents are unchanged
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            entries[filename] = old
+            continue
+        content_hash = file_hash(filename)
+        if old is not None and old['hash'] == content_hash:
+            entries[filename] = dict(old, size=stat.st_size, mtime=stat.st_mtime)
+            continue
+        if content_hash in ignored:
+            continue
+        jobs.append((filename, output_filename, content_hash))
+
+    num_skipped = len(entries)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {job: executor.submit(catalog_flight, *job) for job in jobs}
+        for (filename, output_filename, content_hash), future in futures.items():
+            entry = future.result()
+            if entry is None:
+                ignored.add(content_hash)
+            else:
+                entries[filename] = entry
+                print(f'Converted {filename} -> {output_filename}')
+
+    # Remember files that turned out not to be flight logs (by hash) so they
+    # are not parsed again next time
+    flights = [entries[k] for k in sorted(entries)]
+    os.makedirs(os.path.dirname(catalog_filename) or '.', exist_ok=True)
+    with open(catalog_filename, 'w') as f:
+        json.dump({'version': CATALOG_VERSION, 'flights': flights, 'ignored': sorted(ignored)}, f, indent=1)
+    print(f'Catalog has {len(entries)} flights ({len(entries) - num_skipped} converted, {num_skipped} unchanged)')
+    return flights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert flight logs and build a catalog of them')
+    parser.add_argument('roots', nargs='*', default=['.'], help='files or directories to search for flight logs')
+    parser.add_argument('--output-dir', default='flight_archive', help='where to put converted logs')
+    parser.add_argument('--catalog', default=None, help='catalog file (default: OUTPUT_DIR/catalog.json)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: one per core)')
+    parser.add_argument('--packed', action='store_true', help=f'convert to the compressed {PACKED_EXTENSION} format instead of {EXTENSION}')
+    args = parser.parse_args()
+    catalog_filename = args.catalog or os.path.join(args.output_dir, 'catalog.json')
+    build_catalog(args.roots, args.output_dir, catalog_filename, workers=args.workers, packed=args.packed)
@@ -0,0 +1,133 @@
+import asyncio
+from flight import SimpleClient
+from setpoints import Hold, Line, Stop
+
+# Asyncio version of SimpleClient, e.g.,
+#
+#   async def main():
+#       client = AsyncSimpleClient(uri, use_controller=True)
+#       await client.connect()
+#       await client.set_param('stabilizer.estimator', 2)
+#       await client.astop(1.0)
+#       samples = client.log_queue()
+#       await asyncio.gather(
+#           client.amove_smooth([0., 0., 0.15], [0., 0., 0.5], 0., 0.2),
+#           client.set_param('ring.headlightEnable', 1),
+#       )
+#       await client.adisconnect()
+#
+#   cflib.crtp.init_drivers()
+#   asyncio.run(main())
+#
+# Everything that SimpleClient does (logging, streaming, the setpoint
+# scheduler) works the same way - this class only turns the cflib callbacks
+# into futures and queues on the event loop, and adds amove, amove_smooth,
+# astop and adisconnect, coroutines that finish when their segment has been
+# flown (or the link has been closed). It is still a SimpleClient, so its
+# move, move_smooth, stop and disconnect block exactly as they always have
+# (e.g., for letter_move or Swarm).
+
+
+class AsyncSimpleClient(SimpleClient):
+    def __init__(self, uri, **kwargs):
+        # Must be created in a coroutine (like any other asyncio object) -
+        # the link is opened right away, as with SimpleClient, and connect()
+        # waits until it is fully connected
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue()
+        self.log_queues = []
+        self._connected = self.loop.create_future()
+        super().__init__(uri, **kwargs)
+
+    async def connect(self):
+        await self._connected
+
+    def _emit(self, *event):
+        # Called from cflib threads
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    def _resolve(self, future, exception=None):
+        def resolve():
+            if not future.done():
+                if exception is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exception)
+        self.loop.call_soon_threadsafe(resolve)
+
+    def connected(self, uri):
+        super().connected(uri)
+        self._emit('connected', uri)
+
+    def fully_connected(self, uri):
+        super().fully_connected(uri)
+        self._emit('fully_connected', uri)
+        self._resolve(self._connected)
+
+    def connection_failed(self, uri, msg):
+        super().connection_failed(uri, msg)
+        self._emit('connection_failed', uri, msg)
+        self._resolve(self._connected, ConnectionError(f'Connection to {uri} failed: {msg}'))
+
+    def connection_lost(self, uri, msg):
+        super().connection_lost(uri, msg)
+        self._emit('connection_lost', uri, msg)
+        self._resolve(self._connected, ConnectionError(f'Connection to {uri} lost: {msg}'))
+
+    def disconnected(self, uri):
+        super().disconnected(uri)
+        self._emit('disconnected', uri)
+
+    def log_queue(self, maxsize=1000):
+        # Queue of (timestamp, data, logconf name) for every log packet from
+        # now on - if it is not read fast enough, the oldest packets are
+        # dropped rather than slowing down logging
+        q = asyncio.Queue(maxsize=maxsize)
+        self.log_queues.append(q)
+        return q
+
+    def _offer(self, q, item):
+        if q.full():
+            q.get_nowait()
+        q.put_nowait(item)
+
+    def log_data(self, timestamp, data, logconf):
+        super().log_data(timestamp, data, logconf)
+        for q in self.log_queues:
+            self.loop.call_soon_threadsafe(self._offer, q, (timestamp, data, logconf.name))
+
+    async def _run_segment(self, segment):
+        # (waits in another thread, so that an error that stops the segment
+        # is raised here too - see SetpointScheduler.wait)
+        done = self.setpoints.add(segment)
+        await self.loop.run_in_executor(None, self.setpoints.wait, done)
+
+    async def amove(self, x, y, z, yaw, dt):
+        print(f'Move to {x}, {y}, {z} with yaw {yaw} degrees for {dt} seconds')
+        await self._run_segment(Hold(x, y, z, yaw, dt))
+
+    async def amove_smooth(self, p1, p2, yaw, speed):
+        print(f'Move smoothly from {p1} to {p2} with yaw {yaw} degrees at {speed} meters / second')
+        await self._run_segment(Line(p1, p2, yaw, speed))
+
+    async def astop(self, dt):
+        print(f'Stop for {dt} seconds')
+        await self._run_segment(Stop(dt))
+
+    async def set_param(self, name, value):
+        # Set a parameter and wait until the drone reports its new value
+        # (which is returned, as a string)
+        # (or the value of a newer write that replaced this one - see params.py)
+        updated = self.loop.create_future()
+
+        def param_updated(value_s):
+            def resolve():
+                if not updated.done():
+                    updated.set_result(value_s)
+            self.loop.call_soon_threadsafe(resolve)
+
+        self.params.set(name, value, on_ack=param_updated)
+        return await updated
+
+    async def adisconnect(self):
+        await self.loop.run_in_executor(None, self.disconnect)
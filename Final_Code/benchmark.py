@@ -0,0 +1,251 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from flight import SimpleClient, variables
+from log_blocks import load_log_toc
+from analysis import load_hardware_data
+
+# Benchmarks of the parts of the code that have to be fast, with no drone,
+# e.g.,
+#
+#   python Final_Code/benchmark.py --output benchmark_results.json
+#   python Final_Code/benchmark.py --compare benchmark_results.json
+#
+# from the repository root. Results (and where they came from) are written to
+# a JSON file so that runs on different commits can be compared.
+RESULTS_VERSION = 1
+
+# Logs used to time load_hardware_data (the largest ones in the repository)
+hardware_logs = ['NOOR_flight_4.json', 'N_data.json']
+
+# Variables that a typical analysis cell needs (to time load_hardware_data
+# with variables=...)
+selected_variables = ['ae483log.o_x', 'ae483log.o_y', 'ae483log.o_z', 'ae483log.o_x_des', 'ae483log.o_y_des', 'ae483log.o_z_des']
+
+
+class NullCommander:
+    # Stands in for cf.commander and counts setpoints
+    def __init__(self):
+        self.num_setpoints = 0
+
+    def send_position_setpoint(self, x, y, z, yaw):
+        self.num_setpoints += 1
+
+    def send_stop_setpoint(self):
+        self.num_setpoints += 1
+
+
+def offline_client(stream_to=None, setpoint_rate=50., live=None):
+    # A SimpleClient that is not connected to anything, with the same log
+    # blocks that connected would create (using the cached TOC)
+    client = SimpleClient.offline(NullCommander(), setpoint_rate=setpoint_rate, stream_to=stream_to, live=live)
+    blocks = client.create_log_blocks(load_log_toc(variables))
+    return client, blocks
+
+
+def synthetic_packets(blocks, num_packets, seed=0):
+    # A few different packets for each block (as cflib would hand them to
+    # log_data) to cycle through
+    rng = np.random.default_rng(seed)
+    packets = []
+    for block in blocks:
+        packets.append([
+            {v: int(rng.integers(0, 65535)) if t.startswith('uint') else float(rng.normal()) for v, t in block}
+            for i in range(num_packets)
+        ])
+    return packets
+
+
+def fill_client(client, blocks, duration, rate=100):
+    # Call log_data as cflib would for duration seconds of logging (every
+    # 1 / rate seconds, each block only when its period says so), as fast as
+    # possible. Returns the number of calls and of values they carried.
+    packets = synthetic_packets(blocks, 64)
+    num_calls = 0
+    num_values = 0
+    for i in range(int(duration * rate)):
+        timestamp = i * (1000 // rate)
+        for logconf, block_packets in zip(client.logconfs, packets):
+            if timestamp % logconf.period_in_ms != 0:
+                continue
+            packet = block_packets[i % len(block_packets)]
+            client.log_data(timestamp, packet, logconf)
+            num_calls += 1
+            num_values += len(packet)
+    return num_calls, num_values
+
+
+def bench_log_data(duration=60., stream=False, live=False):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        client, blocks = offline_client(
+            stream_to=os.path.join(tmpdir, 'flight.aestream') if stream else None,
+            live=f'ae483_benchmark_{os.getpid()}' if live else None,
+        )
+        start_time = time.perf_counter()
+        num_calls, num_values = fill_client(client, blocks, duration)
+        elapsed = time.perf_counter() - start_time
+        if client.stream is not None:
+            client.stream.close()
+        if client.live is not None:
+            client.live.close()
+        client.setpoints.close()
+    return {
+        'seconds': elapsed,
+        'packets_per_second': num_calls / elapsed,
+        'values_per_second': num_values / elapsed,
+        'realtime_factor': duration / elapsed,
+    }
+
+
+def bench_write_data(duration=60., repeat=3):
+    client, blocks = offline_client()
+    fill_client(client, blocks, duration)
+    client.setpoints.close()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for kind, filename in [('json', 'flight.json'), ('aelog', 'flight.aelog')]:
+            filename = os.path.join(tmpdir, filename)
+            times = []
+            for i in range(repeat):
+                start_time = time.perf_counter()
+                client.write_data(filename)
+                times.append(time.perf_counter() - start_time)
+            results[f'{kind}_seconds'] = min(times)
+            results[f'{kind}_bytes'] = os.path.getsize(filename)
+    return results
+
+
+def bench_load_hardware_data(filename, repeat=5, variables=None):
+    times = []
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        data = load_hardware_data(filename, variables=variables)
+        times.append(time.perf_counter() - start_time)
+    # (peak memory is measured separately, since tracing slows things down)
+    tracemalloc.start()
+    load_hardware_data(filename, variables=variables)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'seconds': min(times),
+        'seconds_median': float(np.median(times)),
+        'bytes': os.path.getsize(filename),
+        'peak_bytes': peak_bytes,
+        'samples': len(data['time']),
+        'variables': len(data) - 1,
+    }
+
+
+def bench_connect(repeat=3):
+    # Time from opening the link to a simulated drone (see sim.py) until it
+    # is ready, which is all protocol and setup (there is no radio)
+    timelines = []
+    for i in range(repeat):
+        client = SimpleClient('sim://model')
+        if not client.wait_until_ready(timeout=30.):
+            raise Exception('Simulated drone was not ready within 30 seconds')
+        client.disconnect()
+        timelines.append(client.timeline)
+    best = min(timelines, key=lambda timeline: timeline['ready'])
+    return {f'{event.replace(" ", "_")}_seconds': t for event, t in best.items()}
+
+
+def bench_setpoints(method, duration=5., rate=50.):
+    client, blocks = offline_client(setpoint_rate=rate)
+    if method == 'move':
+        client.move(0., 0., 0.5, 0., duration)
+    else:
+        client.move_smooth([0., 0., 0.], [0., 0., duration * 0.1], 0., 0.1)
+    client.setpoints.close()
+    s = client.setpoints.stats()
+    return {
+        'rate': s['rate'],
+        'ticks': s['ticks'],
+        'missed': s['missed'],
+        'setpoints': client.setpoints.commander.num_setpoints,
+        'jitter_mean_ms': s['jitter_mean_ms'],
+        'jitter_p99_ms': s['jitter_p99_ms'],
+        'jitter_max_ms': s['jitter_max_ms'],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(quick=False):
+    repeat = 1 if quick else 5
+    setpoint_duration = 1. if quick else 5.
+    benchmarks = [
+        ('log_data', lambda: bench_log_data()),
+        ('log_data_streaming', lambda: bench_log_data(stream=True)),
+        ('log_data_live', lambda: bench_log_data(live=True)),
+        ('write_data', lambda: bench_write_data(repeat=min(repeat, 3))),
+    ]
+    for filename in hardware_logs:
+        if os.path.exists(filename):
+            benchmarks.append((f'load_hardware_data[{filename}]', lambda filename=filename: bench_load_hardware_data(filename, repeat=repeat)))
+            benchmarks.append((f'load_hardware_data_selected[{filename}]', lambda filename=filename: bench_load_hardware_data(filename, repeat=repeat, variables=selected_variables)))
+        else:
+            print(f'Skipping load_hardware_data on {filename} (not found - run from the repository root)')
+    benchmarks.append(('setpoints_move', lambda: bench_setpoints('move', duration=setpoint_duration)))
+    benchmarks.append(('setpoints_move_smooth', lambda: bench_setpoints('move_smooth', duration=setpoint_duration)))
+    benchmarks.append(('connect', lambda: bench_connect(repeat=1 if quick else 3)))
+
+    results = {}
+    for name, f in benchmarks:
+        print(f'Running {name}...', flush=True)
+        # (move, move_smooth and the scheduler print as they go)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = f()
+    return {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def print_results(results, baseline=None):
+    for name, metrics in results['results'].items():
+        print(name)
+        old_metrics = baseline['results'].get(name, {}) if baseline is not None else {}
+        for k, v in metrics.items():
+            line = f'  {k:24s} {v:14.6g}'
+            if k in old_metrics and old_metrics[k]:
+                line += f'  (was {old_metrics[k]:.6g}, {v / old_metrics[k]:.2f}x)'
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark logging, storage, analysis and setpoints.')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--compare', default=None, help='results of an earlier run to compare against')
+    parser.add_argument('--quick', action='store_true', help='repeat each measurement fewer times')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    results = run_benchmarks(quick=args.quick)
+    print_results(results, baseline)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Wrote {args.output}')
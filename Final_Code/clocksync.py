@@ -0,0 +1,286 @@
+import sys
+import numpy as np
+from telemetry import TelemetryStore
+from flightlog import DEFAULT_PERIOD_IN_MS, HOST_PREFIX, load_flight_log
+from replay import setpoint_variables
+
+# Drone time of things the host does. Logged data is timestamped by the drone
+# clock (in milliseconds since it booted), while setpoints, parameter writes
+# and everything else the host does are timed by the host clock
+# (time.monotonic), so the two have to be lined up to tell, e.g., how long it
+# takes from sending a setpoint until the drone acts on it.
+#
+# Every log packet says when it was logged (drone time) and is seen by the
+# host some time later (host time), so host time - drone time is the offset
+# between the clocks plus how long that packet took to arrive. Over each
+# window of a second, the packet that took the least time to arrive gives
+# the closest estimate of the offset, and a line through these estimates
+# gives the offset and how fast it changes (drift, since the two clocks are
+# different crystals), i.e.,
+#
+#   host time = drone time + offset + drift * (drone time - first drone time)
+#
+# This is kept up to date as packets arrive (in SimpleClient.log_data), so the
+# drone time of anything can be found during the flight. Even the fastest
+# packets take some time to arrive, so host events come out that much too
+# early in drone time - delay is added back to correct for it (SimpleClient
+# sets it to half of the fastest parameter write round trip).
+#
+# The drone time of every setpoint sent and parameter written is stored in the
+# flight log by SimpleClient.write_data, as variables that start with
+# HOST_PREFIX:
+#
+#   host.setpoint.x/y/z/yaw     each position setpoint when it was sent
+#   host.stop                   1 whenever the motors were stopped
+#   host.param.<name>           each value written to parameter <name>
+#   host.mark.<name>            each value given to SimpleClient.mark(<name>)
+#
+# (e.g., host.param.ring.headlightEnable holds every headlight change)
+
+# Width of the windows in which the least delayed packet is found (in seconds)
+window = 1.
+
+# Setpoints and logged setpoints that differ by less than this are the same
+# (in meters - they are both float32 on the drone)
+tolerance = 1e-4
+
+# A setpoint that is not seen in the logged setpoints within this many
+# seconds is considered never to have been acted on
+max_latency = 0.5
+
+# Rate (in Hz) at which SimpleClient(..., measure_latency=True) logs the
+# setpoints (instead of the rate in log_rates in flight.py), so that the
+# latencies below are each at most 20 ms too long rather than 100 ms. This is
+# the fastest rate at which everything else that is logged still fits in the
+# radio budget.
+latency_log_rate = 50
+
+
+class ClockSync:
+    def __init__(self, window=window, delay=0.):
+        self.window = window
+        self.delay = delay
+        # (drone time, host time - drone time) in seconds of the least delayed
+        # packet in each window so far, and [window, drone time, offset] for
+        # the current window
+        self.minima = []
+        self.current = None
+        self.count = 0
+        self.fit = None
+
+    def update(self, timestamp, host_time):
+        # timestamp is the drone time (ms) of a log packet, host_time is when
+        # it arrived (s, from time.monotonic)
+        d = timestamp / 1000.
+        offset = host_time - d
+        w = int(d // self.window)
+        c = self.current
+        if c is None or w > c[0]:
+            if c is not None:
+                self.minima.append((c[1], c[2]))
+            self.current = [w, d, offset]
+            self.fit = None
+        elif offset < c[2]:
+            c[1] = d
+            c[2] = offset
+            self.fit = None
+        self.count += 1
+
+    def _fit(self):
+        # (offset at the first drone time, drift, first drone time), from a
+        # least-squares line through the minimum of each window - windows
+        # whose fastest packet was still unusually late (e.g., because the
+        # radio stalled for the whole window) are left out
+        if self.fit is None:
+            points = self.minima + ([tuple(self.current[1:])] if self.current is not None else [])
+            if not points:
+                return None
+            d, offset = np.array(points).T
+            d0 = d[0]
+            if len(points) < 3:
+                self.fit = (float(np.min(offset)), 0., d0)
+            else:
+                drift, offset0 = np.polyfit(d - d0, offset, 1)
+                residual = offset - (offset0 + drift * (d - d0))
+                keep = residual <= 3. * np.median(np.abs(residual)) + 1e-4
+                if not np.all(keep) and np.count_nonzero(keep) >= 3:
+                    drift, offset0 = np.polyfit(d[keep] - d0, offset[keep], 1)
+                self.fit = (float(offset0), float(drift), d0)
+        return self.fit
+
+    def is_ready(self):
+        return self.current is not None
+
+    def to_drone(self, host_time):
+        # Drone time (ms) at host time host_time (s, from time.monotonic) -
+        # host_time can be a number or an array
+        offset0, drift, d0 = self._fit()
+        d = (np.asarray(host_time) - offset0 + drift * d0) / (1. + drift)
+        return (d + self.delay) * 1000.
+
+    def to_host(self, timestamp):
+        # Host time (s, as time.monotonic) at drone time timestamp (ms)
+        offset0, drift, d0 = self._fit()
+        d = np.asarray(timestamp) / 1000. - self.delay
+        return d + offset0 + drift * (d - d0)
+
+    def summary(self):
+        fit = self._fit()
+        if fit is None:
+            return {'packets': 0}
+        offset0, drift, d0 = fit
+        points = self.minima + [tuple(self.current[1:])]
+        d, offset = np.array(points).T
+        residual = offset - (offset0 + drift * (d - d0))
+        return {
+            'packets': self.count,
+            'windows': len(points),
+            'offset_s': offset0 + drift * (d[-1] - d0),
+            'drift_ppm': drift * 1e6,
+            'residual_ms': float(np.median(np.abs(residual))) * 1e3,
+            'delay_ms': self.delay * 1e3,
+        }
+
+
+def print_clock(s):
+    if s['packets'] == 0:
+        print('Clock offset unknown (no log packets)')
+        return
+    print(f'Host clock - drone clock = {s["offset_s"]:.3f} s, drifting {s["drift_ppm"]:.1f} ppm '
+          f'(from the fastest of {s["packets"]} packets in {s["windows"]} windows, residual {s["residual_ms"]:.2f} ms, '
+          f'radio delay {s["delay_ms"]:.1f} ms)')
+
+
+def host_log(clock, sent=(), param_writes=(), marks=(), setpoint_period_in_ms=DEFAULT_PERIOD_IN_MS):
+    # Setpoints sent (from SetpointScheduler.sent), parameters written (from
+    # ParamWriter.history) and marks ((time, name, value) from
+    # SimpleClient.mark) as variables in drone time (see above), in a
+    # TelemetryStore that can be merged with the logged data
+    store = TelemetryStore()
+    if not clock.is_ready():
+        return store
+
+    def add(name, variables, host_times, columns, period_in_ms=DEFAULT_PERIOD_IN_MS):
+        store.add_block(name, [(v, 'float') for v in variables], capacity=max(len(host_times), 1), period_in_ms=period_in_ms)
+        store.extend(name, np.rint(clock.to_drone(np.array(host_times, dtype=np.float64))).astype(np.int64), dict(zip(variables, columns)))
+
+    moves = [(t, p) for t, p in sent if p is not None]
+    if moves:
+        p = np.array([p for t, p in moves], dtype=np.float64)
+        variables = [f'{HOST_PREFIX}setpoint.{k}' for k in ['x', 'y', 'z', 'yaw']]
+        add(f'{HOST_PREFIX}setpoints', variables, [t for t, p in moves], p.T, period_in_ms=setpoint_period_in_ms)
+    stops = [t for t, p in sent if p is None]
+    if stops:
+        add(f'{HOST_PREFIX}stops', [f'{HOST_PREFIX}stop'], stops, [np.ones(len(stops))])
+
+    events = {}
+    for write in param_writes:
+        if write['sent'] is not None:
+            events.setdefault(f'{HOST_PREFIX}param.{write["name"]}', []).append((write['sent'], float(write['value'])))
+    for t, name, value in marks:
+        events.setdefault(f'{HOST_PREFIX}mark.{name}', []).append((t, float(value)))
+    for v, rows in events.items():
+        rows.sort()
+        add(v, [v], [t for t, value in rows], [[value for t, value in rows]])
+    return store
+
+
+def command_latency(data, source):
+    # Time from sending each new setpoint until it shows up in the setpoint
+    # the drone logs (setpoint_variables[source] in replay.py), in seconds,
+    # from a flight log (or TelemetryStore) with host.setpoint.* in it. Only
+    # setpoints that differ from the one before are counted, and only those
+    # that were logged before the next one replaced them. These are upper
+    # bounds rather than the latencies themselves: each can be up to one
+    # period of the logged setpoint too long, since it is only seen the next
+    # time it is logged, and setpoints that were replaced sooner than that
+    # (i.e., those the drone acted on soonest) are the ones that are missed.
+    sent_time = np.asarray(data[f'{HOST_PREFIX}setpoint.x']['time'], dtype=np.float64)
+    sent = np.array([data[f'{HOST_PREFIX}setpoint.{k}']['data'] for k in ['x', 'y', 'z']], dtype=np.float64).T
+    changed = np.concatenate([[True], np.any(np.abs(np.diff(sent, axis=0)) > tolerance, axis=1)])
+    sent_time = sent_time[changed]
+    sent = sent[changed]
+
+    variables = setpoint_variables[source]
+    logged_time = np.asarray(data[variables[0]]['time'], dtype=np.float64)
+    logged = np.array([data[v]['data'] for v in variables], dtype=np.float64).T
+    first_seen = np.full(len(sent_time), np.inf)
+    hi = np.searchsorted(sent_time, logged_time, side='right')
+    lo = np.searchsorted(sent_time, logged_time - max_latency * 1000., side='left')
+    for j in range(len(logged_time)):
+        # (the newest setpoint sent before this sample that it matches)
+        match = np.nonzero(np.all(np.abs(sent[lo[j]:hi[j]] - logged[j]) <= tolerance, axis=1))[0]
+        if len(match):
+            k = lo[j] + match[-1]
+            first_seen[k] = min(first_seen[k], logged_time[j])
+    seen = np.isfinite(first_seen)
+    return (first_seen[seen] - sent_time[seen]) / 1000., len(sent_time)
+
+
+def latency_summary(data):
+    # Summary of command_latency for each logged setpoint in data
+    result = {}
+    if f'{HOST_PREFIX}setpoint.x' not in data:
+        return result
+    for source, variables in setpoint_variables.items():
+        if not all(v in data for v in variables):
+            continue
+        latency, num_sent = command_latency(data, source)
+        s = {'sent': num_sent, 'seen': len(latency), 'period_ms': data[variables[0]].get('period_in_ms', DEFAULT_PERIOD_IN_MS)}
+        if len(latency):
+            latency = latency * 1e3
+            s.update({
+                'min_ms': float(np.min(latency)),
+                'p50_ms': float(np.percentile(latency, 50)),
+                'p90_ms': float(np.percentile(latency, 90)),
+                'p99_ms': float(np.percentile(latency, 99)),
+                'max_ms': float(np.max(latency)),
+            })
+        result[source] = s
+    return result
+
+
+def print_latency(summary):
+    # (the latencies are only upper bounds - see command_latency)
+    for source, s in summary.items():
+        line = f'Setpoint to {source}: {s["seen"]} of {s["sent"]} new setpoints seen'
+        if s['seen']:
+            line += (f', latency at most min {s["min_ms"]:.1f} ms, p50 {s["p50_ms"]:.1f} ms, p90 {s["p90_ms"]:.1f} ms, '
+                     f'p99 {s["p99_ms"]:.1f} ms, max {s["max_ms"]:.1f} ms (each up to {s["period_ms"]} ms too long, '
+                     f'since {source} is logged every {s["period_ms"]} ms)')
+            if s['period_ms'] > 1000 / latency_log_rate:
+                line += f' - log it every {1000 // latency_log_rate} ms with SimpleClient(uri, measure_latency=True)'
+        print(line)
+
+
+if __name__ == '__main__':
+    # Command-to-effect latency of flights that were logged with host events,
+    # e.g.,
+    #
+    #   python Final_Code/clocksync.py NOOR_flight_6.json
+    #
+    # or, with no arguments, of a short flight in the simulator
+    if len(sys.argv) > 1:
+        for filename in sys.argv[1:]:
+            print(filename)
+            data = load_flight_log(filename)
+            summary = latency_summary(data)
+            if not summary:
+                print(' (no host events - this flight was logged before they were)')
+            print_latency(summary)
+    else:
+        import cflib.crtp
+        from flight import SimpleClient
+        cflib.crtp.init_drivers()
+        client = SimpleClient('sim://model', measure_latency=True)
+        client.wait_until_ready()
+        client.params.wait()
+        client.stop(0.1)
+        client.move(0., 0., 0.15, 0., 1.)
+        client.move_smooth([0., 0., 0.15], [0., 0., 0.5], 0., 0.2)
+        for x, y in [(0.5, 0.), (0.5, 0.5), (0., 0.5), (0., 0.)]:
+            client.move(x, y, 0.5, 0., 1.)
+        client.mark('landing')
+        client.move_smooth([0., 0., 0.5], [0., 0., 0.15], 0., 0.2)
+        client.stop(0.5)
+        client.disconnect()
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import time
+import inspect
+import hashlib
+import functools
+import contextlib
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    # (Windows)
+    fcntl = None
+    import msvcrt
+
+# On-disk cache of things computed from flight logs (resampled data, frame
+# transformations, offline observers, ...), so that running a notebook again
+# after restarting its kernel reads them back instead of computing them, e.g.,
+#
+#   from datacache import cached
+#   from analysis import load_hardware_data
+#   load_hardware_data = cached(load_hardware_data)
+#   data = load_hardware_data('NOOR_flight_4.json', only_in_flight=True)
+#
+# A result is found by a hash of the content of the flight log (the first
+# argument), the source code of the function and of the modules in this
+# folder that it uses (directly or through each other, e.g., analysis.py and
+# flightlog.py for load_hardware_data), and every other argument (with
+# defaults filled in, so f(x) and f(x, only_in_flight=False) are the same).
+# Editing the flight log, the function or those modules therefore gives a new
+# entry, and the old entries for that log and function are removed when it is
+# stored. Anything else a result depends on (e.g., a data file that the
+# function reads) can be given as version, e.g., cached(f, version=2).
+# Results are stored as numpy arrays (one .npz file per entry), and the least
+# recently used entries are removed once the cache is bigger than max_bytes.
+#
+# A result can be an array, a tuple or list of arrays, or a dict of arrays
+# (like what load_hardware_data returns) - strings and numbers are stored as
+# 0-d arrays and come back as they were.
+INDEX_VERSION = 2
+INDEX_FILENAME = 'index.json'
+# (held while the index is read, changed and written, so that notebooks that
+# share the cache do not undo each other's changes)
+LOCK_FILENAME = 'index.lock'
+
+
+def _hash_value(h, value):
+    # Feed a canonical description of value to the hash h
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update(f'array{value.dtype.str}{value.shape}'.encode('utf-8'))
+        h.update(value.tobytes())
+    elif isinstance(value, dict):
+        h.update(b'dict{')
+        for k in sorted(value, key=repr):
+            _hash_value(h, k)
+            _hash_value(h, value[k])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(f'{type(value).__name__}['.encode('utf-8'))
+        for item in value:
+            _hash_value(h, item)
+        h.update(b']')
+    elif value is None or isinstance(value, (bool, int, float, str, np.generic)):
+        h.update(f'{type(value).__name__}:{value!r}'.encode('utf-8'))
+    else:
+        raise TypeError(f'Cannot use an argument of type {type(value).__name__} in a cache key')
+
+
+def _local_module(value):
+    # The module in this folder that value is (or that it was defined in), or
+    # None if there is none
+    module = value
+    if not inspect.ismodule(value):
+        name = getattr(value, '__module__', None)
+        module = sys.modules.get(name) if isinstance(name, str) else None
+    filename = getattr(module, '__file__', None)
+    if not isinstance(filename, str) or os.path.dirname(os.path.abspath(filename)) != os.path.dirname(os.path.abspath(__file__)):
+        return None
+    return module
+
+
+def dependencies(func):
+    # Modules in this folder that func uses, directly or through each other
+    found = {}
+    todo = [func.__globals__]
+    module = _local_module(func)
+    if module is not None:
+        found[module.__name__] = module
+        todo.append(vars(module))
+    while todo:
+        for value in list(todo.pop().values()):
+            module = _local_module(value)
+            if module is not None and module.__name__ not in found:
+                found[module.__name__] = module
+                todo.append(vars(module))
+    return [found[name] for name in sorted(found)]
+
+
+# Hash of the source of each module, kept as long as its file does not change
+_module_hashes = {}
+
+
+def _module_hash(module):
+    st = os.stat(module.__file__)
+    stamp = (st.st_size, st.st_mtime_ns)
+    if _module_hashes.get(module.__file__, (None,))[0] != stamp:
+        with open(module.__file__, 'rb') as f:
+            _module_hashes[module.__file__] = (stamp, hashlib.sha256(f.read()).hexdigest())
+    return _module_hashes[module.__file__][1]
+
+
+def function_id(func, version=None):
+    # Name of func and a hash of its source code, of the modules it depends
+    # on and of version (so that editing any of them gives new results)
+    name = f'{func.__module__}.{func.__qualname__}'
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = name
+    h = hashlib.sha256(source.encode('utf-8'))
+    for module in dependencies(func):
+        h.update(f'{module.__name__}:{_module_hash(module)}'.encode('utf-8'))
+    _hash_value(h, version)
+    return name, h.hexdigest()[:16]
+
+
+def _pack(result):
+    # Turn a result into {name: array} for np.savez, plus its kind
+    if isinstance(result, np.ndarray):
+        return 'array', {'value': result}
+    if isinstance(result, (tuple, list)):
+        return type(result).__name__, {f'{i}': np.asarray(item) for i, item in enumerate(result)}
+    if isinstance(result, dict):
+        arrays = {}
+        for k, item in result.items():
+            if not isinstance(k, str) or isinstance(item, (dict, list, tuple)):
+                raise TypeError(f'Cannot cache a dict with a {type(k).__name__} key or a {type(item).__name__} value')
+            arrays[k] = np.asarray(item)
+        return 'dict', arrays
+    raise TypeError(f'Cannot cache a result of type {type(result).__name__}')
+
+
+def _unpack(kind, arrays, names):
+    def value(name):
+        a = arrays[name]
+        return a.item() if a.ndim == 0 else a
+    if kind == 'array':
+        return arrays['value']
+    if kind == 'dict':
+        return {name: value(name) for name in names}
+    items = [value(name) for name in names]
+    return tuple(items) if kind == 'tuple' else items
+
+
+class DataCache:
+    def __init__(self, cache_dir='.aecache', max_bytes=500e6):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        # Content hash of each flight log, kept as long as the file's size
+        # and modification time do not change (so each log is only hashed
+        # once per kernel, not once per call)
+        self.file_hashes = {}
+
+    def _index_filename(self):
+        return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Hold the lock on the index (waiting for other processes to let go
+        # of it first)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, LOCK_FILENAME), 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_index(self):
+        try:
+            with open(self._index_filename(), 'r') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'version': INDEX_VERSION, 'entries': {}}
+
+    def _write_index(self, index):
+        # (written to a temporary file first, so that another notebook never
+        # sees half an index - call it with the lock held)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_filename = f'{self._index_filename()}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_filename, self._index_filename())
+
+    def content_hash(self, filename):
+        st = os.stat(filename)
+        stamp = (st.st_size, st.st_mtime_ns)
+        path = os.path.abspath(filename)
+        if self.file_hashes.get(path, (None,))[0] != stamp:
+            h = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            self.file_hashes[path] = (stamp, h.hexdigest())
+        return self.file_hashes[path][1]
+
+    def key(self, func, filename, *args, version=None, **kwargs):
+        # Key of the entry (which does not depend on where the flight log is,
+        # only on its content), and a hash of the call on this file (which
+        # does not depend on its content - see call)
+        name, source_hash = function_id(func, version=version)
+        bound = inspect.signature(func).bind(filename, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(list(bound.arguments.items())[1:])
+        h = hashlib.sha256()
+        _hash_value(h, [name, source_hash, arguments])
+        call = h.copy()
+        h.update(self.content_hash(filename).encode('utf-8'))
+        call.update(os.path.abspath(filename).encode('utf-8'))
+        return h.hexdigest(), call.hexdigest()
+
+    def call(self, func, filename, *args, version=None, **kwargs):
+        # func(filename, *args, **kwargs), read from the cache if it has been
+        # computed before on the same content of filename (with the same
+        # version)
+        key, call_hash = self.key(func, filename, *args, version=version, **kwargs)
+        entry_filename = os.path.join(self.cache_dir, f'{key}.npz')
+        entry = self._read_index()['entries'].get(key)
+        if entry is not None:
+            try:
+                with np.load(entry_filename, allow_pickle=False) as npz:
+                    arrays = {name: npz[name] for name in entry['names']}
+                result = _unpack(entry['kind'], arrays, entry['names'])
+            except (OSError, KeyError, ValueError):
+                # (the file is gone or broken, so compute it again)
+                pass
+            else:
+                with self._locked():
+                    index = self._read_index()
+                    if key in index['entries']:
+                        index['entries'][key]['last_used'] = time.time()
+                        self._write_index(index)
+                self.num_hits += 1
+                return result
+
+        self.num_misses += 1
+        result = func(filename, *args, **kwargs)
+        kind, arrays = _pack(result)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_filename = f'{entry_filename}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_filename, **arrays)
+        os.replace(tmp_filename, entry_filename)
+
+        # The same call on an older version of the flight log (or of the
+        # function) can never be used again, so it is removed now
+        with self._locked():
+            index = self._read_index()
+            for old_key, old_entry in list(index['entries'].items()):
+                if old_key != key and old_entry['call'] == call_hash:
+                    self._remove(index, old_key)
+            index['entries'][key] = {
+                'call': call_hash,
+                'function': function_id(func)[0],
+                'file': os.path.abspath(filename),
+                'kind': kind,
+                'names': list(arrays.keys()),
+                'bytes': os.path.getsize(entry_filename),
+                'last_used': time.time(),
+            }
+            self._evict(index)
+            self._write_index(index)
+        return result
+
+    def _remove(self, index, key):
+        index['entries'].pop(key, None)
+        try:
+            os.remove(os.path.join(self.cache_dir, f'{key}.npz'))
+        except OSError:
+            pass
+
+    def _evict(self, index):
+        # Remove the least recently used entries until the cache fits in
+        # max_bytes
+        total = sum(entry['bytes'] for entry in index['entries'].values())
+        for key, entry in sorted(index['entries'].items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entry['bytes']
+            self._remove(index, key)
+
+    def size(self):
+        return sum(entry['bytes'] for entry in self._read_index()['entries'].values())
+
+    def clear(self):
+        with self._locked():
+            index = self._read_index()
+            for key in list(index['entries']):
+                self._remove(index, key)
+            self._write_index(index)
+
+
+default_cache = DataCache()
+
+
+def cached(func, cache=None, version=None):
+    # Cached version of func, whose first argument must be the filename of a
+    # flight log (see DataCache.call)
+    @functools.wraps(func)
+    def wrapper(filename, *args, **kwargs):
+        return (default_cache if cache is None else cache).call(func, filename, *args, version=version, **kwargs)
+    return wrapper
+
+
+if __name__ == '__main__':
+    # Time what the observer notebook does on each flight (load the data,
+    # transform the default observer's velocities into the body frame, and
+    # run the offline observer) without and then with the cache, e.g.,
+    #
+    #   python Final_Code/datacache.py lab9_square_flight4.json Final_Code/1206_default_observer_hover5.json
+    #
+    import tempfile
+    from analysis import load_hardware_data
+    from frames import default_observer_velocity
+    from observer import load_observer_data, notebook_gain, update_matrices, run_observer
+
+    def notebook_velocities(filename, only_in_flight=True):
+        return default_observer_velocity(load_hardware_data(filename, only_in_flight=only_in_flight))
+
+    def notebook_observer(filename, L):
+        data = load_observer_data(filename, model='lighthouse')
+        M, N = update_matrices(L)
+        estimates, rmse = run_observer(M, N, data['z'], true=data['true'])
+        return {'time': data['time'], 'estimates': estimates, 'rmse': rmse}
+
+    def notebook(filenames, cache=None):
+        f = [load_hardware_data, notebook_velocities, notebook_observer]
+        if cache is not None:
+            f = [cached(g, cache=cache) for g in f]
+        for filename in filenames:
+            f[0](filename, only_in_flight=True)
+            f[1](filename)
+            f[2](filename, notebook_gain())
+
+    filenames = sys.argv[1:] or ['lab9_square_flight4.json', 'Final_Code/1206_default_observer_hover5.json']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for label, cache in [('no cache', None), ('cold cache', DataCache(tmpdir)), ('warm cache', DataCache(tmpdir))]:
+            start_time = time.perf_counter()
+            notebook(filenames, cache=cache)
+            print(f'{label:12s} {time.perf_counter() - start_time:8.3f} s')
+        print(f'{len([f for f in os.listdir(tmpdir) if f.endswith(".npz")])} entries, {cache.size() / 1e6:.2f} MB')
@@ -1,16 +1,32 @@
+import os
 import logging
 import time
 import json
+import threading
 import numpy as np
 import cflib.crtp
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie.log import LogConfig
+from log_blocks import CACHE_DIR, RADIO_BUDGET, ctypes_from_toc, pack_by_rate, check_budget
+from telemetry import TelemetryStore
+from flightlog import EXTENSION, write_flight_log
+from packedlog import EXTENSION as PACKED_EXTENSION, write_packed_log
+from streaming import StreamWriter
+from live import LivePublisher
+from health import StreamHealth, print_health, write_health
+from clocksync import ClockSync, host_log, latency_log_rate, latency_summary, print_clock, print_latency
+from setpoints import SetpointScheduler, Hold, Line, Stop
+from glyphs import letter_waypoints, plan_word, fly_word
+from replay import setpoint_variables
+from params import ParamWriter
+from sim import register as register_sim_driver
 
 # Specify the uri of the drone to which we want to connect (if your radio
 # channel is X, the uri should be 'radio://0/X/2M/E7E7E7E7E7')
 uri = 'radio://0/24/2M/E7E7E7E7E7' # <-- FIXME # 24 for SSSH and 48 for NAAG
 
-# Specify the variables we want to log (all at 100 Hz)
+# Specify the variables we want to log (at default_log_rate unless log_rates
+# says otherwise)
 variables = [
     # State estimates (custom observer)
     'ae483log.o_x',
@@ -67,404 +83,363 @@ variables = [
     'motor.m4',
 ]
 
+# Specify the rate (in Hz) at which to log each variable, or each group of
+# variables (the part of the name before the '.'), that should not be logged
+# at default_log_rate. Rates must be 100 Hz divided by a whole number (100,
+# 50, 25, 20, 10, ...) - 100 Hz is the fastest the log subsystem can send.
+default_log_rate = 100
+log_rates = {
+    # Setpoints only change when a new setpoint is sent, so log them slowly
+    # and leave the bandwidth to the IMU and the motor commands
+    'ctrltarget': 10,
+    'ae483log.o_x_des': 10,
+    'ae483log.o_y_des': 10,
+    'ae483log.o_z_des': 10,
+}
+# (SimpleClient(..., measure_latency=True) logs the setpoints at
+# latency_log_rate instead - see clocksync.py)
+
 class SimpleClient:
-    def __init__(self, uri, use_controller=False, use_observer=False):
-        self.init_time = time.time()
-        self.use_controller = use_controller
-        self.use_observer = use_observer
-        self.cf = Crazyflie(rw_cache='./cache')
+    def __init__(self, uri, use_controller=False, use_observer=False, stream_to=None, keep_data=True, setpoint_rate=50., live=None, log_budget=RADIO_BUDGET, measure_latency=False):
+        self._init_state(use_controller=use_controller, use_observer=use_observer, stream_to=stream_to, keep_data=keep_data, live=live, log_budget=log_budget, measure_latency=measure_latency)
+
+        self.cf = Crazyflie(rw_cache=CACHE_DIR)
         self.cf.connected.add_callback(self.connected)
         self.cf.fully_connected.add_callback(self.fully_connected)
         self.cf.connection_failed.add_callback(self.connection_failed)
         self.cf.connection_lost.add_callback(self.connection_lost)
         self.cf.disconnected.add_callback(self.disconnected)
+
+        # Parameter writes go through a queue that does not wait for the
+        # drone to acknowledge them (see params.py)
+        self.params = ParamWriter(self.cf.param)
+
+        # Setpoints are sent from their own thread at setpoint_rate (in Hz) -
+        # move, move_smooth and stop just add segments to its trajectory
+        self.setpoints = SetpointScheduler(self.cf.commander, rate=setpoint_rate)
+
+        # sim:// URIs connect to a simulated drone (see sim.py)
+        if uri.startswith('sim://'):
+            register_sim_driver()
+
         print(f'Connecting to {uri}')
+        self.open_time = time.monotonic()
         self.cf.open_link(uri)
+
+    @classmethod
+    def offline(cls, commander, setpoint_rate=50., **kwargs):
+        # A client that is not connected to anything (e.g., for benchmarks),
+        # that sends its setpoints to commander - kwargs are the same as for
+        # SimpleClient (call create_log_blocks to log as if it had connected)
+        client = cls.__new__(cls)
+        client._init_state(**kwargs)
+        client.params = ParamWriter()
+        client.setpoints = SetpointScheduler(commander, rate=setpoint_rate)
+        return client
+
+    def _init_state(self, use_controller=False, use_observer=False, stream_to=None, keep_data=True, live=None, log_budget=RADIO_BUDGET, measure_latency=False):
+        # Everything a client keeps track of that does not depend on the link
+        # (SimpleClient.offline calls this too)
+        #
+        # If measure_latency is True, the setpoints are logged at
+        # latency_log_rate rather than at their rate in log_rates, so that the
+        # setpoint latency printed by disconnect is less coarse
+        self.log_rates = dict(log_rates)
+        if measure_latency:
+            self.log_rates.update({v: latency_log_rate for source in setpoint_variables.values() for v in source})
+
+        # Make sure that logging every variable at its rate fits in log_budget
+        # radio bytes per second before connecting (the TOC is not known yet,
+        # so this assumes that every variable is 4 bytes, which is the most
+        # any of them can be)
+        check_budget(pack_by_rate(variables, {v: 'float' for v in variables}, rates=self.log_rates, default_rate=default_log_rate), log_budget)
+        self.log_budget = log_budget
+
+        self.init_time = time.time()
+        self.use_controller = use_controller
+        self.use_observer = use_observer
+        # If stream_to is a filename, logged data is also written to that file
+        # during the flight (see streaming.py) - turn off keep_data as well to
+        # stop keeping it in memory for write_data
+        self.stream_to = stream_to
+        self.keep_data = keep_data
+        self.stream = None
+        # If live is a name, logged data is also published in shared memory
+        # under that name, for other processes to watch (see live.py)
+        self.live_name = live
+        self.live = None
+        self.data = TelemetryStore()
+
+        # Rate, dropped packets, callback time and skew of each log block
+        # (see health.py)
+        self.health = {}
+
+        # Offset and drift between the host clock and the drone clock, from
+        # the log packets, and things the host did that are not setpoints or
+        # parameter writes (see mark) - these are written to the flight log
+        # in drone time (see clocksync.py)
+        self.clock = ClockSync()
+        self.marks = []
+
+        # Times (in seconds after open_link) at which each step of connecting
+        # finished, and an event that is set once the drone is ready, i.e.,
+        # once every parameter set in fully_connected has been acknowledged
+        # and every log block has sent its first packet
+        self.timeline = {}
+        self.ready = threading.Event()
+        self.ready_lock = threading.Lock()
+        self.logconfs = []
+        self.waiting_for_logs = set()
+        self.waiting_for_params = True
         self.is_fully_connected = False
-        self.data = {}
+        self.open_time = time.monotonic()
+
+    def _mark(self, event):
+        self.timeline[event] = time.monotonic() - self.open_time
 
     def connected(self, uri):
         print(f'Connected to {uri}')
+        self._mark('connected')
+
+        # Start logging (variables are packed into as few blocks as their
+        # types and rates allow - see log_blocks.py). This is done here rather
+        # than in fully_connected because the log TOC is known by now, so the
+        # log blocks are created while cflib is still reading every parameter.
+        ctypes = ctypes_from_toc(self.cf.log.toc, variables)
+        for v in variables:
+            if v not in ctypes:
+                print(f'Could not log {v} because it is not in the TOC')
+        self.create_log_blocks(ctypes)
+        for logconf in self.logconfs:
+            try:
+                self.cf.log.add_config(logconf)
+                logconf.data_received_cb.add_callback(self.log_data)
+                logconf.error_cb.add_callback(self.log_error)
+                logconf.start()
+            except KeyError as e:
+                print(f'Could not start {logconf.name} because {e}')
+                for v in logconf.variables:
+                    print(f' - {v.name}')
+                self.waiting_for_logs.discard(logconf.name)
+            except AttributeError:
+                print(f'Could not start {logconf.name} because of bad configuration')
+                for v in logconf.variables:
+                    print(f' - {v.name}')
+                self.waiting_for_logs.discard(logconf.name)
+        self._mark('logging started')
+
+    def create_log_blocks(self, ctypes):
+        # Pack the variables that have a type in ctypes into log blocks (as
+        # few as their types and rates allow - see log_blocks.py), and get
+        # ready to store, stream and publish what they log. Returns the
+        # variables of each block.
+        plan = pack_by_rate([v for v in variables if v in ctypes], ctypes, rates=self.log_rates, default_rate=default_log_rate)
+        blocks = [block for period, block in plan]
+        for period, block in plan:
+            self.logconfs.append(LogConfig(name=f'LogConf{len(self.logconfs)}', period_in_ms=period))
+            self.data.add_block(self.logconfs[-1].name, block, period_in_ms=period)
+            self.health[self.logconfs[-1].name] = StreamHealth(self.logconfs[-1].period_in_ms)
+            self.waiting_for_logs.add(self.logconfs[-1].name)
+            for v, fetch_as in block:
+                self.logconfs[-1].add_variable(v, fetch_as)
+        if self.stream_to is not None:
+            self.stream = StreamWriter(
+                self.stream_to,
+                [(logconf.name, block) for logconf, block in zip(self.logconfs, blocks)],
+                periods=[logconf.period_in_ms for logconf in self.logconfs],
+            )
+        if self.live_name is not None:
+            self.live = LivePublisher(self.live_name, [(logconf.name, block) for logconf, block in zip(self.logconfs, blocks)])
+        return blocks
 
     def fully_connected(self, uri):
         print(f'Fully connected to {uri}')
         self.is_fully_connected = True
+        self._mark('fully connected')
+
+        # Set all parameters at once (they are all queued right away, and
+        # cflib sends each one as soon as the one before it has been
+        # acknowledged)
+        params = {}
 
         # Reset the default observer
-        self.cf.param.set_value('kalman.resetEstimation', 1)
+        params['kalman.resetEstimation'] = 1
 
         # Reset the ae483 observer
-        self.cf.param.set_value('ae483par.reset_observer', 1)
+        params['ae483par.reset_observer'] = 1
 
         # Enable the controller (1 for default controller, 4 for ae483 controller)
         if self.use_controller:
-            self.cf.param.set_value('stabilizer.controller', 4)
-            self.cf.param.set_value('powerDist.motorSetEnable', 1)
+            params['stabilizer.controller'] = 4
+            params['powerDist.motorSetEnable'] = 1
         else:
-            self.cf.param.set_value('stabilizer.controller', 1)
-            self.cf.param.set_value('powerDist.motorSetEnable', 0)
+            params['stabilizer.controller'] = 1
+            params['powerDist.motorSetEnable'] = 0
 
         # Enable the observer (0 for disable, 1 for enable)
         if self.use_observer:
-            self.cf.param.set_value('ae483par.use_observer', 1)
+            params['ae483par.use_observer'] = 1
         else:
-            self.cf.param.set_value('ae483par.use_observer', 0)
+            params['ae483par.use_observer'] = 0
 
-        # Start logging
-        self.logconfs = []
-        self.logconfs.append(LogConfig(name=f'LogConf0', period_in_ms=10))
-        num_variables = 0
-        for v in variables:
-            num_variables += 1
-            if num_variables > 5: # <-- could increase if you paid attention to types / sizes (max 30 bytes per packet)
-                num_variables = 0
-                self.logconfs.append(LogConfig(name=f'LogConf{len(self.logconfs)}', period_in_ms=10))
-            self.data[v] = {'time': [], 'data': []}
-            self.logconfs[-1].add_variable(v)
-        for logconf in self.logconfs:
+        waiting = set(params)
+
+        def param_acknowledged(name):
+            waiting.discard(name)
+            if not waiting:
+                self.waiting_for_params = False
+                self._mark('parameters acknowledged')
+                self._check_ready()
+
+        for name, value in params.items():
             try:
-                self.cf.log.add_config(logconf)
-                logconf.data_received_cb.add_callback(self.log_data)
-                logconf.error_cb.add_callback(self.log_error)
-                logconf.start()
-            except KeyError as e:
-                print(f'Could not start {logconf.name} because {e}')
-                for v in logconf.variables:
-                    print(f' - {v.name}')
-            except AttributeError:
-                print(f'Could not start {logconf.name} because of bad configuration')
-                for v in logconf.variables:
-                    print(f' - {v.name}')
+                self.params.set(name, value, on_ack=lambda value_s, name=name: param_acknowledged(name))
+            except Exception as e:
+                # (so that wait_until_ready does not wait for it forever)
+                print(f'Could not set {name} because {e!r}')
+                param_acknowledged(name)
+
+    def _check_ready(self):
+        # (called from the threads of both log packets and parameters)
+        with self.ready_lock:
+            if self.ready.is_set() or self.waiting_for_params or self.waiting_for_logs:
+                return
+            self._mark('ready')
+            self.ready.set()
+        steps = ', '.join(f'{event} {t:.3f} s' for event, t in self.timeline.items() if event != 'ready')
+        print(f'Ready {self.timeline["ready"]:.3f} seconds after opening the link ({steps})')
+
+    def wait_until_ready(self, timeout=None):
+        # Wait until the drone is ready (see __init__) - returns False if it
+        # was not ready within timeout seconds
+        return self.ready.wait(timeout=timeout)
 
     def connection_failed(self, uri, msg):
         print(f'Connection to {uri} failed: {msg}')
 
     def connection_lost(self, uri, msg):
         print(f'Connection to {uri} lost: {msg}')
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception as e:
+                print(f'Could not finish writing {self.stream.filename} because {e!r}')
 
     def disconnected(self, uri):
         print(f'Disconnected from {uri}')
         self.is_fully_connected = False
 
     def log_data(self, timestamp, data, logconf):
-        for v in logconf.variables:
-            self.data[v.name]['time'].append(timestamp)
-            self.data[v.name]['data'].append(data[v.name])
+        received = time.perf_counter()
+        self.clock.update(timestamp, time.monotonic())
+        if self.keep_data:
+            self.data.append(logconf.name, timestamp, data)
+        if self.stream is not None and self.stream.error is None:
+            self.stream.push(logconf.name, timestamp, data)
+        if self.live is not None:
+            self.live.push(logconf.name, timestamp, data)
+        self.health[logconf.name].update(timestamp, received, time.perf_counter() - received)
+        if self.waiting_for_logs and logconf.name in self.waiting_for_logs:
+            self.waiting_for_logs.discard(logconf.name)
+            if not self.waiting_for_logs:
+                self._mark('first packets')
+                self._check_ready()
+
+    def stream_health(self):
+        # Health of each log block so far (this can be called at any time,
+        # including during the flight)
+        return {name: health.summary() for name, health in self.health.items()}
+
+    def mark(self, name, value=1.):
+        # Record that something happened now (it is written to the flight log
+        # as host.mark.<name>, in drone time)
+        self.marks.append((time.monotonic(), name, value))
+
+    def drone_time(self, host_time=None):
+        # Drone time (ms, like the logged 'time') at host_time (from
+        # time.monotonic), or now - only known once logging has started
+        if not self.clock.is_ready():
+            return None
+        return float(self.clock.to_drone(time.monotonic() if host_time is None else host_time))
+
+    def host_data(self):
+        # Setpoints sent, parameters written and marks so far, in drone time
+        # (see clocksync.py). The radio delay is taken to be half of the
+        # fastest parameter write round trip.
+        round_trips = [w['acknowledged'] - w['sent'] for w in self.params.history]
+        if round_trips:
+            self.clock.delay = min(round_trips) / 2.
+        writes = self.params.history + list(self.params.in_flight.values())
+        return host_log(self.clock, self.setpoints.sent, writes, self.marks, setpoint_period_in_ms=int(round(1000. * self.setpoints.period)))
 
     def log_error(self, logconf, msg):
         print(f'Error when logging {logconf}: {msg}')
 
     def move(self, x, y, z, yaw, dt):
         print(f'Move to {x}, {y}, {z} with yaw {yaw} degrees for {dt} seconds')
-        start_time = time.time()
-        while time.time() - start_time < dt:
-            self.cf.commander.send_position_setpoint(x, y, z, yaw)
-            time.sleep(0.1)
+        self.setpoints.run(Hold(x, y, z, yaw, dt))
 
     def move_smooth(self, p1, p2, yaw, speed):
         print(f'Move smoothly from {p1} to {p2} with yaw {yaw} degrees at {speed} meters / second')
-        p1 = np.array(p1)
-        p2 = np.array(p2)
-
-        # Compute distance from p1 to p2
-        distance_from_p1_to_p2 = np.linalg.norm(p2-p1) # <-- FIXME (B)
-
-        # Compute time it takes to move from p1 to p2 at desired speed
-        time_from_p1_to_p2 = distance_from_p1_to_p2 / speed # <-- FIXME (C)
-
-        start_time = time.time()
-        while True:
-            current_time = time.time()
-
-            # Compute what fraction of the distance from p1 to p2 should have
-            # been travelled by the current time
-            s = (current_time - start_time) / time_from_p1_to_p2 # <-- FIXME (D)
-
-            # Compute where the drone should be at the current time, in the
-            # coordinates of the world frame
-            p = (1-s) * p1 + s * p2 # <-- FIXME (E)
-
-            self.cf.commander.send_position_setpoint(p[0], p[1], p[2], yaw)
-            if s >= 1:
-                return
-            else:
-                time.sleep(0.1)
+        self.setpoints.run(Line(p1, p2, yaw, speed))
 
     def stop(self, dt):
         print(f'Stop for {dt} seconds')
-        self.cf.commander.send_stop_setpoint()
-        start_time = time.time()
-        while time.time() - start_time < dt:
-            time.sleep(0.1)
+        self.setpoints.run(Stop(dt))
 
     def disconnect(self):
+        self.setpoints.close()
+        self.params.print_stats()
+        print_health(self.stream_health())
+        host_data = self.host_data()
+        print_clock(self.clock.summary())
+        if self.keep_data:
+            print_latency(latency_summary(self.data.merged(host_data)))
         self.cf.close_link()
+        if self.live is not None:
+            self.live.close()
+        # (last, since it raises if writing the stream failed)
+        if self.stream is not None:
+            self.stream.close()
+
+    def write_data(self, filename='logged_data.json', binary=None):
+        # Write JSON, or the binary format in flightlog.py if binary is True
+        # (by default, binary is used only if filename ends with .aelog), or
+        # the compressed format in packedlog.py if filename ends with .aepack.
+        # The health of each log block goes next to it, in name.health.json.
+        if self.health:
+            write_health(os.path.splitext(filename)[0] + '.health.json', self.stream_health())
+        if binary is None:
+            binary = filename.endswith(EXTENSION)
+        # (with the setpoints, parameter writes and marks in drone time)
+        data = self.data.merged(self.host_data())
+        if filename.endswith(PACKED_EXTENSION):
+            write_packed_log(filename, data)
+        elif binary:
+            write_flight_log(filename, data)
+        else:
+            with open(filename, 'w') as outfile:
+                json.dump(data.to_dict(), outfile, indent=4, sort_keys=False)
 
-    def write_data(self, filename='logged_data.json'):
-        with open(filename, 'w') as outfile:
-            json.dump(self.data, outfile, indent=4, sort_keys=False)
-
-
-def letter_move(char, x_pos, x_dim, z_dim):
-  # convert letter to uppercase
-  char = char.upper()
 
-  # define some universal parameters
+def letter_move(char, x_pos, x_dim, z_dim, drone=None):
+  # fly one letter stroke by stroke (the strokes of each letter are in glyphs.py)
+  # with drone, or with the client in __main__ if drone is not given
+  if drone is None:
+    drone = client
   yaw = 0.0
   dt = 0.2
-  # speed = 2.0
-
-  # define some location parameters
-  x_left = 0.0*x_dim + x_pos
-  x_mid = 0.5*x_dim + x_pos
-  x_right = x_dim + x_pos
-  # z_low = 0.5
-  # z_mid = 0.5*z_dim + z_low
-  # z_hi = z_dim + z_low
-
-  if(char == 'A'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth( [x_left,          0.0, 0.5], [x_mid,           0.0, 1.0], yaw, dt)
-    client.move_smooth( [x_mid,           0.0, 1.0], [x_right,         0.0, 0.5], yaw, dt)
-    client.move_smooth( [x_right,         0.0, 0.5], [0.8*x_dim+x_pos, 0.0, 0.7], yaw, dt)
-    client.move_smooth( [0.8*x_dim+x_pos, 0.0, 0.7], [0.4*x_dim+x_pos, 0.0, 0.7], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth( [0.4*x_dim+x_pos, 0.0, 0.7], [x_right,         0.0, 0.5], yaw, dt) #lr corner
-
-  if(char == 'B'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth( [x_left,          0.0, 0.5], [x_left,          0.0, 1.0], yaw, dt)
-    client.move_smooth( [x_left,          0.0, 1.0], [0.8*x_dim+x_pos, 0.0, 1.0], yaw, dt)
-    client.move_smooth( [0.8*x_dim+x_pos, 0.0, 1.0], [0.8*x_dim+x_pos, 0.0, 0.5], yaw, dt)
-    client.move_smooth( [0.8*x_dim+x_pos, 0.0, 0.5], [x_left,          0.0, 0.5], yaw, dt)
-    client.move_smooth( [x_left,          0.0, 0.5], [x_left,          0.0, 0.8], yaw, dt)
-    client.move_smooth( [x_left,          0.0, 0.8], [0.8*x_dim+x_pos, 0.0, 0.8], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth( [0.8*x_dim+x_pos, 0.0, 0.8], [x_right,         0.0, 0.5], yaw, dt) #lr corner
-
-  if(char == 'C'):
-    client.move_smooth( [x_left,  0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth( [x_right, 0.0, 1.0], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth( [x_left,  0.0, 1.0], [x_left,  0.0, 0.5], yaw, dt)
-    client.move_smooth( [x_left,  0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-
-  if(char == 'D'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.5 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-
-  if(char == 'E'):
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_left,  0.0, 0.5 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 0.5 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 0.5 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-
-  if(char == 'F'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-
-  if(char == 'G'):
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_left,  0.0, 0.5 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 0.5 ], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_mid,   0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_mid,   0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-
-  if(char == 'H'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_left,  0.0, 0.75], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-
-  if(char == 'I'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 0.5], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5], [x_mid,   0.0, 0.5], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 0.5], [x_mid,   0.0, 1.0], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 1.0], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-
-  if(char == 'J'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_mid,   0.0, 0.5], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 0.5], [x_mid,   0.0, 1.0], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 1.0], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-
-  if(char == 'K'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_left,  0.0, 0.75], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-
-  if(char == 'L'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left, 0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left, 0.0, 1.0], [x_left,  0.0, 0.5], yaw, dt)
-    client.move_smooth([x_left, 0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-
-  if(char == 'M'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0], [x_mid,   0.0, 0.5], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-
-  if(char == 'N'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-
-  if(char == 'O'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 1.0], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5], [x_left,  0.0, 0.5], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'P'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-  
-  if(char == 'Q'):
-    client.move_smooth([x_left,          0.0, 0.5], [x_left,          0.0, 0.6], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,          0.0, 0.6], [x_left,          0.0, 1.0], yaw, dt)
-    client.move_smooth([x_left,          0.0, 1.0], [0.8*x_dim+x_pos, 0.0, 1.0], yaw, dt)
-    client.move_smooth([0.8*x_dim+x_pos, 0.0, 1.0], [0.8*x_dim+x_pos, 0.0, 0.6], yaw, dt)
-    client.move_smooth([0.8*x_dim+x_pos, 0.0, 0.6], [x_left,          0.0, 0.6], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_left,          0.0, 0.6], [0.4*x_dim+x_pos, 0.0, 0.8], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([0.4*x_dim+x_pos, 0.0, 0.8], [x_right,         0.0, 0.5], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-  
-  if(char == 'R'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.75], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-  
-  if(char == 'S'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 0.5 ], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5 ], [x_right, 0.0, 0.75], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.75], [x_left,  0.0, 0.75], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.75], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-  
-  if(char == 'T'):
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 1.0], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0], [x_mid,   0.0, 1.0], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 1.0], [x_mid,   0.0, 0.5], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_mid,   0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'U'):
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0], [x_left,  0.0, 0.5], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt)
-    client.move_smooth([x_right, 0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'V'):
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0], [x_mid,   0.0, 0.5], yaw, dt)
-    client.move_smooth([x_mid,   0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'W'):
-    client.move_smooth([x_left,           0.0, 0.5], [x_left,           0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,           0.0, 1.0], [0.25*x_dim+x_pos, 0.0, 0.5], yaw, dt)
-    client.move_smooth([0.25*x_dim+x_pos, 0.0, 0.5], [x_right,          0.0, 1.0], yaw, dt)
-    client.move_smooth([x_right,          0.0, 1.0], [0.75*x_dim+x_pos, 0.0, 0.5], yaw, dt)
-    client.move_smooth([0.75*x_dim+x_pos, 0.0, 0.5], [x_right,          0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right,          0.0, 1.0], [x_right,          0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'X'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5], [x_right, 0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0], [x_left,  0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 0.5], yaw, dt) #lr corner
-  
-  if(char == 'Y'):
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 0.5 ], [x_right, 0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_right, 0.0, 1.0 ], [x_left,  0.0, 1.0 ], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0 ], [x_mid,   0.0, 0.75], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
-    client.move_smooth([x_mid,   0.0, 0.75], [x_right, 0.0, 0.5 ], yaw, dt) #lr corner
-  
-  if(char == 'Z'):
-    client.move_smooth([x_left,  0.0, 0.5], [x_left,  0.0, 1.0], yaw, dt)
-    client.cf.param.set_value('ring.headlightEnable', 1) # Headlights on
-    client.move_smooth([x_left,  0.0, 1.0], [x_right, 0.0, 1.0], yaw, dt)
-    client.move_smooth([x_right, 0.0, 1.0], [x_left,  0.0, 0.5], yaw, dt)
-    client.move_smooth([x_left,  0.0, 0.5], [x_right, 0.0, 0.5], yaw, dt) #lr corner 
-    client.cf.param.set_value('ring.headlightEnable', 0) # Headlights off
+
+  light = 0
+  p1 = [x_pos, 0.0, 0.5]
+  for p2, pen in letter_waypoints(char, x_pos, x_dim):
+    if pen != light:
+      drone.params.set('ring.headlightEnable', pen) # Headlights on / off
+      light = pen
+    drone.move_smooth(p1, p2, yaw, dt)
+    p1 = p2
+  if light:
+    drone.params.set('ring.headlightEnable', 0) # Headlights off
 
 if __name__ == '__main__':
     # Initialize everything
@@ -473,17 +448,19 @@ if __name__ == '__main__':
 
     # Create and start the client that will connect to the drone
     client = SimpleClient(uri, use_controller=True, use_observer=False) # <-- FIXME
-    while not client.is_fully_connected:
-        time.sleep(0.1)
+    client.wait_until_ready()
 
     # Allows lighthouse.x .y .z to be logged? 
-    client.cf.param.set_value('lighthouse.method', 0)
+    client.params.set('lighthouse.method', 0)
 
     # [added for using the lighthouse] Allows the Kalman Filter to be used in the state estimation
-    client.cf.param.set_value('stabilizer.estimator', 2)
+    client.params.set('stabilizer.estimator', 2)
 
-    # Leave time at the start to initialize
-    client.stop(1.0)
+    # Leave time at the start to initialize (until both parameters above have
+    # been acknowledged, rather than for a fixed second), and start from zero
+    # motor commands
+    client.params.wait()
+    client.stop(0.1)
 
     # # Insert move commands here...
     print('hello world')
@@ -576,16 +553,27 @@ if __name__ == '__main__':
     
     drone_speed = 0.2 # in m/s
 
+    # plan the whole word as one trajectory before taking off (with the
+    # strokes in each letter, and the way from one letter to the next, that
+    # fly the least distance with the headlights off - see glyphs.py)
+    word = plan_word(name_string, starting_position, left_shift, spacing=0.1, speed=drone_speed, z_dim=vertical_shift)
+
     # take off from origin and move to starting position 
     client.move_smooth([0, 0.0, 0.10], [iterator, 0.0, 0.30], 0.0, drone_speed)
 
-    for i in input_list:
-        letter_move(i, iterator, left_shift, vertical_shift)
-        iterator = iterator+left_shift+0.1
-        client.move(iterator, 0, 0.5, 0,2.0)
+    # fly every letter without stopping in between (the word ends wherever
+    # its last stroke does)
+    fly_word(client, word)
+    iterator, _, z_end = word.p[-1]
+
+    # # (or one letter at a time, with a hover between letters)
+    # for i in input_list:
+    #     letter_move(i, iterator, left_shift, vertical_shift)
+    #     iterator = iterator+left_shift+0.1
+    #     client.move(iterator, 0, 0.5, 0,2.0)
 
     #Return to origin to Land
-    client.move_smooth([iterator, 0.0, 0.5], [iterator, 0.0, 0.15], 0.0, drone_speed)
+    client.move_smooth([iterator, 0.0, z_end], [iterator, 0.0, 0.15], 0.0, drone_speed)
     client.move_smooth([iterator, 0.0, 0.15], [0, 0.0, 0.15], 0.0, drone_speed)
     print('goodbye world')
     ## - FINAL PROJECT: Speall a word ^^^^^^^^^^^^^^^^^^^^^^^
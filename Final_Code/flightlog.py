@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import re
+import mmap
+import time
+import struct
+from collections.abc import Mapping
+import numpy as np
+
+# Binary flight log format (version 1)
+#
+#   header      8-byte magic, uint16 version, uint16 reserved, uint32 length
+#               of the table, all little-endian
+#   table       utf-8 JSON list of log blocks, each of which looks like
+#               {'name': 'LogConf0', 'count': 1234, 'period_in_ms': 10, 'time': {'dtype': '<i4', 'offset': 4096},
+#                'variables': [{'name': 'ae483log.o_x', 'dtype': '<f4', 'offset': 13968}, ...]}
+#   columns     one contiguous little-endian array per timestamp vector and
+#               per variable, each starting at an 8-byte aligned offset
+#
+# Every variable in a block shares the block's timestamp vector, so reading
+# a file gives the same {'time': ..., 'data': ..., 'period_in_ms': ...} layout
+# as the JSON logs. Logs written before variables could be logged at
+# different rates have no 'period_in_ms' (in either format), and were all
+# logged every DEFAULT_PERIOD_IN_MS.
+MAGIC = b'AE483LOG'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+ALIGN = 8
+EXTENSION = '.aelog'
+DEFAULT_PERIOD_IN_MS = 10
+# Variables whose names start with HOST_PREFIX were not logged by the drone:
+# they are things the host did (setpoints sent, parameters written, ...) at
+# the drone time at which they happened (see clocksync.py)
+HOST_PREFIX = 'host.'
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _smallest_dtype(values):
+    # Smallest little-endian dtype that holds every value exactly (logs that
+    # went through JSON have lost their original types)
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.dtype('<f4')
+    if np.issubdtype(values.dtype, np.integer):
+        for dtype in ['<u2', '<u4', '<i4', '<i8']:
+            info = np.iinfo(dtype)
+            if values.min() >= info.min and values.max() <= info.max:
+                return np.dtype(dtype)
+    values = values.astype(np.float64)
+    if np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True):
+        return np.dtype('<f4')
+    return np.dtype('<f8')
+
+
+def blocks_from_data(data):
+    # Turn logged data into a list of (block name, time, [(variable, values)], period in ms)
+    # from either a TelemetryStore (which already knows its blocks) or a dict
+    # in the JSON layout (in which case variables with identical timestamps
+    # are put in the same block)
+    if hasattr(data, 'blocks'):
+        return [
+            (name, block.get_time(), [(v, block.get_data(v)) for v in block.names], block.period_in_ms)
+            for name, block in data.blocks.items()
+        ]
+    blocks = {}
+    for v, val in data.items():
+        t = np.asarray(val['time'], dtype=np.int64)
+        period = val.get('period_in_ms', DEFAULT_PERIOD_IN_MS)
+        key = (len(t), t.tobytes(), period)
+        if key not in blocks:
+            blocks[key] = (f'LogConf{len(blocks)}', t, [], period)
+        values = np.asarray(val['data'])
+        blocks[key][2].append((v, values.astype(_smallest_dtype(values))))
+    return list(blocks.values())
+
+
+def write_flight_log(filename, data):
+    # Lay out the table first (it needs to know where every column goes,
+    # which depends on the length of the table itself)
+    blocks = blocks_from_data(data)
+    columns = []
+    table = []
+    for name, t, variables, period in blocks:
+        # Drone timestamps are milliseconds since boot, so they fit in 32 bits
+        # unless the drone has been on for almost a month
+        t = np.asarray(t, dtype=np.int64)
+        time_dtype = '<i4' if len(t) == 0 or t.max() <= np.iinfo(np.int32).max else '<i8'
+        entry = {'name': name, 'count': len(t), 'period_in_ms': period, 'time': {'dtype': time_dtype}, 'variables': []}
+        columns.append((entry['time'], t.astype(time_dtype)))
+        for v, values in variables:
+            values = np.asarray(values)
+            values = values.astype(values.dtype.newbyteorder('<'))
+            var_entry = {'name': v, 'dtype': values.dtype.str}
+            entry['variables'].append(var_entry)
+            columns.append((var_entry, values))
+        table.append(entry)
+
+    table_length = 0
+    while True:
+        offset = _align(HEADER.size + table_length)
+        for entry, values in columns:
+            entry['offset'] = offset
+            offset = _align(offset + values.nbytes)
+        table_bytes = json.dumps(table).encode('utf-8')
+        if len(table_bytes) <= table_length:
+            break
+        table_length = len(table_bytes)
+    table_bytes = table_bytes.ljust(table_length)
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, table_length))
+        f.write(table_bytes)
+        for entry, values in columns:
+            f.write(b'\0' * (entry['offset'] - f.tell()))
+            f.write(values.tobytes())
+
+
+class FlightLog(Mapping):
+    # Memory-mapped binary flight log. Indexing by variable name gives
+    # {'time': ..., 'data': ..., 'period_in_ms': ...} where 'time' and 'data'
+    # are read-only numpy views of the file (nothing is read from disk until
+    # the arrays are used).
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, table_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a binary flight log')
+        if version != VERSION:
+            raise ValueError(f'{filename} has version {version} but only version {VERSION} is supported')
+        self.blocks = json.loads(self.buffer[HEADER.size:HEADER.size + table_length])
+        self.variables = {}
+        for block in self.blocks:
+            for var in block['variables']:
+                self.variables[var['name']] = (block, var)
+
+    def _column(self, entry, count):
+        return np.frombuffer(self.buffer, dtype=entry['dtype'], count=count, offset=entry['offset'])
+
+    def get_time(self, v):
+        block, var = self.variables[v]
+        return self._column(block['time'], block['count'])
+
+    def get_data(self, v):
+        block, var = self.variables[v]
+        return self._column(var, block['count'])
+
+    def get_period(self, v):
+        block, var = self.variables[v]
+        return block.get('period_in_ms', DEFAULT_PERIOD_IN_MS)
+
+    def __getitem__(self, v):
+        return {'time': self.get_time(v), 'data': self.get_data(v), 'period_in_ms': self.get_period(v)}
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+    def to_dict(self):
+        return {
+            v: {'time': val['time'].tolist(), 'data': val['data'].tolist(), 'period_in_ms': val['period_in_ms']}
+            for v, val in self.items()
+        }
+
+
+def read_flight_log(filename):
+    return FlightLog(filename)
+
+
+# One variable of a JSON flight log (as written by write_data), i.e., the
+# key and the start of its {'time': [...], 'data': [...]}
+_json_key = re.compile(rb'\s*,?\s*"([^"\\]*)"\s*:\s*(\{)')
+_json_end = re.compile(rb'\s*\}')
+
+
+def _scan_json_log(buffer):
+    # Where the value of each variable starts and ends in a JSON flight log,
+    # found without parsing any numbers. Raises ValueError if the file does
+    # not look like a flight log (e.g., if a value has nested objects).
+    offsets = {}
+    position = buffer.find(b'{')
+    if position < 0:
+        raise ValueError('not a JSON object')
+    position += 1
+    while True:
+        match = _json_key.match(buffer, position)
+        if match is None:
+            if _json_end.match(buffer, position) is None:
+                raise ValueError(f'unexpected content at byte {position}')
+            return offsets
+        start = match.start(2)
+        end = buffer.find(b'}', start) + 1
+        if end == 0 or buffer.find(b'{', start + 1, end) >= 0:
+            raise ValueError(f'unexpected value at byte {start}')
+        offsets[match.group(1).decode('utf-8')] = (start, end)
+        position = end
+
+
+class JsonFlightLog(Mapping):
+    # JSON flight log that is only parsed as far as it is used: opening it
+    # finds where each variable is in the (memory-mapped) file, and each
+    # variable is parsed into arrays the first time it is accessed. Loading a
+    # few variables therefore takes time and memory in proportion to those
+    # variables rather than to the whole file.
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = _scan_json_log(self.buffer)
+        self.loaded = {}
+
+    def __getitem__(self, v):
+        if v not in self.loaded:
+            start, end = self.offsets[v]
+            val = json.loads(self.buffer[start:end])
+            self.loaded[v] = {
+                'time': np.array(val['time']),
+                'data': np.array(val['data']),
+                'period_in_ms': val.get('period_in_ms', DEFAULT_PERIOD_IN_MS),
+            }
+        return self.loaded[v]
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def to_dict(self):
+        return {
+            v: {'time': val['time'].tolist(), 'data': val['data'].tolist(), 'period_in_ms': val['period_in_ms']}
+            for v, val in self.items()
+        }
+
+
+def load_flight_log(filename, lazy=False):
+    # Load a flight log in any format, based on its extension (binary and
+    # packed logs are always lazy, and JSON logs are too if lazy is True)
+    if filename.endswith(EXTENSION):
+        return read_flight_log(filename)
+    from packedlog import EXTENSION as PACKED_EXTENSION, read_packed_log
+    if filename.endswith(PACKED_EXTENSION):
+        return read_packed_log(filename)
+    if lazy:
+        try:
+            return JsonFlightLog(filename)
+        except ValueError:
+            # (not laid out the way write_data writes it, so parse all of it)
+            pass
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def load_channels(filename, variables=None, time_window=None, return_span=False):
+    # Load only some variables (all of them by default) of a flight log, and
+    # only between time_window = (start, end) in seconds if it is given. The
+    # time window is on the same axis as the 'time' that load_hardware_data
+    # would return for these variables, i.e., 0 is when the last of them
+    # (other than host events, which do not cover the whole flight) started
+    # being logged. A sample on either side of the window is kept so
+    # that the window can still be resampled right up to its edges. With
+    # return_span, also returns the drone times (ms) at which the last of
+    # these variables started being logged and the first of them stopped,
+    # over the whole flight (for resample_flight_data in analysis.py).
+    log = load_flight_log(filename, lazy=True)
+    if variables is None:
+        variables = list(log.keys())
+    timed = [v for v in variables if not v.startswith(HOST_PREFIX)] or variables
+    if time_window is None or not variables:
+        data = {v: log[v] for v in variables}
+        if not return_span:
+            return data
+        span = (max(data[v]['time'][0] for v in timed), min(data[v]['time'][-1] for v in timed)) if variables else None
+        return data, span
+    start, end = time_window
+    if hasattr(log, 'window'):
+        # (packed logs only decompress the chunks around the window)
+        span = (max(log.first_time(v) for v in timed), min(log.last_time(v) for v in timed))
+        data = {v: log.window(v, span[0] + start * 1000., span[0] + end * 1000.) for v in variables}
+    else:
+        data = {v: log[v] for v in variables}
+        span = (max(data[v]['time'][0] for v in timed), min(data[v]['time'][-1] for v in timed))
+    for v, val in data.items():
+        t = (np.asarray(val['time']) - span[0]) / 1000.
+        i0 = max(np.searchsorted(t, start, side='left') - 1, 0)
+        i1 = min(np.searchsorted(t, end, side='right') + 1, len(t))
+        data[v] = {'time': val['time'][i0:i1], 'data': val['data'][i0:i1], 'period_in_ms': val.get('period_in_ms', DEFAULT_PERIOD_IN_MS)}
+    return (data, span) if return_span else data
+
+
+if __name__ == '__main__':
+    # Convert JSON flight logs to the binary format and compare them, e.g.,
+    #
+    #   python Final_Code/flightlog.py NOOR_flight_4.json N_data.json
+    #
+    for json_filename in sys.argv[1:]:
+        binary_filename = os.path.splitext(json_filename)[0] + EXTENSION
+
+        start_time = time.perf_counter()
+        with open(json_filename, 'r') as f:
+            data = json.load(f)
+        json_arrays = {k: (np.array(v['time']), np.array(v['data'])) for k, v in data.items()}
+        json_time = time.perf_counter() - start_time
+
+        write_flight_log(binary_filename, data)
+
+        start_time = time.perf_counter()
+        log = read_flight_log(binary_filename)
+        binary_arrays = {k: (log.get_time(k), log.get_data(k)) for k in log}
+        binary_time = time.perf_counter() - start_time
+
+        for k, (t, d) in json_arrays.items():
+            assert np.array_equal(t, binary_arrays[k][0]) and np.array_equal(d, binary_arrays[k][1]), k
+
+        json_size = os.path.getsize(json_filename)
+        binary_size = os.path.getsize(binary_filename)
+        print(f'{json_filename} -> {binary_filename}')
+        print(f' size: {json_size / 1e6:8.3f} MB -> {binary_size / 1e6:8.3f} MB ({json_size / binary_size:5.1f}x smaller)')
+        print(f' load: {json_time * 1e3:8.3f} ms -> {binary_time * 1e3:8.3f} ms ({json_time / binary_time:5.1f}x faster)')
@@ -0,0 +1,109 @@
+import numpy as np
+
+# Coordinate transformations between the world frame (frame 0) and the body
+# frame of the drone (frame 1) for every sample of a flight at once, e.g.,
+#
+#   from analysis import load_hardware_data
+#   from frames import default_observer_velocity
+#   data = load_hardware_data('lab9_square_flight4.json', only_in_flight=True)
+#   v_x_default, v_y_default, v_z_default = default_observer_velocity(data)
+#
+# which gives the same result as the "apply coordinate transformation at each
+# time step" loop in the notebooks. Angles follow the notebooks: R_1in0 is
+# Rz(psi) @ Ry(theta) @ Rx(phi), and the default observer logs yaw, pitch and
+# roll in degrees with the sign of pitch reversed.
+
+
+def R_1in0(psi, theta, phi):
+    # Orientation of the drone (frame 1 in the coordinates of frame 0) - the
+    # same matrix as R_1in0 in the notebooks, for scalars (shape (3, 3)) or for
+    # arrays of angles (shape (..., 3, 3))
+    c_psi, s_psi = np.cos(psi), np.sin(psi)
+    c_theta, s_theta = np.cos(theta), np.sin(theta)
+    c_phi, s_phi = np.cos(phi), np.sin(phi)
+    R = np.empty(np.broadcast(psi, theta, phi).shape + (3, 3))
+    R[..., 0, 0] = c_psi * c_theta
+    R[..., 0, 1] = c_psi * s_theta * s_phi - s_psi * c_phi
+    R[..., 0, 2] = c_psi * s_theta * c_phi + s_psi * s_phi
+    R[..., 1, 0] = s_psi * c_theta
+    R[..., 1, 1] = s_psi * s_theta * s_phi + c_psi * c_phi
+    R[..., 1, 2] = s_psi * s_theta * c_phi - c_psi * s_phi
+    R[..., 2, 0] = -s_theta
+    R[..., 2, 1] = c_theta * s_phi
+    R[..., 2, 2] = c_theta * c_phi
+    return R
+
+
+def world_to_body(v_in0, psi, theta, phi):
+    # R_1in0(psi, theta, phi).T @ v_in0 for each sample, where v_in0 has one
+    # row (x, y, z) per sample - e.g., velocities or accelerations
+    return np.einsum('...ji,...j->...i', R_1in0(psi, theta, phi), v_in0)
+
+
+def body_to_world(v_in1, psi, theta, phi):
+    # R_1in0(psi, theta, phi) @ v_in1 for each sample (the inverse of
+    # world_to_body)
+    return np.einsum('...ij,...j->...i', R_1in0(psi, theta, phi), v_in1)
+
+
+def default_observer_angles(data):
+    # Yaw, pitch and roll from the default observer as psi, theta and phi in
+    # radians (note: the sign of pitch is reverse of AE483's convention)
+    psi = np.deg2rad(data['stateEstimate.yaw'])
+    theta = - np.deg2rad(data['stateEstimate.pitch'])
+    phi = np.deg2rad(data['stateEstimate.roll'])
+    return psi, theta, phi
+
+
+def default_observer_velocity(data):
+    # Velocity from the default observer (which is in the world frame) in the
+    # body frame, as three arrays v_x, v_y, v_z
+    return default_observer_in_body(data, ['stateEstimate.vx', 'stateEstimate.vy', 'stateEstimate.vz'])
+
+
+def default_observer_in_body(data, keys):
+    # Any vector the default observer logs in the world frame (e.g.,
+    # ['stateEstimate.ax', 'stateEstimate.ay', 'stateEstimate.az']) in the
+    # body frame, as one array per component
+    v_in0 = np.stack([data[k] for k in keys], axis=-1)
+    v_in1 = world_to_body(v_in0, *default_observer_angles(data))
+    return v_in1[:, 0], v_in1[:, 1], v_in1[:, 2]
+
+
+if __name__ == '__main__':
+    # Compare against the loop in the notebooks, e.g.,
+    #
+    #   python Final_Code/frames.py lab9_square_flight4.json
+    #
+    import sys
+    import time
+    from analysis import load_hardware_data
+
+    def R_1in0_loop(psi, theta, phi):
+        # (what sym.lambdify makes of Rz @ Ry @ Rx in the notebooks)
+        Rz = np.array([[np.cos(psi), -np.sin(psi), 0], [np.sin(psi), np.cos(psi), 0], [0, 0, 1]])
+        Ry = np.array([[np.cos(theta), 0, np.sin(theta)], [0, 1, 0], [-np.sin(theta), 0, np.cos(theta)]])
+        Rx = np.array([[1, 0, 0], [0, np.cos(phi), -np.sin(phi)], [0, np.sin(phi), np.cos(phi)]])
+        return Rz @ Ry @ Rx
+
+    for filename in sys.argv[1:] or ['lab9_square_flight4.json']:
+        data = load_hardware_data(filename)
+        psi_default, theta_default, phi_default = default_observer_angles(data)
+
+        start_time = time.perf_counter()
+        v_default = np.empty((len(data['time']), 3))
+        for i in range(0, len(data['time'])):
+            v_in0 = np.array([data['stateEstimate.vx'][i], data['stateEstimate.vy'][i], data['stateEstimate.vz'][i]])
+            v_default[i] = R_1in0_loop(psi_default[i], theta_default[i], phi_default[i]).T @ v_in0
+        loop_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        v_x, v_y, v_z = default_observer_velocity(data)
+        batch_time = time.perf_counter() - start_time
+
+        error = np.max(np.abs(np.column_stack([v_x, v_y, v_z]) - v_default))
+        v_in0 = np.column_stack([data['stateEstimate.vx'], data['stateEstimate.vy'], data['stateEstimate.vz']])
+        round_trip = np.max(np.abs(body_to_world(np.column_stack([v_x, v_y, v_z]), psi_default, theta_default, phi_default) - v_in0))
+        print(f'{filename} ({len(data["time"])} samples)')
+        print(f' loop:    {loop_time * 1e3:8.3f} ms')
+        print(f' batched: {batch_time * 1e3:8.3f} ms ({loop_time / batch_time:5.1f}x faster, max difference {error:.1e}, round trip {round_trip:.1e})')
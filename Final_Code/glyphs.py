@@ -0,0 +1,313 @@
+import functools
+import numpy as np
+from setpoints import Hold, Trajectory
+
+# Strokes for each letter. Every letter starts at its lower-left corner
+# (u = 0, z = 0.5) and is a list of waypoints (u, z, pen), where u is the
+# fraction of the letter width (x_dim) from its left edge, z is the height in
+# meters, and pen is 1 if the headlights should be on while flying to that
+# waypoint (i.e., if that part of the letter is drawn) and 0 if not. Every
+# letter ends at its lower-right corner (u = 1, z = 0.5). A space has no
+# strokes, and so leaves a gap as wide as a letter.
+glyphs = {
+    ' ': [],
+    'A': [(0.5, 1, 1), (1, 0.5, 1), (0.8, 0.7, 1), (0.4, 0.7, 1), (1, 0.5, 0)],
+    'B': [(0, 1, 1), (0.8, 1, 1), (0.8, 0.5, 1), (0, 0.5, 1), (0, 0.8, 1), (0.8, 0.8, 1), (1, 0.5, 0)],
+    'C': [(1, 1, 0), (0, 1, 1), (0, 0.5, 1), (1, 0.5, 1)],
+    'D': [(0, 1, 1), (1, 0.75, 1), (0, 0.5, 1), (1, 0.5, 0)],
+    'E': [(1, 1, 0), (0, 1, 1), (0, 0.5, 1), (1, 0.5, 1), (1, 0.75, 0), (0, 0.75, 1), (1, 0.5, 0)],
+    'F': [(0, 1, 1), (1, 1, 1), (1, 0.75, 0), (0, 0.75, 1), (1, 0.5, 0)],
+    'G': [(1, 1, 0), (0, 1, 1), (0, 0.5, 1), (1, 0.5, 1), (1, 0.75, 1), (0.5, 0.75, 1), (1, 0.5, 0)],
+    'H': [(0, 1, 1), (0, 0.75, 1), (1, 0.75, 1), (1, 1, 1), (1, 0.5, 1)],
+    'I': [(1, 0.5, 1), (0.5, 0.5, 1), (0.5, 1, 1), (0, 1, 1), (1, 1, 1), (1, 0.5, 0)],
+    'J': [(0.5, 0.5, 1), (0.5, 1, 1), (0, 1, 1), (1, 1, 1), (1, 0.5, 0)],
+    'K': [(0, 1, 1), (1, 1, 0), (0, 0.75, 1), (1, 0.5, 1)],
+    'L': [(0, 1, 1), (0, 0.5, 1), (1, 0.5, 1)],
+    'M': [(0, 1, 1), (0.5, 0.5, 1), (1, 1, 1), (1, 0.5, 1)],
+    'N': [(0, 1, 1), (1, 0.5, 1), (1, 1, 1), (1, 0.5, 0)],
+    'O': [(0, 1, 1), (1, 1, 1), (1, 0.5, 1), (0, 0.5, 1), (1, 0.5, 0)],
+    'P': [(0, 1, 1), (1, 1, 1), (1, 0.75, 1), (0, 0.75, 1), (1, 0.5, 0)],
+    'Q': [(0, 0.6, 0), (0, 1, 1), (0.8, 1, 1), (0.8, 0.6, 1), (0, 0.6, 1), (0.4, 0.8, 0), (1, 0.5, 1)],
+    'R': [(0, 1, 1), (1, 1, 1), (1, 0.75, 1), (0, 0.75, 1), (1, 0.5, 1)],
+    'S': [(1, 0.5, 1), (1, 0.75, 1), (0, 0.75, 1), (0, 1, 1), (1, 1, 1), (1, 0.5, 0)],
+    'T': [(0, 1, 0), (1, 1, 1), (0.5, 1, 1), (0.5, 0.5, 1), (1, 0.5, 0)],
+    'U': [(0, 1, 0), (0, 0.5, 1), (1, 0.5, 1), (1, 1, 1), (1, 0.5, 0)],
+    'V': [(0, 1, 0), (0.5, 0.5, 1), (1, 1, 1), (1, 0.5, 0)],
+    'W': [(0, 1, 0), (0.25, 0.5, 1), (1, 1, 1), (0.75, 0.5, 1), (1, 1, 1), (1, 0.5, 0)],
+    'X': [(1, 1, 1), (0, 1, 0), (1, 0.5, 1)],
+    'Y': [(1, 1, 1), (0, 1, 0), (0.5, 0.75, 1), (1, 0.5, 0)],
+    'Z': [(0, 1, 0), (1, 1, 1), (0, 0.5, 1), (1, 0.5, 1)],
+}
+
+
+class WordTrajectory:
+    # A whole word as one trajectory: positions p[i] (world frame) at times
+    # t[i] (seconds from the start), with pen[i] = 1 if the headlights are on
+    # between p[i] and p[i + 1], and a list of (time, value) at which to set
+    # ring.headlightEnable
+    def __init__(self, t, p, pen):
+        self.t = t
+        self.p = p
+        self.pen = pen
+        self.duration = t[-1]
+        self.light_events = []
+        light = 0
+        for i, value in enumerate(list(pen) + [0]):
+            if value != light:
+                self.light_events.append((float(t[i]), int(value)))
+                light = value
+
+
+def drawable(word):
+    # word without the characters that are not in the table above (with a
+    # warning for each of them)
+    for char in sorted(set(c for c in word if c.upper() not in glyphs)):
+        print(f'WARNING: skipping "{char}" in "{word}" (there are no strokes for it in glyphs.py)')
+    return ''.join(c for c in word if c.upper() in glyphs)
+
+
+def letter_waypoints(char, x_pos, x_dim, y=0.):
+    # Waypoints of one letter in the world frame, not including its start
+    # (none for a character that is not in the table above)
+    return [((x_pos + u * x_dim, y, z), pen) for u, z, pen in glyphs.get(char.upper(), [])]
+
+
+def compile_word(word, x_start, x_dim, spacing=0.1, speed=0.2, y=0., hover=0.):
+    # Turn a word into a single trajectory at constant speed, with letter k
+    # drawn between x_start + k * (x_dim + spacing) and that plus x_dim.
+    # The drone does not stop between strokes or letters unless hover > 0,
+    # in which case it waits that long at the start of every letter after
+    # the first. Characters that are not in the table above are skipped.
+    points = [(x_start, y, 0.5)]
+    pens = []
+    waits = [0.]
+    for k, char in enumerate(drawable(word)):
+        x_pos = x_start + k * (x_dim + spacing)
+        if char == ' ':
+            continue
+        if k > 0:
+            points.append((x_pos, y, 0.5))
+            pens.append(0)
+            waits.append(0.)
+            if hover > 0:
+                points.append((x_pos, y, 0.5))
+                pens.append(0)
+                waits.append(hover)
+        for p, pen in letter_waypoints(char, x_pos, x_dim, y=y):
+            points.append(p)
+            pens.append(pen)
+            waits.append(0.)
+    p = np.array(points)
+    dt = np.linalg.norm(np.diff(p, axis=0), axis=1) / speed + np.array(waits[1:])
+    t = np.concatenate([[0.], np.cumsum(dt)])
+    return WordTrajectory(t, p, np.array(pens))
+
+
+def pen_up_distance(word):
+    # How far a compiled word flies with the headlights off (in meters)
+    return float(np.sum(np.linalg.norm(np.diff(word.p, axis=0), axis=1)[word.pen == 0]))
+
+
+# Cost (in meters) added to every pen-up move when planning, so that of two
+# plans that fly the same distance, the one that turns the headlights on and
+# off fewer times is chosen
+pen_up_penalty = 1e-6
+
+
+def glyph_edges(char):
+    # Segments of a letter that are drawn (with the headlights on), as
+    # ((u0, z0), (u1, z1)) pairs in the order of the table above
+    edges = []
+    p0 = (0, 0.5)
+    for u, z, pen in glyphs.get(char.upper(), []):
+        if pen and (u, z) != p0:
+            edges.append((p0, (u, z)))
+        p0 = (u, z)
+    return edges
+
+
+def _pen_up_cost(p0, p1):
+    d = float(np.linalg.norm(np.subtract(p1, p0)))
+    return d + pen_up_penalty if d > 0 else 0.
+
+
+@functools.lru_cache(maxsize=None)
+def letter_tours(char, x_dim, z_dim=0.5):
+    # Every way to draw a letter that starts at one of its vertices s and ends
+    # at another one e, as {(s, e): (cost, [(a, b), ...])}, where the list has
+    # the edges of glyph_edges in the order and direction that costs the
+    # least pen-up travel between them. Vertices are (x, z) in meters from
+    # the lower-left corner of the letter (the letter is x_dim wide and z_dim
+    # tall). This tries every order, which is fine for letters of a handful
+    # of edges (dynamic programming over subsets of the edges).
+    def scale(p):
+        return (p[0] * x_dim, 0.5 + (p[1] - 0.5) * z_dim / 0.5)
+    edges = [(scale(a), scale(b)) for a, b in glyph_edges(char)]
+    vertices = sorted(set(p for edge in edges for p in edge))
+    index = {p: i for i, p in enumerate(vertices)}
+    n = len(edges)
+    full = (1 << n) - 1
+    tours = {}
+    for s in vertices:
+        # cost[mask][v] is the cheapest way to draw the edges in mask starting
+        # at s and ending at vertex v, and back[mask][v] is how it got there
+        cost = [[np.inf] * len(vertices) for mask in range(full + 1)]
+        back = [[None] * len(vertices) for mask in range(full + 1)]
+        cost[0][index[s]] = 0.
+        for mask in range(full + 1):
+            for v, c in enumerate(cost[mask]):
+                if c == np.inf:
+                    continue
+                for i, (a, b) in enumerate(edges):
+                    if mask & (1 << i):
+                        continue
+                    for a, b in [(a, b), (b, a)]:
+                        c_next = c + _pen_up_cost(vertices[v], a)
+                        if c_next < cost[mask | (1 << i)][index[b]]:
+                            cost[mask | (1 << i)][index[b]] = c_next
+                            back[mask | (1 << i)][index[b]] = (mask, v, (a, b))
+        for e in vertices:
+            if cost[full][index[e]] == np.inf:
+                continue
+            path = []
+            mask, v = full, index[e]
+            while mask:
+                mask, v, edge = back[mask][v]
+                path.append(edge)
+            tours[(s, e)] = (cost[full][index[e]], path[::-1])
+    return tours
+
+
+def plan_word(word, x_start, x_dim, spacing=0.1, speed=0.2, y=0., z_dim=0.5):
+    # Same as compile_word (and with the same layout, so left_shift and
+    # vertical_shift in flight.py are x_dim and z_dim), except that instead
+    # of drawing every letter the way the table above does and then flying
+    # to the lower-right corner, it chooses the order and direction of the
+    # strokes in each letter, and where to enter and leave each letter, that
+    # fly the shortest distance with the headlights off (and so take the
+    # least time). The drone still starts at the lower-left corner of the
+    # first letter, but ends wherever the last stroke does (word.p[-1]).
+    #
+    # Plans are cached for each word and layout, and each call returns its
+    # own copy of the plan (so changing it does not change the cached one).
+    plan = _plan_word(drawable(word), x_start, x_dim, spacing, speed, y, z_dim)
+    return WordTrajectory(plan.t.copy(), plan.p.copy(), plan.pen.copy())
+
+
+@functools.lru_cache(maxsize=None)
+def _plan_word(word, x_start, x_dim, spacing, speed, y, z_dim):
+    def world(x_pos, p):
+        return (x_pos + p[0], y, p[1])
+
+    # best[e] is (cost, plan) of the cheapest way to draw every letter so far
+    # and end at e (in the world frame), where plan is a list of edges
+    start = (x_start, y, 0.5)
+    best = {start: (0., [])}
+    for k, char in enumerate(word):
+        x_pos = x_start + k * (x_dim + spacing)
+        if char == ' ':
+            continue
+        tours = letter_tours(char, x_dim, z_dim)
+        new_best = {}
+        for q, (c_q, plan) in best.items():
+            for (s, e), (c_se, path) in tours.items():
+                c = c_q + _pen_up_cost(q, world(x_pos, s)) + c_se
+                e_world = world(x_pos, e)
+                if e_world not in new_best or c < new_best[e_world][0]:
+                    new_best[e_world] = (c, (plan, x_pos, path))
+        best = new_best
+
+    # Unwind the plan into waypoints, with a pen-up move before every edge
+    # that does not start where the last one ended
+    pieces = []
+    plan = min(best.values(), key=lambda item: item[0])[1]
+    while plan:
+        plan, x_pos, path = plan
+        pieces.append((x_pos, path))
+    points = [start]
+    pens = []
+    for x_pos, path in pieces[::-1]:
+        for a, b in path:
+            if world(x_pos, a) != points[-1]:
+                points.append(world(x_pos, a))
+                pens.append(0)
+            points.append(world(x_pos, b))
+            pens.append(1)
+    p = np.array(points)
+    t = np.concatenate([[0.], np.cumsum(np.linalg.norm(np.diff(p, axis=0), axis=1) / speed)])
+    return WordTrajectory(t, p, np.array(pens))
+
+
+def fly_word(client, word, yaw=0., start_at=None, wait=True):
+    # Fly a compiled word with client (a SimpleClient). The trajectory is
+    # split wherever the headlights change, and each piece turns them on or
+    # off as soon as it ends, so the setpoint stream is never interrupted.
+    # If start_at (a time.monotonic() time) is given, the word starts then.
+    # Returns an event that is set when the word is done (after waiting for
+    # it, unless wait is False).
+    events = list(word.light_events)
+    on_start = None
+    if events and events[0][0] == 0.:
+        value = events.pop(0)[1]
+        on_start = lambda value=value: client.params.set('ring.headlightEnable', value)
+    x, y, z = word.p[0]
+    done = client.setpoints.add(Hold(x, y, z, yaw, 0.), on_done=on_start, start_at=start_at)
+    t0 = 0.
+    for t1, value in events + [(word.duration, None)]:
+        i = (word.t >= t0) & (word.t <= t1)
+        on_done = None
+        if value is not None:
+            on_done = lambda value=value: client.params.set('ring.headlightEnable', value)
+        if np.count_nonzero(i) < 2:
+            # (too short to fly on its own, so it is flown as part of the next
+            # piece - but the headlights still change here, where the last
+            # piece ended)
+            if on_done is not None:
+                x, y, z = word.p[np.searchsorted(word.t, t0, side='right') - 1]
+                done = client.setpoints.add(Hold(x, y, z, yaw, 0.), on_done=on_done)
+            continue
+        done = client.setpoints.add(Trajectory(word.t[i] - t0, word.p[i], yaw), on_done=on_done)
+        t0 = t1
+    if wait:
+        client.setpoints.wait(done)
+    return done
+
+
+def letter_by_letter_time(word, x_dim, spacing=0.1, speed=0.2, hover=2.0):
+    # How long flying word takes the way __main__ in flight.py used to do it,
+    # i.e., with letter_move for each letter and then a move to the start of
+    # the next letter that hovers for two seconds
+    duration = 0.
+    for char in word:
+        p1 = np.array([0., 0., 0.5])
+        for p, pen in letter_waypoints(char, 0., x_dim):
+            duration += np.linalg.norm(np.array(p) - p1) / speed
+            p1 = np.array(p)
+        duration += hover
+    return duration
+
+
+if __name__ == '__main__':
+    # Compare mission times for a word, e.g.,
+    #
+    #   python Final_Code/glyphs.py NOOR
+    #
+    import sys
+    import time
+    word = sys.argv[1] if len(sys.argv) > 1 else 'NOOR'
+    x_dim = 0.30
+    compiled = compile_word(word, -x_dim * len(word) / 2, x_dim)
+    start_time = time.perf_counter()
+    planned = plan_word(word, -x_dim * len(word) / 2, x_dim)
+    plan_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    plan_word(word, -x_dim * len(word) / 2, x_dim)
+    cached_time = time.perf_counter() - start_time
+    old_duration = letter_by_letter_time(word, x_dim)
+    print(f'{word}: {len(compiled.t)} waypoints, {len(compiled.light_events)} headlight changes')
+    print(f' letter by letter: {old_duration:6.2f} s')
+    print(f' compiled:         {compiled.duration:6.2f} s ({old_duration - compiled.duration:.2f} s shorter, '
+          f'{pen_up_distance(compiled):.2f} m with the headlights off)')
+    print(f' planned:          {planned.duration:6.2f} s ({old_duration - planned.duration:.2f} s shorter, '
+          f'{pen_up_distance(planned):.2f} m with the headlights off, {len(planned.light_events)} headlight changes)')
+    print(f' planning took {plan_time * 1e3:.1f} ms ({cached_time * 1e6:.1f} us when cached)')
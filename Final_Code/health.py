@@ -0,0 +1,180 @@
+import sys
+import json
+import bisect
+import numpy as np
+from flightlog import HOST_PREFIX
+
+# Health of each log stream (one per LogConfig), updated in log_data as
+# packets arrive, e.g.,
+#
+#   client.stream_health()      # {'LogConf0': {'rate_hz': 99.8, 'dropped': 3, ...}, ...}
+#
+# Drone timestamps are in milliseconds, so a gap of two periods between two
+# packets means one packet was dropped (the analysis notebooks interpolate
+# over such gaps without saying so). Skew is how much later than usual a
+# packet arrived at the host, i.e., (host time - drone time) minus the
+# smallest such difference so far, and drift is how much faster the host
+# clock runs than the drone clock.
+
+# Gaps are counted in multiples of the period, up to this many (longer gaps
+# are counted together)
+max_gap_periods = 10
+
+# Upper edges of the bins of the callback duration histogram (in microseconds)
+callback_bins_us = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, np.inf]
+
+
+def _bin_label(i):
+    if np.isinf(callback_bins_us[i]):
+        return f'>{callback_bins_us[i - 1]:g}us'
+    return f'<={callback_bins_us[i]:g}us'
+
+
+class StreamHealth:
+    def __init__(self, period_in_ms=10):
+        self.period_in_ms = period_in_ms
+        self.count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.first_host_time = None
+        self.last_host_time = None
+        self.gaps = [0] * (max_gap_periods + 1)
+        self.dropped = 0
+        self.out_of_order = 0
+        self.callback_sum = 0.
+        self.callback_max = 0.
+        self.callback_hist = [0] * len(callback_bins_us)
+        self.min_offset = None
+        self.skew_sum = 0.
+        self.skew_max = 0.
+        # (sums for a least-squares fit of host time against drone time,
+        # relative to the first packet so that they stay small)
+        self.fit = [0., 0., 0., 0.]
+
+    def update(self, timestamp, host_time, callback_duration):
+        # timestamp is the drone time (ms) of the packet, host_time is when it
+        # arrived (s, e.g. from time.perf_counter) and callback_duration is
+        # how long log_data took (s)
+        if self.count == 0:
+            self.first_timestamp = timestamp
+            self.first_host_time = host_time
+        else:
+            gap = timestamp - self.last_timestamp
+            if gap <= 0:
+                self.out_of_order += 1
+            else:
+                periods = int(round(gap / self.period_in_ms))
+                self.gaps[min(periods, max_gap_periods)] += 1
+                if periods > 1:
+                    self.dropped += periods - 1
+        self.count += 1
+        self.last_timestamp = timestamp
+        self.last_host_time = host_time
+
+        self.callback_sum += callback_duration
+        if callback_duration > self.callback_max:
+            self.callback_max = callback_duration
+        self.callback_hist[bisect.bisect_left(callback_bins_us, callback_duration * 1e6)] += 1
+
+        t_drone = (timestamp - self.first_timestamp) / 1000.
+        t_host = host_time - self.first_host_time
+        offset = t_host - t_drone
+        if self.min_offset is None or offset < self.min_offset:
+            self.min_offset = offset
+        skew = offset - self.min_offset
+        self.skew_sum += skew
+        if skew > self.skew_max:
+            self.skew_max = skew
+        fit = self.fit
+        fit[0] += t_drone
+        fit[1] += t_host
+        fit[2] += t_drone * t_drone
+        fit[3] += t_drone * t_host
+
+    def summary(self):
+        n = self.count
+        duration = (self.last_timestamp - self.first_timestamp) / 1000. if n > 1 else 0.
+        expected = int(round(duration * 1000. / self.period_in_ms)) + 1 if n > 0 else 0
+        drift_ppm = 0.
+        if n > 2:
+            sx, sy, sxx, sxy = self.fit
+            denominator = n * sxx - sx * sx
+            if denominator > 0:
+                drift_ppm = ((n * sxy - sx * sy) / denominator - 1.) * 1e6
+        return {
+            'period_ms': self.period_in_ms,
+            'packets': n,
+            'duration_s': duration,
+            'rate_hz': (n - 1) / duration if duration > 0 else 0.,
+            'expected_hz': 1000. / self.period_in_ms,
+            'dropped': self.dropped,
+            'dropped_percent': 100. * self.dropped / expected if expected > 0 else 0.,
+            'out_of_order': self.out_of_order,
+            # number of gaps of 0, 1, 2, ... periods (the last one is for
+            # max_gap_periods or more)
+            'gaps': list(self.gaps),
+            'callback_mean_us': 1e6 * self.callback_sum / n if n > 0 else 0.,
+            'callback_max_us': 1e6 * self.callback_max,
+            'callback_hist': {_bin_label(i): count for i, count in enumerate(self.callback_hist)},
+            'skew_mean_ms': 1e3 * self.skew_sum / n if n > 0 else 0.,
+            'skew_max_ms': 1e3 * self.skew_max,
+            'drift_ppm': drift_ppm,
+        }
+
+
+def log_health(data, period_in_ms=10):
+    # Gap statistics of a flight log that has already been recorded (in the
+    # JSON layout, or a FlightLog), for each group of variables that share
+    # timestamps (i.e., each log block) - period_in_ms is only used for logs
+    # that do not say at which period each variable was logged
+    from analysis import _group_by_time
+    result = {}
+    for t, group in _group_by_time(data, [k for k in data.keys() if not k.startswith(HOST_PREFIX)]):
+        period = data[group[0]].get('period_in_ms', period_in_ms)
+        gaps = np.diff(t.astype(np.int64))
+        periods = np.rint(gaps[gaps > 0] / period).astype(np.int64)
+        duration = (t[-1] - t[0]) / 1000. if len(t) > 1 else 0.
+        expected = int(round(duration * 1000. / period)) + 1 if len(t) > 0 else 0
+        dropped = int(np.sum(np.maximum(periods - 1, 0)))
+        result[group[0]] = {
+            'variables': group,
+            'period_ms': period,
+            'packets': len(t),
+            'duration_s': duration,
+            'rate_hz': (len(t) - 1) / duration if duration > 0 else 0.,
+            'dropped': dropped,
+            'dropped_percent': 100. * dropped / expected if expected > 0 else 0.,
+            'out_of_order': int(np.sum(gaps <= 0)),
+            'gaps': np.bincount(np.minimum(periods, max_gap_periods), minlength=max_gap_periods + 1).tolist(),
+        }
+    return result
+
+
+def print_health(health):
+    # health is {name: summary}, from SimpleClient.stream_health()
+    for name, s in health.items():
+        line = (f'{name}: {s["packets"]} packets at {s["rate_hz"]:.1f} Hz '
+                f'({s["dropped"]} dropped, {s["dropped_percent"]:.1f}%')
+        if 'callback_mean_us' in s:
+            line += (f', callback mean {s["callback_mean_us"]:.1f} us, max {s["callback_max_us"]:.1f} us'
+                     f', skew mean {s["skew_mean_ms"]:.1f} ms, max {s["skew_max_ms"]:.1f} ms, drift {s["drift_ppm"]:.0f} ppm')
+        print(line + ')')
+
+
+def write_health(filename, health):
+    with open(filename, 'w') as f:
+        json.dump(health, f, indent=4)
+
+
+if __name__ == '__main__':
+    # Look for dropped packets in flights that have already been recorded, e.g.,
+    #
+    #   python Final_Code/health.py NOOR_flight_4.json lab9_square_flight4.json
+    #
+    from flightlog import load_flight_log
+    for filename in sys.argv[1:]:
+        print(filename)
+        health = log_health(load_flight_log(filename))
+        for name, s in health.items():
+            print(f' {len(s["variables"])} variables like {name}: {s["packets"]} packets at {s["rate_hz"]:.1f} Hz '
+                  f'({s["dropped"]} dropped, {s["dropped_percent"]:.1f}%, gaps of 1..{max_gap_periods}+ periods: {s["gaps"][1:]})')
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import struct
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Live feed of logged data in shared memory, so that another process (e.g., a
+# dashboard or a plot) can watch a flight while it happens, e.g.,
+#
+#   client = SimpleClient(uri, live='cf0')              # in the flight script
+#
+#   reader = LiveReader('cf0')                          # in any other process
+#   while True:
+#       new = reader.read()     # {variable: {'time': array, 'data': array}}
+#       ...
+#
+# Each log block has a ring buffer of its last `capacity` samples, and a count
+# of how many samples have ever been written to it. The cflib callback thread
+# writes each sample once, straight into the ring (no queue, no lock, no
+# copies for readers), and only then increments the count. Readers never slow
+# the flight down - a reader that falls more than `capacity` samples behind
+# skips ahead to the oldest sample still in the ring.
+#
+# Layout of the shared memory (version 2, native byte order):
+#
+#   header      8-byte magic, uint32 version, uint32 capacity, uint32 length
+#               of the table, uint32 closed (set to 1 when the flight ends),
+#               uint32 id of the process that writes it, then the table
+#               itself: a utf-8 JSON list of log blocks, each of which looks
+#               like
+#               {'name': 'LogConf0', 'variables': [['ae483log.o_x', 'float'], ...]}
+#   counts      one uint64 per block, padded to a multiple of 8 bytes first
+#   rings       one float64 array of shape (capacity, 1 + number of
+#               variables) per block, with the drone timestamp in column 0
+MAGIC = b'AE483LIV'
+VERSION = 2
+HEADER = struct.Struct('=8sIIIII')
+CLOSED_OFFSET = 20
+
+
+def _layout(table, capacity, table_length):
+    # Offsets of the counts and of each ring, and the total size
+    offset = HEADER.size + table_length
+    offset += -offset % 8
+    counts_offset = offset
+    offset += 8 * len(table)
+    ring_offsets = []
+    for block in table:
+        ring_offsets.append(offset)
+        offset += 8 * capacity * (1 + len(block['variables']))
+    return counts_offset, ring_offsets, offset
+
+
+def _is_running(pid):
+    # Whether the process with id pid still exists
+    if os.name == 'nt':
+        # (on Windows, shared memory goes away with the last process that
+        # has it open, so whoever made it is still running)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class LivePublisher:
+    # Creates the shared memory called name and writes logged data to it
+    # (SimpleClient does this for you if it is given live=name)
+    def __init__(self, name, blocks, capacity=4096):
+        # blocks is a list of (name, [(variable, type), ...]) pairs
+        self.name = name
+        self.capacity = capacity
+        self.index = {block_name: i for i, (block_name, variables) in enumerate(blocks)}
+        self.variables = [[v for v, t in variables] for block_name, variables in blocks]
+        table = [{'name': block_name, 'variables': [list(var) for var in variables]} for block_name, variables in blocks]
+        table_bytes = json.dumps(table).encode('utf-8')
+        counts_offset, ring_offsets, size = _layout(table, capacity, len(table_bytes))
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # (only a feed left behind by a flight that crashed before it
+            # could close it is replaced - readers that are still attached to
+            # it are told it is closed, and a new one is made, since its
+            # layout may not be the same)
+            stale = shared_memory.SharedMemory(name=name)
+            error = None
+            if stale.size < HEADER.size:
+                error = f'Shared memory called {name} exists and is not a live feed'
+            else:
+                magic, version, _, _, closed, pid = HEADER.unpack_from(stale.buf, 0)
+                if magic != MAGIC or version != VERSION:
+                    error = f'Shared memory called {name} exists and is not a version {VERSION} live feed'
+                elif not closed and _is_running(pid):
+                    error = f'The live feed {name} is still being written by process {pid} (give each client its own name)'
+            if error is not None:
+                stale.close()
+                # (so that it is not removed when this process exits - see
+                # LiveReader - unless this process is the one writing it)
+                if stale.size < HEADER.size or pid != os.getpid():
+                    resource_tracker.unregister(stale._name, 'shared_memory')
+                raise FileExistsError(error)
+            struct.pack_into('=I', stale.buf, CLOSED_OFFSET, 1)
+            stale.close()
+            stale.unlink()
+            print(f'Replaced the live feed {name} that was left behind by an earlier flight')
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, capacity, len(table_bytes), 0, os.getpid())
+        self.shm.buf[HEADER.size:HEADER.size + len(table_bytes)] = table_bytes
+        self.counts = np.ndarray(len(table), dtype=np.uint64, buffer=self.shm.buf, offset=counts_offset)
+        self.counts[:] = 0
+        self.rings = [
+            np.ndarray((capacity, 1 + len(v)), dtype=np.float64, buffer=self.shm.buf, offset=offset)
+            for v, offset in zip(self.variables, ring_offsets)
+        ]
+        # (a copy of the counts that only this thread writes, so that push
+        # never has to read shared memory)
+        self.num_written = [0] * len(table)
+        self.closed = False
+
+    def push(self, block_name, timestamp, data):
+        if self.closed:
+            return
+        i = self.index[block_name]
+        n = self.num_written[i]
+        row = self.rings[i][n % self.capacity]
+        row[0] = timestamp
+        row[1:] = [data[v] for v in self.variables[i]]
+        # Only publish the new sample after it has been written
+        self.num_written[i] = n + 1
+        self.counts[i] = n + 1
+
+    def close(self):
+        # Tell readers that the flight is over and remove the shared memory
+        # (readers that are attached to it can still read what is left)
+        if self.closed:
+            return
+        self.closed = True
+        struct.pack_into('=I', self.shm.buf, CLOSED_OFFSET, 1)
+        del self.counts, self.rings
+        self.shm.close()
+        self.shm.unlink()
+
+
+class LiveReader:
+    # Attaches to the shared memory of a LivePublisher (waiting up to timeout
+    # seconds for it to be created) and reads the samples that are new since
+    # the last read
+    def __init__(self, name, timeout=None):
+        start_time = time.monotonic()
+        while True:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if timeout is not None and time.monotonic() - start_time > timeout:
+                    raise
+                time.sleep(0.1)
+        # Python 3.8-3.12 would otherwise remove the shared memory when this
+        # process exits, even though the publisher created it
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        magic, version, capacity, table_length, closed, pid = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{name} is not a live telemetry feed')
+        if version != VERSION:
+            raise ValueError(f'{name} has version {version} but only version {VERSION} is supported')
+        self.name = name
+        self.capacity = capacity
+        self.table = json.loads(bytes(self.shm.buf[HEADER.size:HEADER.size + table_length]))
+        counts_offset, ring_offsets, size = _layout(self.table, capacity, table_length)
+        self.counts = np.ndarray(len(self.table), dtype=np.uint64, buffer=self.shm.buf, offset=counts_offset)
+        self.rings = [
+            np.ndarray((capacity, 1 + len(block['variables'])), dtype=np.float64, buffer=self.shm.buf, offset=offset)
+            for block, offset in zip(self.table, ring_offsets)
+        ]
+        self.variables = [v for block in self.table for v, t in block['variables']]
+        self.block_of = {v: i for i, block in enumerate(self.table) for v, t in block['variables']}
+        self.column_of = {v: 1 + j for block in self.table for j, (v, t) in enumerate(block['variables'])}
+        # Start with whatever is still in the rings
+        self.next = [max(0, int(n) - capacity) for n in self.counts]
+        self.num_skipped = 0
+
+    @property
+    def closed(self):
+        return struct.unpack_from('=I', self.shm.buf, CLOSED_OFFSET)[0] == 1
+
+    def _read_block(self, i):
+        # Rows written since the last read (copied out of the ring)
+        start = self.next[i]
+        end = int(self.counts[i])
+        if end - start > self.capacity:
+            self.num_skipped += end - self.capacity - start
+            start = end - self.capacity
+        rows = self.rings[i][np.arange(start, end) % self.capacity]
+
+        # The publisher may have overwritten the oldest of these rows while
+        # they were being copied (and may be in the middle of overwriting the
+        # next one), in which case they are skipped too
+        valid_from = int(self.counts[i]) - self.capacity + 1
+        if valid_from > start:
+            self.num_skipped += valid_from - start
+            rows = rows[valid_from - start:]
+        self.next[i] = end
+        return rows
+
+    def read(self):
+        # New samples of every variable, in the same layout as the JSON flight
+        # logs, i.e., {variable: {'time': array, 'data': array}}
+        data = {}
+        for i, block in enumerate(self.table):
+            rows = self._read_block(i)
+            t = rows[:, 0].astype(np.int64)
+            for j, (v, ctype) in enumerate(block['variables']):
+                data[v] = {'time': t, 'data': rows[:, 1 + j]}
+        return data
+
+    def latest(self, variables=None):
+        # The most recent value of each variable (without changing what the
+        # next read returns), or None if there is no value yet
+        values = {}
+        for v in (self.variables if variables is None else variables):
+            i = self.block_of[v]
+            n = int(self.counts[i])
+            values[v] = float(self.rings[i][(n - 1) % self.capacity, self.column_of[v]]) if n > 0 else None
+        return values
+
+    def close(self):
+        del self.counts, self.rings
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    # Print the latest values from a flight that was started with
+    # SimpleClient(uri, live=name) until it ends, e.g.,
+    #
+    #   python Final_Code/live.py cf0 ae483log.o_x ae483log.o_x_des motor.m1
+    #
+    name = sys.argv[1] if len(sys.argv) > 1 else 'ae483'
+    watch = sys.argv[2:] or ['ae483log.o_x', 'ae483log.o_x_des', 'ae483log.o_z', 'ae483log.o_z_des', 'motor.m1', 'motor.m2', 'motor.m3', 'motor.m4']
+    print(f'Waiting for {name}...')
+    reader = LiveReader(name)
+    watch = [v for v in watch if v in reader.block_of]
+    num_samples = 0
+    while not reader.closed:
+        new = reader.read()
+        num_samples += max([len(val['time']) for val in new.values()], default=0)
+        values = reader.latest(watch)
+        print('  '.join(f'{v} {values[v]:10.4f}' if values[v] is not None else f'{v} {"-":>10s}' for v in watch))
+        time.sleep(0.1)
+    print(f'{name} closed after {num_samples} samples ({reader.num_skipped} skipped)')
+    reader.close()
@@ -0,0 +1,228 @@
+import os
+import glob
+import json
+
+# Where cflib caches the TOC of each firmware build (the repository's cache
+# directory, wherever a script is run from)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+
+# Each log packet carries a 1-byte CRTP header, a 1-byte block id and a
+# 3-byte timestamp, leaving 26 bytes for the variables themselves (this
+# is the same limit as LogConfig.MAX_LEN in cflib)
+MAX_PAYLOAD = 26
+PACKET_OVERHEAD = 5
+
+# The log subsystem counts the period of each block in units of 10 ms, from
+# 1 to 254 (so the fastest rate is 100 Hz and every rate must be 100 Hz
+# divided by a whole number)
+PERIOD_UNIT_IN_MS = 10
+MAX_PERIOD_UNITS = 254
+
+# Radio bytes per second (payload plus packet overhead, as in layout_stats)
+# that SimpleClient lets its log blocks use. Flights logged with the old
+# layout of seven blocks at 100 Hz (about 18700 bytes per second) lost a
+# large fraction of their packets, so this stays well below that.
+RADIO_BUDGET = 16000
+
+# Size in bytes of each type that the log subsystem knows about
+type_sizes = {
+    'uint8_t': 1,
+    'int8_t': 1,
+    'uint16_t': 2,
+    'int16_t': 2,
+    'FP16': 2,
+    'uint32_t': 4,
+    'int32_t': 4,
+    'float': 4,
+}
+
+# Variables that are stored with a wider type than they need on the drone
+# and can be fetched as a narrower type without losing anything (the motor
+# commands are uint32_t in the TOC but are always clamped to 0..UINT16_MAX)
+default_fetch_as = {
+    'motor.m1': 'uint16_t',
+    'motor.m2': 'uint16_t',
+    'motor.m3': 'uint16_t',
+    'motor.m4': 'uint16_t',
+}
+
+
+def load_log_toc(variables, cache_dir=CACHE_DIR):
+    # Find the cached log TOC (cflib writes one JSON file per firmware
+    # build, in the repository's cache directory by default) that knows
+    # about the most of the variables we want to log, preferring the most
+    # recently written one if there is a tie
+    best_ctypes = {}
+    files = sorted(glob.glob(os.path.join(cache_dir, '*.json')), key=os.path.getmtime, reverse=True)
+    for filename in files:
+        with open(filename, 'r') as f:
+            toc = json.load(f)
+        ctypes = {}
+        for group_name, group in toc.items():
+            for name, element in group.items():
+                if element.get('__class__') != 'LogTocElement':
+                    break
+                ctypes[f'{group_name}.{name}'] = element['ctype']
+        ctypes = {v: ctypes[v] for v in variables if v in ctypes}
+        if len(ctypes) > len(best_ctypes):
+            best_ctypes = ctypes
+    if not best_ctypes:
+        raise Exception(f'Found no log TOC in {cache_dir} with any of the variables (connect to a drone once to cache its TOC)')
+    return best_ctypes
+
+
+def ctypes_from_toc(toc, variables):
+    # Same as load_log_toc, but using the TOC of a connected drone
+    # (i.e., client.cf.log.toc)
+    ctypes = {}
+    for v in variables:
+        element = toc.get_element_by_complete_name(v)
+        if element is not None:
+            ctypes[v] = element.ctype
+    return ctypes
+
+
+def fetch_types(variables, ctypes, fetch_as=None):
+    # Type in which each variable will actually be sent over the radio
+    if fetch_as is None:
+        fetch_as = default_fetch_as
+    return {v: fetch_as.get(v, ctypes[v]) for v in variables}
+
+
+def pack_variables(variables, ctypes, fetch_as=None, max_payload=MAX_PAYLOAD):
+    # Pack variables into as few log blocks as possible, where each block
+    # can hold at most max_payload bytes. This uses first-fit decreasing,
+    # which is optimal for the handful of sizes (1, 2, 4 bytes) we have.
+    # Variables keep their original order within each block so that related
+    # values (e.g., o_x, o_y, o_z) tend to arrive in the same packet.
+    types = fetch_types(variables, ctypes, fetch_as=fetch_as)
+    order = {v: i for i, v in enumerate(variables)}
+    blocks = []
+    space = []
+    for v in sorted(variables, key=lambda v: -type_sizes[types[v]]):
+        size = type_sizes[types[v]]
+        for i in range(len(blocks)):
+            if space[i] >= size:
+                blocks[i].append(v)
+                space[i] -= size
+                break
+        else:
+            if size > max_payload:
+                raise ValueError(f'{v} ({types[v]}) does not fit in a log block')
+            blocks.append([v])
+            space.append(max_payload - size)
+    return [[(v, types[v]) for v in sorted(block, key=order.get)] for block in blocks]
+
+
+def period_in_ms(rate):
+    # Period of a log block that is sent rate times per second, or ValueError
+    # if the log subsystem cannot send it at that rate
+    units = 1000. / (PERIOD_UNIT_IN_MS * rate) if rate > 0 else 0.
+    if not (1 <= round(units) <= MAX_PERIOD_UNITS and abs(units - round(units)) < 1e-6):
+        raise ValueError(
+            f'Cannot log at {rate} Hz (the rate must be {1000 // PERIOD_UNIT_IN_MS} Hz '
+            f'divided by a whole number from 1 to {MAX_PERIOD_UNITS})'
+        )
+    return int(round(units)) * PERIOD_UNIT_IN_MS
+
+
+def rate_of(v, rates, default_rate=100):
+    # Rate of variable v from rates, which maps either a variable (e.g.,
+    # 'ae483log.o_x_des') or a whole group (e.g., 'ctrltarget') to a rate in
+    # Hz - a variable takes precedence over its group
+    if v in rates:
+        return rates[v]
+    return rates.get(v.split('.')[0], default_rate)
+
+
+def pack_by_rate(variables, ctypes, rates=None, default_rate=100, fetch_as=None, max_payload=MAX_PAYLOAD):
+    # Same as pack_variables, except that variables with different rates go
+    # in different blocks. Returns a list of (period in ms, block), fastest
+    # blocks first.
+    periods = {v: period_in_ms(rate_of(v, rates or {}, default_rate)) for v in variables}
+    plan = []
+    for period in sorted(set(periods.values())):
+        group = [v for v in variables if periods[v] == period]
+        plan.extend((period, block) for block in pack_variables(group, ctypes, fetch_as=fetch_as, max_payload=max_payload))
+    return plan
+
+
+def check_budget(plan, budget=RADIO_BUDGET):
+    # Raise ValueError if the log blocks in plan (from pack_by_rate) would
+    # need more than budget radio bytes per second
+    stats = layout_stats([block for period, block in plan], [period for period, block in plan])
+    if stats['radio_bytes_per_second'] > budget:
+        lines = [f'Logging needs {stats["radio_bytes_per_second"]:.0f} radio bytes per second, but the budget is {budget:.0f}:']
+        for period in sorted(set(period for period, block in plan)):
+            blocks = [block for p, block in plan if p == period]
+            group = layout_stats(blocks, period)
+            lines.append(
+                f' - {1000 / period:g} Hz: {len(blocks)} blocks, {sum(len(block) for block in blocks)} variables, '
+                f'{group["radio_bytes_per_second"]:.0f} bytes per second'
+            )
+        lines.append('Log fewer variables, or log some of them at a lower rate (see log_rates in flight.py).')
+        raise ValueError('\n'.join(lines))
+    return stats
+
+
+def legacy_layout(variables, ctypes):
+    # The layout that SimpleClient.fully_connected used to build: a new
+    # block after every six variables (five in the first one), with every
+    # variable fetched as its stored type
+    blocks = [[]]
+    num_variables = 0
+    for v in variables:
+        num_variables += 1
+        if num_variables > 5:
+            num_variables = 0
+            blocks.append([])
+        blocks[-1].append((v, ctypes[v]))
+    return blocks
+
+
+def layout_stats(blocks, period_in_ms=10):
+    # period_in_ms is either the period of every block or a list with the
+    # period of each block
+    periods = period_in_ms if isinstance(period_in_ms, (list, tuple)) else [period_in_ms] * len(blocks)
+    payload = [sum(type_sizes[t] for v, t in block) for block in blocks]
+    return {
+        'blocks': len(blocks),
+        'packets_per_second': sum(1000. / period for period in periods),
+        'payload_bytes_per_second': sum(p * 1000. / period for p, period in zip(payload, periods)),
+        'radio_bytes_per_second': sum((p + PACKET_OVERHEAD) * 1000. / period for p, period in zip(payload, periods)),
+        'fill': sum(payload) / (MAX_PAYLOAD * max(len(blocks), 1)),
+    }
+
+
+def print_layout_report(variables, ctypes, fetch_as=None, period_in_ms=10, rates=None, default_rate=100):
+    # Compare the legacy layout (everything every period_in_ms) with the
+    # packed layout, where variables are logged at their rates if rates is
+    # given (see pack_by_rate)
+    old = layout_stats(legacy_layout(variables, ctypes), period_in_ms)
+    if rates is None:
+        plan = [(period_in_ms, block) for block in pack_variables(variables, ctypes, fetch_as=fetch_as)]
+    else:
+        plan = pack_by_rate(variables, ctypes, rates=rates, default_rate=default_rate, fetch_as=fetch_as)
+    blocks = [block for period, block in plan]
+    new = layout_stats(blocks, [period for period, block in plan])
+    for i, (period, block) in enumerate(plan):
+        size = sum(type_sizes[t] for v, t in block)
+        print(f'LogConf{i} ({size:2d} / {MAX_PAYLOAD} bytes, {1000 / period:g} Hz)')
+        for v, t in block:
+            print(f' - {v} ({t})')
+    print(f'{"":24s} {"before":>10s} {"after":>10s} {"saved":>10s}')
+    for key in ['blocks', 'packets_per_second', 'payload_bytes_per_second', 'radio_bytes_per_second']:
+        print(f'{key:24s} {old[key]:10.0f} {new[key]:10.0f} {old[key] - new[key]:10.0f}')
+    print(f'{"fill":24s} {old["fill"]:10.0%} {new["fill"]:10.0%}')
+    print(f'{"budget":24s} {RADIO_BUDGET:10.0f} {RADIO_BUDGET:10.0f}')
+    return plan
+
+
+if __name__ == '__main__':
+    from flight import variables, log_rates, default_log_rate
+
+    ctypes = load_log_toc(variables)
+    missing = [v for v in variables if v not in ctypes]
+    for v in missing:
+        print(f'{v} is not in any cached log TOC and will be skipped')
+    print_layout_report([v for v in variables if v in ctypes], ctypes, rates=log_rates, default_rate=default_log_rate)
@@ -0,0 +1,323 @@
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from analysis import load_hardware_data
+from frames import default_observer_angles, default_observer_velocity
+
+# Runs the observer from controller_ae483.c offline on logged flights, for
+# many observer gains at once, e.g.,
+#
+#   from observer import notebook_gain, sweep
+#   result = sweep([notebook_gain(), 2 * notebook_gain()], ['lab9_square_flight4.json'])
+#   result['rmse']      # one row of RMSEs (one per state) per gain and flight
+#
+# This is the same discrete-time update as the "custom observer - offline"
+# loop in the notebooks (including the order in which states are updated,
+# so v_x and v_y see the new theta and phi), written as
+#
+#   x[k + 1] = M x[k] + N z[k]      with z[k] = (w_x, w_y, w_z, a_z, 1, outputs)
+#
+# so that one time step is one batched matrix product for every gain.
+
+# Time step and acceleration of gravity
+dt = 0.01
+g = 9.81
+
+# States and inputs
+states = ['o_x', 'o_y', 'o_z', 'psi', 'theta', 'phi', 'v_x', 'v_y', 'v_z']
+inputs = ['ae483log.w_x', 'ae483log.w_y', 'ae483log.w_z', 'ae483log.a_z']
+
+# Linear model from the Lab 8/9 notebook (the last input is a_z - g)
+A = np.array([[0, 0, 0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, g, 0, 0, 0, 0], [0, 0, 0, 0, 0, -g, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0]])
+B = np.array([[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 1]], dtype=float)
+
+# Optical flow scale factor and equilibrium height (from the Lab 7 notebook)
+k_flow = 4.09255568
+o_z_eq = 0.5
+
+# What the observer measures - either the lighthouse position, or optical
+# flow and the rangefinder (for flights without the lighthouse, such as
+# con_test_*.json). Each model is y = C x + D u, and only the "observed"
+# states get a nonzero gain.
+models = {
+    'lighthouse': {
+        'outputs': ['ae483log.lh_x', 'ae483log.lh_y', 'ae483log.lh_z'],
+        'C': np.array([[1, 0, 0, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0, 0, 0], [0, 0, 1, 0, 0, 0, 0, 0, 0]], dtype=float),
+        'D': np.zeros((3, 4)),
+        'observed': [0, 1, 2, 4, 5, 6, 7, 8],
+        # (standard deviations used to design the gain in the Lab 8/9 notebook)
+        'state_std': [0.026, 0.026, 0.033, 0.103, 0.203, 0.149, 0.115, 0.187],
+        'output_std': [0.003, 0.004, 0.002],
+    },
+    'flow': {
+        'outputs': ['ae483log.n_x', 'ae483log.n_y', 'ae483log.r'],
+        'C': np.array([[0, 0, 0, 0, 0, 0, -k_flow / o_z_eq, 0, 0], [0, 0, 0, 0, 0, 0, 0, -k_flow / o_z_eq, 0], [0, 0, 1, 0, 0, 0, 0, 0, 0]], dtype=float),
+        'D': np.array([[0, k_flow, 0, 0], [-k_flow, 0, 0, 0], [0, 0, 0, 0]], dtype=float),
+        'observed': [2, 4, 5, 6, 7, 8],
+        # (a rough starting point for a sweep)
+        'state_std': [0.033, 0.103, 0.203, 0.149, 0.115, 0.187],
+        'output_std': [1.0, 1.0, 0.01],
+    },
+}
+
+
+def notebook_gain():
+    # The gain that is hard-coded in the offline observer in the notebooks
+    # (and in controller_ae483.c), with rows in the order of states
+    L = np.zeros((9, 3))
+    L[0, 0] = 17.7581819124871
+    L[1, 1] = 17.7223121570295
+    L[2, 2] = 21.4301189917369
+    L[4, 0] = 34.3333333333332
+    L[5, 1] = -50.7499999999999
+    L[6, 0] = 120.120956862936
+    L[7, 1] = 135.915174095598
+    L[8, 2] = 93.5000000000001
+    return L
+
+
+def lqr(A, B, Q, R):
+    # (same as in the notebooks)
+    from scipy import linalg
+    P = linalg.solve_continuous_are(A, B, Q, R)
+    K = linalg.inv(R) @ B.T @ P
+    return K
+
+
+def observer_gain(model='lighthouse', state_std=None, output_std=None):
+    # Design a gain the way the Lab 8/9 notebook does, from the standard
+    # deviations of the observed states and of the outputs
+    m = models[model]
+    state_std = np.asarray(m['state_std'] if state_std is None else state_std)
+    output_std = np.asarray(m['output_std'] if output_std is None else output_std)
+    i = m['observed']
+    A_obs = A[i, :][:, i]
+    C_obs = m['C'][:, i]
+    L = np.zeros((9, len(m['outputs'])))
+    L[i] = lqr(A_obs.T, C_obs.T, np.diag(state_std ** 2), np.diag(output_std ** 2)).T
+    return L
+
+
+def random_gains(num_gains, model='lighthouse', spread=10., seed=0):
+    # Gains designed with standard deviations between 1 / spread and spread
+    # times the defaults (chosen at random, log-uniformly)
+    m = models[model]
+    rng = np.random.default_rng(seed)
+    gains = []
+    for k in range(num_gains):
+        state_scale = spread ** rng.uniform(-1, 1, len(m['state_std']))
+        output_scale = spread ** rng.uniform(-1, 1, len(m['output_std']))
+        gains.append(observer_gain(model, m['state_std'] * state_scale, m['output_std'] * output_scale))
+    return np.array(gains)
+
+
+def update_matrices(L, model='lighthouse', g=g, dt=dt):
+    # M and N such that one step of the offline observer loop in the
+    # notebooks is x[k + 1] = M x[k] + N z[k]. L may be one gain or an array
+    # of them, and so may be M and N.
+    L = np.asarray(L, dtype=float)
+    if L.ndim == 3:
+        Ms, Ns = zip(*(update_matrices(Lk, model=model, g=g, dt=dt) for Lk in L))
+        return np.array(Ms), np.array(Ns)
+    m = models[model]
+    C, D = m['C'], m['D']
+    n_y = C.shape[0]
+
+    # With z = (u, 1, y), where u includes a_z (not a_z - g)
+    B_z = np.concatenate([B, -g * B[:, 3:4], np.zeros((9, n_y))], axis=1)
+    err_z = np.concatenate([D, -g * D[:, 3:4], -np.eye(n_y)], axis=1)
+
+    # The error C x + D u - y is computed once, before any state changes,
+    # but each state is then updated in turn with the states before it
+    # already updated (as in the loop)
+    Mx = np.eye(9)
+    Mz = np.zeros((9, B_z.shape[1]))
+    for i in range(9):
+        row_x = Mx[i] + dt * (A[i] @ Mx - L[i] @ C)
+        row_z = Mz[i] + dt * (A[i] @ Mz + B_z[i] - L[i] @ err_z)
+        Mx[i] = row_x
+        Mz[i] = row_z
+    return Mx, Mz
+
+
+def load_observer_data(filename, model=None):
+    # Inputs, outputs and "true" states (from the default observer) of a
+    # flight, resampled at 100 Hz while in flight. model is chosen from what
+    # was logged if it is not given.
+    if model is None:
+        model = 'lighthouse' if _has_outputs(filename, 'lighthouse') else 'flow'
+    m = models[model]
+    truth = [
+        'stateEstimate.x', 'stateEstimate.y', 'stateEstimate.z',
+        'stateEstimate.yaw', 'stateEstimate.pitch', 'stateEstimate.roll',
+        'stateEstimate.vx', 'stateEstimate.vy', 'stateEstimate.vz',
+    ]
+    variables = inputs + m['outputs'] + truth + ['ae483log.o_z_des', 'ctrltarget.z']
+    data = load_hardware_data(filename, only_in_flight=True, variables=[v for v in variables if v in _logged(filename)])
+
+    psi, theta, phi = default_observer_angles(data)
+    v_x, v_y, v_z = default_observer_velocity(data)
+    true_states = np.column_stack([
+        data['stateEstimate.x'], data['stateEstimate.y'], data['stateEstimate.z'],
+        psi, theta, phi, v_x, v_y, v_z,
+    ])
+    z = np.column_stack([data[k] for k in inputs] + [np.ones(len(data['time']))] + [data[k] for k in m['outputs']])
+    return {'model': model, 'time': data['time'], 'z': z, 'true': true_states}
+
+
+_logged_cache = {}
+
+
+def _logged(filename):
+    if filename not in _logged_cache:
+        from flightlog import load_flight_log
+        _logged_cache[filename] = set(load_flight_log(filename).keys())
+    return _logged_cache[filename]
+
+
+def _has_outputs(filename, model):
+    return all(k in _logged(filename) for k in models[model]['outputs'])
+
+
+def run_observer(M, N, z, true=None, x0=None, keep_estimates=True, chunk=500):
+    # Run the observer (one or many gains - M has shape (9, 9) or (G, 9, 9))
+    # over the inputs and outputs z (one row per time step). Returns the
+    # estimates (shape (T, 9) or (G, T, 9)) if keep_estimates is True, and
+    # the RMSE of each state against true (shape (9,) or (G, 9)) if true is
+    # given. Gains that are too large for the time step make the estimates
+    # blow up - their RMSE is inf.
+    single = (np.ndim(M) == 2)
+    if single:
+        M, N = M[None], N[None]
+    G = len(M)
+    T = len(z)
+    x = np.zeros((G, 9)) if x0 is None else np.broadcast_to(np.asarray(x0, dtype=float), (G, 9)).copy()
+    estimates = np.empty((G, T, 9)) if keep_estimates else None
+    squared_error = np.zeros((G, 9))
+    Mt = np.ascontiguousarray(np.swapaxes(M, 1, 2))
+    with np.errstate(over='ignore', invalid='ignore'):
+        for k0 in range(0, T, chunk):
+            k1 = min(k0 + chunk, T)
+            Nz = np.einsum('gij,tj->tgi', N, z[k0:k1])
+            block = np.empty((k1 - k0, G, 9))
+            for k in range(k1 - k0):
+                # (the loop stores estimates after each update, so does this)
+                x = np.matmul(x[:, None, :], Mt)[:, 0, :] + Nz[k]
+                block[k] = x
+            if keep_estimates:
+                estimates[:, k0:k1] = np.swapaxes(block, 0, 1)
+            if true is not None:
+                squared_error += np.sum((block - true[k0:k1, None, :]) ** 2, axis=0)
+    rmse = None
+    if true is not None:
+        rmse = np.sqrt(squared_error / T)
+        rmse[~np.isfinite(rmse)] = np.inf
+    if single:
+        estimates = estimates[0] if keep_estimates else None
+        rmse = rmse[0] if rmse is not None else None
+    return estimates, rmse
+
+
+def _sweep_flight(args):
+    filename, gains, model, g, keep_estimates = args
+    data = load_observer_data(filename, model=model)
+    M, N = update_matrices(gains, model=data['model'], g=g)
+    estimates, rmse = run_observer(M, N, data['z'], true=data['true'], keep_estimates=keep_estimates)
+    return filename, data['time'], estimates, rmse
+
+
+def sweep(gains, filenames, model=None, g=g, workers=None, keep_estimates=False):
+    # Run the offline observer with every gain (an array of shape (G, 9, n),
+    # or a list of such gains) on every flight, one flight per process.
+    # Returns a dict with the RMSE of each state for each (gain, flight) pair
+    # (shape (G, F, 9)), and the estimates for each flight (each of shape
+    # (G, T, 9)) if keep_estimates is True. Every flight must have the
+    # outputs of model (chosen from the first flight if not given).
+    gains = np.asarray(gains, dtype=float)
+    if gains.ndim == 2:
+        gains = gains[None]
+    if model is None:
+        model = 'lighthouse' if _has_outputs(filenames[0], 'lighthouse') else 'flow'
+    jobs = [(filename, gains, model, g, keep_estimates) for filename in filenames]
+    if workers == 1 or len(filenames) == 1:
+        results = list(map(_sweep_flight, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_sweep_flight, jobs))
+    return {
+        'model': model,
+        'states': states,
+        'flights': [r[0] for r in results],
+        'time': {r[0]: r[1] for r in results},
+        'rmse': np.stack([r[3] for r in results], axis=1),
+        'estimates': {r[0]: r[2] for r in results} if keep_estimates else None,
+    }
+
+
+def notebook_loop(data, g=g):
+    # The loop from the notebooks (for checking against)
+    z = data['z']
+    o_x = o_y = o_z = psi = theta = phi = v_x = v_y = v_z = 0.
+    out = np.empty((len(z), 9))
+    for i in range(len(z)):
+        w_x, w_y, w_z, a_z, one, lh_x, lh_y, lh_z = z[i]
+        lh_x_err = o_x - lh_x
+        lh_y_err = o_y - lh_y
+        lh_z_err = o_z - lh_z
+        o_x += dt * (-17.7581819124871*lh_x_err + 1.0*v_x)
+        o_y += dt * (-17.7223121570295*lh_y_err + 1.0*v_y)
+        o_z += dt * (-21.4301189917369*lh_z_err + 1.0*v_z)
+        psi += dt * (w_z)
+        theta += dt * (-34.3333333333332*lh_x_err + w_y)
+        phi += dt * (50.7499999999999*lh_y_err + w_x)
+        v_x += dt * (-120.120956862936*lh_x_err + 9.81*theta)
+        v_y += dt * (-135.915174095598*lh_y_err - 9.81*phi)
+        v_z += dt * (a_z - g - 93.5000000000001*lh_z_err)
+        out[i] = [o_x, o_y, o_z, psi, theta, phi, v_x, v_y, v_z]
+    return out
+
+
+if __name__ == '__main__':
+    # Sweep random gains over flights (by default every con_test_*.json and
+    # lab9_*.json in the current directory) and show the best ones, e.g.,
+    #
+    #   python Final_Code/observer.py --gains 500
+    #
+    parser = argparse.ArgumentParser(description='Sweep observer gains over logged flights.')
+    parser.add_argument('filenames', nargs='*')
+    parser.add_argument('--gains', type=int, default=200, help='number of random gains per model')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    filenames = args.filenames or sorted(glob.glob('con_test_*.json')) + sorted(glob.glob('lab9_*.json'))
+
+    # Check against the loop in the notebooks
+    lighthouse_flights = [f for f in filenames if _has_outputs(f, 'lighthouse')]
+    if lighthouse_flights:
+        data = load_observer_data(lighthouse_flights[0], model='lighthouse')
+        start_time = time.perf_counter()
+        expected = notebook_loop(data)
+        loop_time = time.perf_counter() - start_time
+        M, N = update_matrices(notebook_gain())
+        estimates, rmse = run_observer(M, N, data['z'])
+        print(f'{lighthouse_flights[0]}: max difference from the notebook loop {np.max(np.abs(estimates - expected)):.1e} '
+              f'(the loop takes {loop_time * 1e3:.0f} ms per gain)')
+
+    for model in models:
+        flights = [f for f in filenames if _has_outputs(f, model) and (model == 'lighthouse' or not _has_outputs(f, 'lighthouse'))]
+        if not flights:
+            continue
+        gains = random_gains(args.gains, model=model)
+        gains = np.concatenate([[observer_gain(model)], gains])
+        start_time = time.perf_counter()
+        result = sweep(gains, flights, model=model, workers=args.workers)
+        elapsed = time.perf_counter() - start_time
+        # Score each gain by its RMSE over every observed state and flight
+        score = np.mean(result['rmse'][:, :, models[model]['observed']], axis=(1, 2))
+        best = np.argsort(score)[:3]
+        print(f'{model}: {len(gains)} gains x {len(flights)} flights in {elapsed:.2f} s '
+              f'({np.sum(~np.isfinite(score))} gains diverged)')
+        print(f' default gain: mean RMSE {score[0]:.4f}')
+        for i in best:
+            print(f' gain {i:4d}:      mean RMSE {score[i]:.4f}')
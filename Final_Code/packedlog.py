@@ -0,0 +1,346 @@
+import os
+import sys
+import bz2
+import json
+import lzma
+import mmap
+import time
+import zlib
+import struct
+from collections.abc import Mapping
+import numpy as np
+from flightlog import DEFAULT_PERIOD_IN_MS, blocks_from_data
+
+# Compressed flight log format for archiving (version 1)
+#
+#   header      8-byte magic, uint16 version, uint16 compression (an index
+#               into compression_names), uint32 length of the table, all
+#               little-endian
+#   table       utf-8 JSON, compressed like everything else, that looks like
+#               {'blocks': [{'name': 'LogConf0', 'period_in_ms': 10, 'count': 1234,
+#                            'variables': [{'name': 'ae483log.o_x', 'dtype': '<f4', 'encoding': 'xor'}, ...],
+#                            'chunks': [{'t0': 51230, 't1': 61220, 'count': 1000,
+#                                        'time': [offset, '<u1', [[length, 1]]],
+#                                        'columns': [[offset, '<u4', [[length, 1], [length, 0], ...]], ...]}, ...]}, ...]}
+#   columns     byte planes of each column (offsets are from the end of the
+#               table), compressed if the [length, compressed] pair says so
+#
+# Each log block is cut into chunks of chunk_seconds worth of samples, and
+# every column of every chunk is compressed on its own, so any variable at
+# any time can be read by decompressing only the chunks that hold it. Before
+# it is compressed, each column is turned into something that compresses
+# well when values change slowly, and its bytes are split into planes (the
+# first byte of every value, then the second byte of every value, ...). Each
+# plane is compressed on its own, unless that would not make it at least
+# min_saving smaller - the low bytes of noisy floats are close to random, and
+# are faster to read if they are simply copied:
+#
+#   time        differences between consecutive timestamps (t0 for the first
+#               one), in the smallest type that holds them - almost all of
+#               them are the period of the block
+#   'delta'     integers (e.g. motor commands): differences between
+#               consecutive values, which wrap around like the type itself
+#   'xor'       floats: the bits of each value XORed with those of the value
+#               before it
+#   'quantized' floats rounded to the nearest multiple of 'step' (so they
+#               are off by at most step / 2), stored as differences between
+#               consecutive multiples, in the smallest type that holds them
+#
+# Only 'quantized' loses anything - every other column comes back exactly as
+# it was written (floats in the type they were logged in, i.e., float32).
+MAGIC = b'AE483PAK'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+EXTENSION = '.aepack'
+
+# Planes that compression does not make at least this much smaller are
+# stored as they are (for the flights in this repository, this makes reading
+# about half again as fast, and files only a few percent bigger)
+min_saving = 0.3
+
+# Compression of the table and columns (standard library only)
+compression_names = ['zlib', 'lzma', 'bz2']
+compressors = {
+    'zlib': (lambda raw: zlib.compress(raw, 9), zlib.decompress),
+    'lzma': (lambda raw: lzma.compress(raw, preset=9), lzma.decompress),
+    'bz2': (lambda raw: bz2.compress(raw, 9), bz2.decompress),
+}
+
+
+def _planes(values):
+    # Byte planes of values (one row per byte of the type)
+    return np.ascontiguousarray(values).view(np.uint8).reshape(len(values), values.dtype.itemsize).T
+
+
+def _from_planes(raw, dtype, count):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, count).T.copy().view(dtype).reshape(count)
+
+
+def _smallest_int_dtype(values):
+    if len(values) == 0 or values.min() >= 0:
+        candidates = ['<u1', '<u2', '<u4', '<u8']
+    else:
+        candidates = ['<i1', '<i2', '<i4', '<i8']
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return np.dtype(dtype)
+    return np.dtype('<i8')
+
+
+def _bits_dtype(dtype):
+    return np.dtype(f'<u{dtype.itemsize}')
+
+
+def _encode_column(values, var):
+    # (stored values, in the dtype in which they are stored)
+    if var['encoding'] == 'quantized':
+        q = np.rint(values.astype(np.float64) / var['step']).astype(np.int64)
+        d = np.diff(q, prepend=np.int64(0))
+        return d.astype(_smallest_int_dtype(d))
+    if var['encoding'] == 'xor':
+        bits = values.view(_bits_dtype(values.dtype))
+        d = bits.copy()
+        d[1:] ^= bits[:-1]
+        return d
+    return np.diff(values, prepend=values.dtype.type(0))
+
+
+def _decode_column(stored, var):
+    dtype = np.dtype(var['dtype'])
+    if var['encoding'] == 'quantized':
+        return np.cumsum(stored, dtype=np.int64) * var['step']
+    if var['encoding'] == 'xor':
+        return np.bitwise_xor.accumulate(stored).view(dtype)
+    return np.cumsum(stored, dtype=dtype)
+
+
+def _max_error_of(v, max_error):
+    # (a variable takes precedence over its group, as in log_rates)
+    if v in max_error:
+        return max_error[v]
+    return max_error.get(v.split('.')[0])
+
+
+def write_packed_log(filename, data, chunk_seconds=10., max_error=None, compression='zlib'):
+    # Write logged data (a TelemetryStore, a FlightLog or a dict in the JSON
+    # layout) in the format above. max_error maps variables, or groups of
+    # variables (e.g., 'stateEstimate'), to how far off their values may be
+    # when they are read back - only those floats are quantized.
+    compress = compressors[compression][0]
+    max_error = max_error or {}
+    table = {'blocks': []}
+    payloads = []
+    offset = 0
+
+    def add(values):
+        nonlocal offset
+        entry = [offset, values.dtype.str, []]
+        for plane in _planes(values):
+            plane = plane.tobytes()
+            payload = compress(plane)
+            compressed = len(payload) < (1. - min_saving) * len(plane)
+            if not compressed:
+                payload = plane
+            payloads.append(payload)
+            entry[2].append([len(payload), int(compressed)])
+            offset += len(payload)
+        return entry
+
+    for name, t, variables, period in blocks_from_data(data):
+        t = np.asarray(t, dtype=np.int64)
+        block = {'name': name, 'period_in_ms': period, 'count': len(t), 'variables': [], 'chunks': []}
+        columns = []
+        for v, values in variables:
+            values = np.asarray(values)
+            values = values.astype(values.dtype.newbyteorder('<'))
+            var = {'name': v, 'dtype': values.dtype.str}
+            if values.dtype.kind == 'f':
+                error = _max_error_of(v, max_error)
+                if error is not None:
+                    var['encoding'] = 'quantized'
+                    var['step'] = 2. * error
+                else:
+                    var['encoding'] = 'xor'
+            else:
+                var['encoding'] = 'delta'
+            block['variables'].append(var)
+            columns.append(values)
+
+        chunk_length = max(int(round(chunk_seconds * 1000. / period)), 1)
+        for i0 in range(0, len(t), chunk_length):
+            i1 = min(i0 + chunk_length, len(t))
+            dt = np.diff(t[i0:i1], prepend=t[i0])
+            block['chunks'].append({
+                't0': int(t[i0]),
+                't1': int(t[i1 - 1]),
+                'count': i1 - i0,
+                'time': add(dt.astype(_smallest_int_dtype(dt))),
+                'columns': [add(_encode_column(values[i0:i1], var)) for var, values in zip(block['variables'], columns)],
+            })
+        table['blocks'].append(block)
+
+    table_bytes = compress(json.dumps(table, separators=(',', ':')).encode('utf-8'))
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, compression_names.index(compression), len(table_bytes)))
+        f.write(table_bytes)
+        for payload in payloads:
+            f.write(payload)
+
+
+class PackedFlightLog(Mapping):
+    # Compressed flight log. Indexing by variable name gives {'time': ...,
+    # 'data': ..., 'period_in_ms': ...} like the other formats, decompressing
+    # only that variable (and its block's timestamps, once per block), and
+    # window gives only the chunks around a span of time.
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, compression, table_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a packed flight log')
+        if version != VERSION:
+            raise ValueError(f'{filename} has version {version} but only version {VERSION} is supported')
+        self.compression = compression_names[compression]
+        self.decompress = compressors[self.compression][1]
+        self.data_offset = HEADER.size + table_length
+        self.blocks = json.loads(self.decompress(self.buffer[HEADER.size:self.data_offset]))['blocks']
+        self.variables = {}
+        for block in self.blocks:
+            for j, var in enumerate(block['variables']):
+                self.variables[var['name']] = (block, j)
+        self.times = {}
+
+    def _read(self, entry, count):
+        offset, dtype, planes = entry
+        start = self.data_offset + offset
+        raw = []
+        for length, compressed in planes:
+            payload = self.buffer[start:start + length]
+            raw.append(self.decompress(payload) if compressed else payload)
+            start += length
+        return _from_planes(raw[0] if len(raw) == 1 else b''.join(raw), dtype, count)
+
+    def _chunk_time(self, chunk):
+        return chunk['t0'] + np.cumsum(self._read(chunk['time'], chunk['count']), dtype=np.int64)
+
+    def _chunk_data(self, chunk, var, j):
+        return _decode_column(self._read(chunk['columns'][j], chunk['count']), var)
+
+    def _concatenate(self, pieces, dtype):
+        if len(pieces) == 1:
+            return pieces[0]
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=dtype)
+
+    def get_time(self, v):
+        block, j = self.variables[v]
+        if block['name'] not in self.times:
+            self.times[block['name']] = self._concatenate([self._chunk_time(chunk) for chunk in block['chunks']], np.int64)
+        return self.times[block['name']]
+
+    def get_data(self, v):
+        block, j = self.variables[v]
+        var = block['variables'][j]
+        return self._concatenate([self._chunk_data(chunk, var, j) for chunk in block['chunks']], var['dtype'])
+
+    def get_period(self, v):
+        block, j = self.variables[v]
+        return block.get('period_in_ms', DEFAULT_PERIOD_IN_MS)
+
+    def first_time(self, v):
+        # First timestamp of v (without decompressing anything)
+        block, j = self.variables[v]
+        return block['chunks'][0]['t0'] if block['chunks'] else None
+
+    def last_time(self, v):
+        # Last timestamp of v (decompressing only the timestamps of its last
+        # chunk)
+        block, j = self.variables[v]
+        return int(self._chunk_time(block['chunks'][-1])[-1]) if block['chunks'] else None
+
+    def window(self, v, start, end):
+        # Samples of v from drone time start to end (in ms), plus at least
+        # one on either side if there are any, decompressing only the chunks
+        # that hold them
+        block, j = self.variables[v]
+        var = block['variables'][j]
+        chunks = block['chunks']
+        i0 = 0
+        while i0 + 1 < len(chunks) and chunks[i0 + 1]['t0'] < start:
+            i0 += 1
+        i1 = i0
+        while i1 < len(chunks) and chunks[i1]['t0'] <= end:
+            i1 += 1
+        # (the sample just before start may be the last one of the chunk
+        # before, and the one just after end the first one of the next chunk)
+        i0 = max(i0 - 1, 0)
+        i1 = min(i1 + 1, len(chunks))
+        return {
+            'time': self._concatenate([self._chunk_time(chunk) for chunk in chunks[i0:i1]], np.int64),
+            'data': self._concatenate([self._chunk_data(chunk, var, j) for chunk in chunks[i0:i1]], var['dtype']),
+            'period_in_ms': self.get_period(v),
+        }
+
+    def __getitem__(self, v):
+        return {'time': self.get_time(v), 'data': self.get_data(v), 'period_in_ms': self.get_period(v)}
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+    def to_dict(self):
+        return {
+            v: {'time': val['time'].tolist(), 'data': val['data'].tolist(), 'period_in_ms': val['period_in_ms']}
+            for v, val in self.items()
+        }
+
+
+def read_packed_log(filename):
+    return PackedFlightLog(filename)
+
+
+if __name__ == '__main__':
+    # Pack flight logs and compare them with the JSON logs, e.g.,
+    #
+    #   python Final_Code/packedlog.py NOOR_flight_4.json N_data.json
+    #
+    # (add --lzma or --bz2 to compress with those instead of zlib)
+    compression = 'zlib'
+    filenames = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            compression = arg[2:]
+        else:
+            filenames.append(arg)
+    for json_filename in filenames or ['NOOR_flight_4.json']:
+        packed_filename = os.path.splitext(json_filename)[0] + EXTENSION
+        with open(json_filename, 'r') as f:
+            data = json.load(f)
+
+        start_time = time.perf_counter()
+        write_packed_log(packed_filename, data, compression=compression)
+        write_time = time.perf_counter() - start_time
+
+        # (best of a few reads, since the first one also reads the file from
+        # disk)
+        read_time = np.inf
+        for i in range(5):
+            start_time = time.perf_counter()
+            log = read_packed_log(packed_filename)
+            arrays = {v: (log.get_time(v), log.get_data(v)) for v in log}
+            read_time = min(read_time, time.perf_counter() - start_time)
+        decoded_bytes = sum(d.nbytes for t, d in arrays.values()) + sum(t.nbytes for t in log.times.values())
+
+        for v, val in data.items():
+            assert np.array_equal(arrays[v][0], val['time']) and np.array_equal(arrays[v][1], val['data']), v
+
+        json_size = os.path.getsize(json_filename)
+        packed_size = os.path.getsize(packed_filename)
+        print(f'{json_filename} -> {packed_filename} ({compression})')
+        print(f' size:  {json_size / 1e6:8.3f} MB -> {packed_size / 1e6:8.3f} MB ({json_size / packed_size:5.1f}x smaller)')
+        print(f' write: {write_time * 1e3:8.1f} ms')
+        print(f' read:  {read_time * 1e3:8.1f} ms ({decoded_bytes / 1e6 / read_time:6.1f} MB/s of decoded data)')
@@ -0,0 +1,127 @@
+import time
+import threading
+import numpy as np
+
+# Queue of parameter writes. set() never waits for the radio: it hands the
+# write to cflib (which queues it, and sends it once every write before it
+# has been acknowledged) and returns.
+# Each parameter has at most one write in flight - if it is set again before
+# the drone has acknowledged the last write, only the newest value is kept
+# and it is sent as soon as that acknowledgement arrives. Every write is
+# recorded with the times it was requested, sent to cflib and acknowledged,
+# and writes that cflib refused (e.g., a parameter that is not in the TOC) are
+# kept in failed with the error.
+
+
+class NullParam:
+    # Stands in for cflib's Param when there is no drone (see
+    # SimpleClient.offline): every write is acknowledged as soon as it is sent
+    def __init__(self):
+        self.callbacks = {}
+        self.values = {}
+
+    def add_update_callback(self, group=None, name=None, cb=None):
+        self.callbacks[f'{group}.{name}'] = cb
+
+    def set_value(self, complete_name, value):
+        self.values[complete_name] = str(value)
+        self.callbacks[complete_name](complete_name, self.values[complete_name])
+
+
+class ParamWriter:
+    def __init__(self, param=None):
+        # (with no param, writes go nowhere and are acknowledged at once)
+        self.param = param if param is not None else NullParam()
+        self.lock = threading.Condition()
+        self.in_flight = {}
+        self.pending = {}
+        self.registered = set()
+        self.history = []
+        self.failed = []
+
+    def set(self, name, value, on_ack=None):
+        # on_ack, if given, is called with the acknowledged value (a string)
+        # from a cflib thread once this write - or a newer one to the same
+        # parameter that replaced it - has been acknowledged
+        with self.lock:
+            if name not in self.registered:
+                group, param_name = name.split('.')
+                self.param.add_update_callback(group=group, name=param_name, cb=self._param_updated)
+                self.registered.add(name)
+            write = {
+                'name': name,
+                'value': value,
+                'requested': time.monotonic(),
+                'sent': None,
+                'acknowledged': None,
+                'coalesced': 0,
+                'on_ack': [on_ack] if on_ack is not None else [],
+            }
+            if name in self.in_flight:
+                if name in self.pending:
+                    old = self.pending[name]
+                    write['coalesced'] = old['coalesced'] + 1
+                    write['on_ack'] = old['on_ack'] + write['on_ack']
+                self.pending[name] = write
+                return
+            self._send(write)
+
+    def set_many(self, values):
+        # Queue several writes at once (cflib still sends them one at a time)
+        for name, value in values.items():
+            self.set(name, value)
+
+    def _send(self, write):
+        # (a write stays in flight only if cflib takes it - if it raises, the
+        # write is recorded as failed and the error is raised again)
+        write['sent'] = time.monotonic()
+        self.in_flight[write['name']] = write
+        try:
+            self.param.set_value(write['name'], write['value'])
+        except Exception as e:
+            del self.in_flight[write['name']]
+            write['sent'] = None
+            write['error'] = repr(e)
+            write.pop('on_ack')
+            self.failed.append(write)
+            self.lock.notify_all()
+            raise
+
+    def _param_updated(self, name, value):
+        # Called by cflib when the drone reports the value of a parameter
+        with self.lock:
+            write = self.in_flight.pop(name, None)
+            if write is None:
+                return
+            write['acknowledged'] = time.monotonic()
+            on_ack = write.pop('on_ack')
+            self.history.append(write)
+            if name in self.pending:
+                try:
+                    self._send(self.pending.pop(name))
+                except Exception as e:
+                    print(f'Could not set {name} because {e!r}')
+            self.lock.notify_all()
+        for callback in on_ack:
+            callback(value)
+
+    def wait(self, timeout=None):
+        # Wait until every write so far has been acknowledged
+        with self.lock:
+            return self.lock.wait_for(lambda: not self.in_flight and not self.pending, timeout=timeout)
+
+    def stats(self):
+        latency = np.array([w['acknowledged'] - w['requested'] for w in self.history]) * 1e3
+        return {
+            'writes': len(self.history),
+            'coalesced': sum(w['coalesced'] for w in self.history),
+            'unacknowledged': len(self.in_flight) + len(self.pending),
+            'failed': len(self.failed),
+            'latency_mean_ms': float(np.mean(latency)) if len(latency) else 0.,
+            'latency_max_ms': float(np.max(latency)) if len(latency) else 0.,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f'Wrote {s["writes"]} parameters ({s["coalesced"]} writes coalesced, {s["unacknowledged"]} unacknowledged, {s["failed"]} failed, '
+              f'request to acknowledgement mean {s["latency_mean_ms"]:.1f} ms, max {s["latency_max_ms"]:.1f} ms)')
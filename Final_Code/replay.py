@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+from flightlog import load_channels
+from analysis import load_hardware_data
+from setpoints import Samples
+
+# Fly a recorded flight again, i.e., send the setpoints that were logged during
+# that flight at the same times, e.g., to compare controllers or observers on
+# exactly the same trajectory:
+#
+#   python Final_Code/replay.py NOOR_flight_4.json --controller --output NOOR_flight_4_custom.json
+#
+# The setpoints are read from the log (only those variables) and resampled at
+# the rate of the setpoint scheduler once, before anything is sent, so each
+# tick of the replay only looks up the next row (see Samples in setpoints.py).
+# The replayed flight is logged like any other flight, and compared with the
+# recorded one at the end.
+
+# Variables in which each controller logs its setpoint
+setpoint_variables = {
+    'ctrltarget': ['ctrltarget.x', 'ctrltarget.y', 'ctrltarget.z'],
+    'ae483log': ['ae483log.o_x_des', 'ae483log.o_y_des', 'ae483log.o_z_des'],
+}
+
+
+def load_setpoints(filename, rate=50., source=None, only_in_flight=True):
+    # Setpoints of a recorded flight sampled every 1 / rate seconds, as (p,
+    # source), where p has one row (x, y, z, yaw) per sample and source is
+    # the key of setpoint_variables they came from. If source is None, this
+    # is whichever of them has a positive z for longer (as in analysis.py).
+    # If only_in_flight is True, samples before the first positive z and
+    # after the last one are left out. Yaw is always zero, since it is not
+    # logged (and every flight so far has been flown at zero yaw).
+    candidates = {}
+    for key, variables in setpoint_variables.items():
+        if source is not None and key != source:
+            continue
+        try:
+            candidates[key] = load_channels(filename, variables)
+        except KeyError:
+            continue
+    if not candidates:
+        raise ValueError(f'{filename} has no setpoints (it should have logged {" or ".join(v[-1] for v in setpoint_variables.values())})')
+    source = max(candidates, key=lambda key: np.count_nonzero(np.asarray(candidates[key][setpoint_variables[key][2]]['data']) > 0))
+    data = candidates[source]
+
+    # (the variables may be in different log blocks, so each one is
+    # interpolated from its own timestamps)
+    t_min = max(data[v]['time'][0] for v in setpoint_variables[source])
+    t_max = min(data[v]['time'][-1] for v in setpoint_variables[source])
+    t = t_min + np.arange(0., t_max - t_min + 1e-9, 1000. / rate)
+    p = np.zeros((len(t), 4))
+    for j, v in enumerate(setpoint_variables[source]):
+        p[:, j] = np.interp(t, np.asarray(data[v]['time'], dtype=np.float64), np.asarray(data[v]['data'], dtype=np.float64))
+    if only_in_flight:
+        flying = np.nonzero(p[:, 2] > 0)[0]
+        if len(flying) < 2:
+            raise ValueError(f'The setpoints in {filename} never have a positive z')
+        p = p[flying[0]:flying[-1] + 1]
+    return p, source
+
+
+def replay(client, p, rate, start_at=None, wait=True):
+    # Send setpoints p (from load_setpoints, sampled at rate) with client (a
+    # SimpleClient). Returns an event that is set when they have all been
+    # sent (after waiting for it, unless wait is False).
+    done = client.setpoints.add(Samples(p, rate), start_at=start_at)
+    if wait:
+        client.setpoints.wait(done)
+    return done
+
+
+def tracking_error(filename, source):
+    # RMSE between the position from the default observer and the setpoint,
+    # in each direction, while the drone was flying
+    variables = setpoint_variables[source] + ['stateEstimate.x', 'stateEstimate.y', 'stateEstimate.z']
+    data = load_hardware_data(filename, only_in_flight=True, variables=variables)
+    rmse = {}
+    for axis, v in zip(['x', 'y', 'z'], setpoint_variables[source]):
+        rmse[axis] = float(np.sqrt(np.mean((data[f'stateEstimate.{axis}'] - data[v]) ** 2)))
+    rmse['duration'] = float(data['time'][-1] - data['time'][0])
+    return rmse
+
+
+def compare_runs(recorded, replayed, source):
+    print(f'{"":12s} {"recorded":>12s} {"replayed":>12s}')
+    errors = [tracking_error(recorded, source), tracking_error(replayed, source)]
+    for key in ['x', 'y', 'z']:
+        print(f'{"rmse " + key + " (m)":12s} {errors[0][key]:12.4f} {errors[1][key]:12.4f}')
+    print(f'{"duration (s)":12s} {errors[0]["duration"]:12.2f} {errors[1]["duration"]:12.2f}')
+    return errors
+
+
+if __name__ == '__main__':
+    import cflib.crtp
+    from flight import SimpleClient, uri as default_uri
+
+    parser = argparse.ArgumentParser(description='Fly the setpoints of a recorded flight again and log the new flight')
+    parser.add_argument('filename', help='recorded flight log (JSON or .aelog)')
+    parser.add_argument('--uri', default=default_uri, help='drone to fly (e.g., sim://model for the simulator)')
+    parser.add_argument('--controller', action='store_true', help='use the ae483 controller')
+    parser.add_argument('--observer', action='store_true', help='use the ae483 observer')
+    parser.add_argument('--source', choices=list(setpoint_variables), help='which logged setpoints to replay (by default, whichever was positive for longer)')
+    parser.add_argument('--output', help='where to write the new flight log (by default, the name of the recorded one ending in _replay)')
+    args = parser.parse_args()
+    output = args.output or '_replay'.join(os.path.splitext(args.filename))
+
+    logging.basicConfig(level=logging.ERROR)
+    cflib.crtp.init_drivers()
+    client = SimpleClient(args.uri, use_controller=args.controller, use_observer=args.observer)
+    rate = 1. / client.setpoints.period
+
+    # Load and resample the setpoints while connecting
+    start_time = time.perf_counter()
+    p, source = load_setpoints(args.filename, rate=rate, source=args.source)
+    print(f'Loaded {len(p)} setpoints ({len(p) / rate:.2f} s at {rate:.0f} Hz, from {source}) in {(time.perf_counter() - start_time) * 1e3:.1f} ms')
+
+    client.wait_until_ready()
+    client.params.wait()
+    client.stop(0.1)
+    replay(client, p, rate)
+    client.stop(1.0)
+    client.disconnect()
+    client.write_data(output)
+    compare_runs(args.filename, output, source)
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from analysis import resample_flight_data
+from archive import file_hash, find_flight_logs
+from flightlog import load_flight_log
+from frames import default_observer_angles, default_observer_velocity
+from observer import inputs, models, notebook_gain, observer_gain, update_matrices, run_observer
+
+# Renders the figures and RMSE tables of Data_Analysis.ipynb for many flights
+# at once, with no display (one process per flight, on every CPU core), e.g.,
+#
+#   python Final_Code/report.py
+#
+# from the repository root writes, for every flight log in the repository,
+#
+#   reports/<flight>/comparison.png     the nine-panel comparison_plot figure
+#   reports/<flight>/x-z.png            x-z path (like x-z_noor.png)
+#   reports/<flight>/x-y.png            top down path (like x-y-noor.png)
+#   reports/<flight>/rmse.txt           controller and observer RMSE
+#
+# and a table of every flight's RMSE in reports/rmse.txt. A flight is only
+# rendered again if its log (or the code that reads and analyzes it - see
+# code_files) has changed since the last time, so running it again after one
+# more flight only renders that flight.
+INDEX_VERSION = 2
+
+# Modules whose code changes what is rendered for a flight
+code_files = ['report.py', 'analysis.py', 'observer.py', 'frames.py', 'flightlog.py', 'packedlog.py']
+
+# Figures that are rendered for each flight
+figures = ['comparison.png', 'x-z.png', 'x-y.png']
+dpi = 100
+# (fast PNG compression - the files are a little bigger, but writing them
+# takes a fraction of the time)
+pil_kwargs = {'compress_level': 1}
+
+# States in the order of the comparison plot, as (name, custom observer
+# variable) - the default observer and the offline observer give the same
+# states in the same order (see observer.py)
+panels = [
+    ('o_x', 'ae483log.o_x'),
+    ('o_y', 'ae483log.o_y'),
+    ('o_z', 'ae483log.o_z'),
+    ('psi', 'ae483log.psi'),
+    ('theta', 'ae483log.theta'),
+    ('phi', 'ae483log.phi'),
+    ('v_x', 'ae483log.v_x'),
+    ('v_y', 'ae483log.v_y'),
+    ('v_z', 'ae483log.v_z'),
+]
+default_variables = [
+    'stateEstimate.x', 'stateEstimate.y', 'stateEstimate.z',
+    'stateEstimate.yaw', 'stateEstimate.pitch', 'stateEstimate.roll',
+    'stateEstimate.vx', 'stateEstimate.vy', 'stateEstimate.vz',
+]
+# Desired position from the custom controller, or else the default one
+desired_variables = [
+    ['ae483log.o_x_des', 'ae483log.o_y_des', 'ae483log.o_z_des'],
+    ['ctrltarget.x', 'ctrltarget.y', 'ctrltarget.z'],
+]
+
+
+def code_hash():
+    # Reports are rendered again (and files that were found not to be flights
+    # are looked at again) whenever any of code_files changes
+    h = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in code_files:
+        with open(os.path.join(directory, name), 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def rmse(x, y):
+    return float(np.sqrt(np.mean((x - y) ** 2)))
+
+
+def load_report_data(log):
+    # Everything the figures need from a flight log (only those variables are
+    # read), resampled like in the notebook (the whole flight, not just while
+    # in flight), as {name: [custom, default, offline]} for each state, plus
+    # time and the desired position. Returns None if the flight has no state
+    # estimates at all.
+    logged = set(log.keys())
+    customs = [v for name, v in panels if v in logged]
+    defaults = [v for v in default_variables if v in logged]
+    desired = next((d for d in desired_variables if all(v in logged for v in d)), [])
+    model = next((m for m in ['lighthouse', 'flow'] if all(v in logged for v in inputs + models[m]['outputs'])), None)
+    offline = inputs + models[model]['outputs'] if model is not None else []
+    if not customs and len(defaults) < len(default_variables):
+        return None
+    variables = list(dict.fromkeys(customs + defaults + desired + offline))
+    t, values, columns = resample_flight_data(log, variables=variables)
+    data = {'time': t}
+    for k, j in columns.items():
+        data[k] = values[:, j]
+
+    states = {name: [data.get(v), None, None] for name, v in panels}
+    if len(defaults) == len(default_variables):
+        psi, theta, phi = default_observer_angles(data)
+        v_x, v_y, v_z = default_observer_velocity(data)
+        values = [data['stateEstimate.x'], data['stateEstimate.y'], data['stateEstimate.z'], psi, theta, phi, v_x, v_y, v_z]
+        for (name, v), value in zip(panels, values):
+            states[name][1] = value
+    if model is not None:
+        # (the offline observer, with the gain from the notebook if the
+        # lighthouse was logged)
+        L = notebook_gain() if model == 'lighthouse' else observer_gain(model)
+        M, N = update_matrices(L, model=model)
+        z = np.column_stack([data[k] for k in inputs] + [np.ones(len(data['time']))] + [data[k] for k in models[model]['outputs']])
+        estimates, _ = run_observer(M, N, z)
+        for j, (name, v) in enumerate(panels):
+            states[name][2] = estimates[:, j]
+    return {
+        'time': data['time'],
+        'states': states,
+        'desired': [data[v] for v in desired] if desired else None,
+        'model': model,
+    }
+
+
+# Figures are made once in each process, and only their data changes from
+# one flight to the next (making the axes, ticks and legends of the nine-panel
+# figure takes longer than drawing it)
+_figures = {}
+
+
+def _set_lines(ax, lines, series, shown, loc='best'):
+    # Show series ((x, y) for each line, or None if it is missing) on lines,
+    # and make the legend again only if which of them are shown has changed
+    for line, xy in zip(lines, series):
+        line.set_visible(xy is not None)
+        line.set_data(xy if xy is not None else ([], []))
+    visible = tuple(xy is not None for xy in series)
+    if shown.get(ax) != visible:
+        ax.legend(handles=[line for line, v in zip(lines, visible) if v], loc=loc)
+        shown[ax] = visible
+    ax.relim(visible_only=True)
+    ax.autoscale_view()
+
+
+def plot_comparison(r, filename):
+    # The comparison_plot figure of the notebook (custom, offline custom and
+    # default observer, and the desired position, for each state)
+    if 'comparison' not in _figures:
+        fig, axes = plt.subplots(9, 1, figsize=(15, 25), sharex=True)
+        lines = []
+        for j, ((name, v), ax) in enumerate(zip(panels, axes)):
+            lines.append([
+                ax.plot([], [], label=f'{name} (custom observer)', linewidth=2)[0],
+                ax.plot([], [], '--', label=f'{name} (custom observer - offline)', linewidth=3)[0],
+                ax.plot([], [], ':', label=f'{name} (default observer)', linewidth=4)[0],
+            ] + ([ax.plot([], [], '-.', label=f'{name} (desired)', linewidth=2)[0]] if j < 3 else []))
+            ax.grid()
+        axes[-1].set_xlabel('time (s)')
+        _figures['comparison'] = (fig, axes, lines, {})
+    fig, axes, lines, shown = _figures['comparison']
+    t = r['time']
+    for j, (name, v) in enumerate(panels):
+        s_custom, s_default, s_offline = r['states'][name]
+        series = [s_custom, s_offline, s_default]
+        if j < 3:
+            series.append(r['desired'][j] if r['desired'] is not None else None)
+        _set_lines(axes[j], lines[j], [(t, s) if s is not None else None for s in series], shown)
+    fig.savefig(filename, dpi=dpi, pil_kwargs=pil_kwargs)
+
+
+def plot_path(r, filename, j):
+    # Path in the x-z plane (j = 2) or seen from above (j = 1)
+    label = 'xyz'[j]
+    if label not in _figures:
+        fig = plt.figure(figsize=(10, 10) if j == 2 else (7, 5))
+        ax = fig.gca()
+        lines = [
+            ax.plot([], [], label='position (custom observer)')[0],
+            ax.plot([], [], ':', label='position (default observer)', linewidth=4)[0],
+            ax.plot([], [], '--', label='desired position')[0],
+            ax.plot([], [], 'ro', markersize=10, label='starting position')[0],
+        ]
+        ax.set_xlabel('x Position (m)')
+        ax.set_ylabel(f'{label} Position (m)')
+        ax.axis('equal')
+        ax.grid()
+        _figures[label] = (fig, ax, lines, {})
+    fig, ax, lines, shown = _figures[label]
+    o_x, o = r['states']['o_x'], r['states'][f'o_{label}']
+    desired = r['desired']
+    series = [
+        (o_x[0], o[0]) if o_x[0] is not None and o[0] is not None else None,
+        (o_x[1], o[1]) if o_x[1] is not None else None,
+        (desired[0], desired[j]) if desired is not None else None,
+        (desired[0][:1], desired[j][:1]) if desired is not None else None,
+    ]
+    _set_lines(ax, lines, series, shown, loc='lower right' if j == 2 else 'best')
+    fig.savefig(filename, dpi=dpi, pil_kwargs=pil_kwargs)
+
+
+def flight_rmse(r):
+    # Controller RMSE (custom observer against desired position) and observer
+    # RMSE (custom against default observer), like sections 4.1 and 4.2 of
+    # the notebook - whichever of them were logged
+    result = {}
+    for j, (name, v) in enumerate(panels):
+        s_custom, s_default, s_offline = r['states'][name]
+        if j < 3 and s_custom is not None and r['desired'] is not None:
+            result[f'controller {name}'] = rmse(s_custom, r['desired'][j])
+    for name, v in panels[:6]:
+        s_custom, s_default, s_offline = r['states'][name]
+        if s_custom is not None and s_default is not None:
+            result[f'observer {name}'] = rmse(s_custom, s_default)
+    return result
+
+
+def open_flight_log(filename):
+    # The flight log in filename, or None if it is not a flight log at all
+    # (e.g., some other JSON file)
+    try:
+        log = load_flight_log(filename, lazy=True)
+    except ValueError:
+        # (neither valid JSON nor a binary or packed log)
+        return None
+    if not isinstance(log, Mapping):
+        return None
+    if isinstance(log, dict) and not all(isinstance(val, dict) and 'time' in val and 'data' in val for val in log.values()):
+        return None
+    return log
+
+
+def report_flight(filename, output_dir, content_hash, code):
+    # Runs in a worker process: render every figure of one flight and
+    # describe it (or return None if it is not a flight with state
+    # estimates). Errors in reading a flight log that is one are raised.
+    start_time = time.perf_counter()
+    log = open_flight_log(filename)
+    if log is None:
+        return None
+    r = load_report_data(log)
+    if r is None or len(r['time']) < 2:
+        return None
+    load_time = time.perf_counter() - start_time
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = [os.path.join(output_dir, f) for f in figures]
+    plot_comparison(r, outputs[0])
+    plot_path(r, outputs[1], 2)
+    plot_path(r, outputs[2], 1)
+    errors = flight_rmse(r)
+    outputs.append(os.path.join(output_dir, 'rmse.txt'))
+    with open(outputs[-1], 'w') as f:
+        f.write(f'{filename}\n')
+        for name, value in errors.items():
+            f.write(f'{name} RMSE = {value}\n')
+    stat = os.stat(filename)
+    return {
+        'file': filename,
+        'hash': content_hash,
+        'code': code,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'outputs': outputs,
+        'model': r['model'],
+        'rmse': errors,
+        'load_s': load_time,
+        'total_s': time.perf_counter() - start_time,
+    }
+
+
+def load_index(filename, code):
+    # Returns the index entries by file, and the hashes of files that were
+    # found not to be flights by the same code (files are looked at again
+    # once the code has changed, since it may read them now)
+    try:
+        with open(filename, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}, set()
+    if index.get('version') != INDEX_VERSION:
+        return {}, set()
+    ignored = set(index['ignored']) if index.get('code') == code else set()
+    return {entry['file']: entry for entry in index['flights']}, ignored
+
+
+def print_rmse_table(entries, f=sys.stdout):
+    names = list(dict.fromkeys(name for entry in entries for name in entry['rmse']))
+    width = max([len(entry['file']) for entry in entries] + [6])
+    print(f'{"flight":{width}s} ' + ' '.join(f'{name:>14s}' for name in names), file=f)
+    for entry in entries:
+        values = [f'{entry["rmse"][name]:14.4f}' if name in entry['rmse'] else f'{"-":>14s}' for name in names]
+        print(f'{entry["file"]:{width}s} ' + ' '.join(values), file=f)
+
+
+def build_reports(roots, output_dir, workers=None, force=False):
+    index_filename = os.path.join(output_dir, 'index.json')
+    code = code_hash()
+    old_entries, ignored = load_index(index_filename, code)
+    entries = {}
+    jobs = []
+    for filename, name in find_flight_logs(roots, output_dir):
+        old = old_entries.get(filename)
+        if force or old is None or old['code'] != code or not all(os.path.exists(f) for f in old['outputs']):
+            old = None
+        stat = os.stat(filename)
+        # Skip hashing files whose size and modification time are unchanged,
+        # and skip rendering files whose contents are unchanged
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            entries[filename] = old
+            continue
+        content_hash = file_hash(filename)
+        if old is not None and old['hash'] == content_hash:
+            entries[filename] = dict(old, size=stat.st_size, mtime=stat.st_mtime)
+            continue
+        if content_hash in ignored and not force:
+            continue
+        flight_dir = os.path.join(output_dir, os.path.splitext(name)[0])
+        jobs.append((filename, flight_dir, content_hash, code))
+
+    # (biggest logs first, so that no process is left with a big one at the
+    # end while the others have nothing to do)
+    jobs.sort(key=lambda job: -os.path.getsize(job[0]))
+    num_skipped = len(entries)
+    start_time = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {job: executor.submit(report_flight, *job) for job in jobs}
+            for (filename, flight_dir, content_hash, code), future in futures.items():
+                entry = future.result()
+                if entry is None:
+                    ignored.add(content_hash)
+                else:
+                    entries[filename] = entry
+                    print(f'Rendered {filename} -> {flight_dir} (loaded in {entry["load_s"]:.2f} s, done in {entry["total_s"]:.2f} s)')
+    elapsed = time.perf_counter() - start_time
+
+    flights = [entries[k] for k in sorted(entries)]
+    os.makedirs(output_dir, exist_ok=True)
+    with open(index_filename, 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'code': code, 'flights': flights, 'ignored': sorted(ignored)}, f, indent=1)
+    with open(os.path.join(output_dir, 'rmse.txt'), 'w') as f:
+        print_rmse_table(flights, f=f)
+    print_rmse_table(flights)
+    rendered = [entries[job[0]] for job in jobs if job[0] in entries]
+    if rendered:
+        print(f'Rendered {len(rendered)} flights in {elapsed:.2f} s with {workers or os.cpu_count()} processes '
+              f'(loading them took {sum(e["load_s"] for e in rendered):.2f} s and rendering {sum(e["total_s"] - e["load_s"] for e in rendered):.2f} s in total)')
+    print(f'{len(flights)} flights in {output_dir} ({len(rendered)} rendered, {num_skipped} unchanged)')
+    return flights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the figures and RMSE of Data_Analysis.ipynb for many flights')
+    parser.add_argument('roots', nargs='*', default=['.'], help='files or directories to search for flight logs')
+    parser.add_argument('--output-dir', default='reports', help='where to put the reports')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='render every flight again, even if it has not changed')
+    args = parser.parse_args()
+    build_reports(args.roots, args.output_dir, workers=args.workers, force=args.force)
@@ -0,0 +1,244 @@
+import time
+import queue
+import threading
+import collections
+import numpy as np
+
+# Streams setpoints to the drone from a dedicated thread at a fixed rate.
+# Each tick is scheduled on an absolute deadline (so the period does not
+# drift by however long it takes to send a setpoint) and samples whatever
+# segment of the trajectory is current at that moment. When one segment
+# ends the next one starts exactly where (and when) it left off, and when
+# there is nothing left to fly the last setpoint is held - but only for
+# idle_timeout seconds, after which nothing more is sent until the next
+# segment, so that the commander watchdog on the drone takes over if the
+# script that was flying it has stalled or crashed.
+
+
+class Hold:
+    # Stay at one position for dt seconds
+    def __init__(self, x, y, z, yaw, dt):
+        self.p = (x, y, z, yaw)
+        self.duration = dt
+
+    def setpoint(self, t):
+        return self.p
+
+
+class Line:
+    # Move in a straight line from p1 to p2 at constant speed
+    def __init__(self, p1, p2, yaw, speed):
+        self.p1 = np.array(p1, dtype=float)
+        self.p2 = np.array(p2, dtype=float)
+        self.yaw = yaw
+        self.duration = np.linalg.norm(self.p2 - self.p1) / speed
+
+    def setpoint(self, t):
+        # (t never exceeds the duration, so this never overshoots p2)
+        s = t / self.duration if self.duration > 0 else 1.
+        p = (1 - s) * self.p1 + s * self.p2
+        return (p[0], p[1], p[2], self.yaw)
+
+
+class Trajectory:
+    # Follow positions p[i] (and yaw[i], in degrees) at times t[i] (in seconds,
+    # starting at zero) with linear interpolation in between
+    def __init__(self, t, p, yaw):
+        self.t = np.asarray(t, dtype=float)
+        self.p = np.asarray(p, dtype=float)
+        self.yaw = np.broadcast_to(np.asarray(yaw, dtype=float), self.t.shape)
+        self.duration = self.t[-1]
+
+    def setpoint(self, t):
+        i = min(max(np.searchsorted(self.t, t, side='right'), 1), len(self.t) - 1)
+        dt = self.t[i] - self.t[i - 1]
+        s = min(max((t - self.t[i - 1]) / dt, 0.), 1.) if dt > 0 else 1.
+        p = (1 - s) * self.p[i - 1] + s * self.p[i]
+        yaw = (1 - s) * self.yaw[i - 1] + s * self.yaw[i]
+        return (p[0], p[1], p[2], yaw)
+
+
+class Samples:
+    # Follow setpoints that have already been sampled at rate (in Hz), i.e.,
+    # p[k] = (x, y, z, yaw) is the setpoint at time k / rate - e.g., at the
+    # rate of the scheduler, so that each tick only has to look up one row
+    def __init__(self, p, rate):
+        self.p = [tuple(row) for row in np.asarray(p, dtype=float).tolist()]
+        self.rate = rate
+        self.duration = (len(self.p) - 1) / rate
+
+    def setpoint(self, t):
+        return self.p[min(int(t * self.rate + 0.5), len(self.p) - 1)]
+
+
+class Stop:
+    # Turn off the motors and send nothing else for dt seconds
+    def __init__(self, dt):
+        self.duration = dt
+
+
+class SetpointScheduler:
+    def __init__(self, commander, rate=50., idle_timeout=1., history_length=100000):
+        self.commander = commander
+        self.period = 1. / rate
+        self.idle_timeout = idle_timeout
+        self.idle_since = None
+        self.segments = queue.Queue()
+        self.current = None
+        self.current_start = None
+        self.last_setpoint = None
+        self.closed = False
+        # (held while a tick runs, so that cancel never happens halfway
+        # through one)
+        self.lock = threading.Lock()
+        # (the error that ended each segment that failed, by its event)
+        self.errors = {}
+
+        # Timing statistics (lateness of each of the last history_length
+        # ticks relative to its deadline, and the number of deadlines that
+        # were missed entirely)
+        self.jitter = collections.deque(maxlen=history_length)
+        # The last history_length setpoints sent, as (time.monotonic() time,
+        # (x, y, z, yaw)), or (time, None) when the motors were stopped
+        self.sent = collections.deque(maxlen=history_length)
+        self.num_ticks = 0
+        self.num_missed = 0
+
+        self.thread = threading.Thread(target=self._run, name='SetpointScheduler', daemon=True)
+        self.thread.start()
+
+    def add(self, segment, on_done=None, start_at=None):
+        # Queue a segment and return an event that is set once it is done
+        # (on_done, if given, is also called from the scheduler thread then).
+        # If start_at (a time.monotonic() time) is given, the segment does not
+        # start before then - the last setpoint is held until it does.
+        done = threading.Event()
+        self.segments.put((segment, done, on_done, start_at))
+        return done
+
+    def run(self, segment):
+        # Queue a segment and wait until it is done
+        self.wait(self.add(segment))
+
+    def wait(self, done):
+        # Wait for the event of a segment (from add), and raise the error
+        # that stopped it, if any
+        done.wait()
+        error = self.errors.pop(done, None)
+        if error is not None:
+            raise error
+
+    def cancel(self):
+        # Drop the segment being flown and every queued one, and hold the last
+        # setpoint (their events are set, so nothing waits for them forever,
+        # but their on_done is not called)
+        with self.lock:
+            self._drop_all()
+
+    def _drop_all(self, error=None):
+        dropped = []
+        if self.current is not None:
+            dropped.append(self.current_done)
+            self.current = None
+        while True:
+            try:
+                segment, done, on_done, start_at = self.segments.get_nowait()
+            except queue.Empty:
+                break
+            dropped.append(done)
+        for done in dropped:
+            if error is not None:
+                self.errors[done] = error
+            done.set()
+
+    def _next_segment(self, start_time):
+        try:
+            self.current, self.current_done, self.current_on_done, start_at = self.segments.get_nowait()
+        except queue.Empty:
+            self.current = None
+            return
+        self.current_start = start_time if start_at is None else max(start_time, start_at)
+        self.current_started = False
+
+    def _tick(self, now):
+        if self.current is None:
+            self._next_segment(now)
+        while self.current is not None:
+            t = now - self.current_start
+            if t < 0:
+                break
+            if not self.current_started:
+                self.current_started = True
+                if isinstance(self.current, Stop):
+                    self.commander.send_stop_setpoint()
+                    self.sent.append((now, None))
+                    self.last_setpoint = None
+            if not isinstance(self.current, Stop):
+                self.last_setpoint = self.current.setpoint(min(t, self.current.duration))
+            if t < self.current.duration:
+                break
+            # This segment is done, so the next one (if there is one) starts
+            # at the exact time this one ended
+            self.current_done.set()
+            if self.current_on_done is not None:
+                # (an error here must not stop the setpoints)
+                try:
+                    self.current_on_done()
+                except Exception as e:
+                    print(f'Error when a segment ended: {e!r}')
+            self._next_segment(self.current_start + self.current.duration)
+        if self.current is not None:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now
+        elif self.last_setpoint is not None and now - self.idle_since > self.idle_timeout:
+            print(f'No setpoints for {self.idle_timeout} seconds, so {self.last_setpoint} is no longer held')
+            self.last_setpoint = None
+        if self.last_setpoint is not None:
+            self.commander.send_position_setpoint(*self.last_setpoint)
+            self.sent.append((now, self.last_setpoint))
+
+    def _run(self):
+        deadline = time.monotonic()
+        while not self.closed:
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+                now = time.monotonic()
+            late = now - deadline
+            self.jitter.append(late)
+            self.num_ticks += 1
+            if late >= self.period:
+                # Skip the deadlines that have already passed rather than
+                # sending a burst of setpoints to catch up
+                missed = int(late / self.period)
+                self.num_missed += missed
+                deadline += missed * self.period
+            with self.lock:
+                try:
+                    self._tick(now)
+                except Exception as e:
+                    # (a bad segment must not stop the scheduler - it and
+                    # every segment after it are dropped, and whoever waits
+                    # for them gets the error)
+                    print(f'Error when sending setpoints: {e!r}')
+                    self._drop_all(error=e)
+            deadline += self.period
+
+    def stats(self):
+        jitter = np.array(self.jitter) * 1e3
+        return {
+            'rate': 1. / self.period,
+            'ticks': self.num_ticks,
+            'missed': self.num_missed,
+            'jitter_mean_ms': float(np.mean(jitter)) if len(jitter) else 0.,
+            'jitter_p99_ms': float(np.percentile(jitter, 99)) if len(jitter) else 0.,
+            'jitter_max_ms': float(np.max(jitter)) if len(jitter) else 0.,
+        }
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        s = self.stats()
+        print(f'Sent setpoints at {s["rate"]:.0f} Hz for {s["ticks"]} ticks ({s["missed"]} missed deadlines, '
+              f'jitter mean {s["jitter_mean_ms"]:.3f} ms, p99 {s["jitter_p99_ms"]:.3f} ms, max {s["jitter_max_ms"]:.3f} ms)')
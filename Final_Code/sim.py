@@ -0,0 +1,459 @@
+import os
+import glob
+import json
+import time
+import queue
+import struct
+import threading
+import numpy as np
+import cflib.crtp
+from urllib.parse import parse_qs
+from cflib.crtp.crtpdriver import CRTPDriver
+from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
+from cflib.crtp.exceptions import WrongUriType
+from cflib.crazyflie.log import LogTocElement
+from cflib.crazyflie.param import ParamTocElement
+from frames import R_1in0
+from log_blocks import CACHE_DIR
+
+# A simulated drone that SimpleClient can connect to instead of a real one,
+# with no radio, e.g.,
+#
+#   client = SimpleClient('sim://model', use_controller=True)
+#   client = SimpleClient('sim://replay/NOOR_flight_4.json?speed=10')
+#
+# The drone speaks enough of the CRTP protocol for cflib to connect, fetch
+# the TOCs (whose CRCs are those of the TOCs in ./cache, so cflib finds them
+# there just like it does for the real drone), set parameters, and create and
+# start log blocks. Log packets are sent at the period of each block, and the
+# logged variables come either from
+#
+#   sim://model                 the linear model (A, B) from the Lab 8/9
+#                               notebook, flown to the position setpoints
+#                               from the commander by an LQR controller
+#   sim://replay/<filename>     a recorded flight (setpoints are ignored)
+#
+# Options go at the end, e.g., sim://model?speed=10&cache=./cache:
+#
+#   speed   how many times faster than real time the drone runs (0 means as
+#           fast as cflib can take its log packets)
+#   cache   where to find the TOCs (./cache by default)
+
+# Version of the CRTP protocol that the simulated drone reports
+PROTOCOL_VERSION = 10
+
+# Ports and channels (see cflib.crazyflie)
+TOC_CHANNEL = 0
+LOG_SETTINGS_CHANNEL = 1
+LOG_DATA_CHANNEL = 2
+PARAM_READ_CHANNEL = 1
+PARAM_WRITE_CHANNEL = 2
+PARAM_MISC_CHANNEL = 3
+
+# Commands (see cflib.crazyflie.log, param and mem)
+CMD_TOC_ITEM_V2 = 2
+CMD_TOC_INFO_V2 = 3
+CMD_CREATE_BLOCK_V2 = 6
+CMD_APPEND_BLOCK_V2 = 7
+CMD_DELETE_BLOCK = 2
+CMD_START_LOGGING = 3
+CMD_STOP_LOGGING = 4
+CMD_RESET_LOGGING = 5
+MISC_GET_EXTENDED_TYPE = 2
+MEM_CMD_INFO_NBR = 1
+TYPE_STOP = 0
+TYPE_POSITION = 7
+
+# Time step of the simulation (logging periods are multiples of 10 ms)
+dt = 0.01
+
+# Most packets waiting for cflib when running as fast as possible
+max_queue = 100
+
+# Linear model of the drone from the Lab 8/9 notebook, with state (o_x, o_y,
+# o_z, psi, theta, phi, v_x, v_y, v_z) and input (w_x, w_y, w_z, a_z - g)
+g = 9.81
+A = np.array([[0, 0, 0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 0, 0, 1], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, g, 0, 0, 0, 0], [0, 0, 0, 0, 0, -g, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0, 0]])
+B = np.array([[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 1]])
+
+# Weights of the controller that flies the model
+Q = np.diag([100., 100., 100., 1., 1., 1., 1., 1., 1.])
+R = np.diag([1., 1., 1., 1.])
+
+# Optical flow scale factor (from the Lab 7 notebook) and motor command when
+# hovering (from flight logs)
+k_flow = 4.09255568
+m_hover = 43500.
+
+# Variables that the model can log (anything else is logged as zero)
+signals = [
+    'ae483log.o_x', 'ae483log.o_y', 'ae483log.o_z',
+    'ae483log.psi', 'ae483log.theta', 'ae483log.phi',
+    'ae483log.v_x', 'ae483log.v_y', 'ae483log.v_z',
+    'stateEstimate.x', 'stateEstimate.y', 'stateEstimate.z',
+    'stateEstimate.yaw', 'stateEstimate.pitch', 'stateEstimate.roll',
+    'stateEstimate.vx', 'stateEstimate.vy', 'stateEstimate.vz',
+    'ae483log.w_x', 'ae483log.w_y', 'ae483log.w_z',
+    'ae483log.n_x', 'ae483log.n_y', 'ae483log.r', 'ae483log.a_z',
+    'ae483log.lh_x', 'ae483log.lh_y', 'ae483log.lh_z',
+    'ctrltarget.x', 'ctrltarget.y', 'ctrltarget.z',
+    'ae483log.o_x_des', 'ae483log.o_y_des', 'ae483log.o_z_des',
+    'motor.m1', 'motor.m2', 'motor.m3', 'motor.m4',
+]
+
+# Parameters that SimpleClient sets
+param_names = [
+    'kalman.resetEstimation',
+    'ae483par.reset_observer',
+    'ae483par.use_observer',
+    'stabilizer.controller',
+    'stabilizer.estimator',
+    'powerDist.motorSetEnable',
+    'lighthouse.method',
+    'ring.headlightEnable',
+]
+
+
+def lqr(A, B, Q, R):
+    # (same as in the notebooks)
+    from scipy import linalg
+    P = linalg.solve_continuous_are(A, B, Q, R)
+    K = linalg.inv(R) @  B.T @ P
+    return K
+
+
+class Model:
+    # The linear model flown by an LQR controller
+    def __init__(self):
+        self.K = lqr(A, B, Q, R)
+        self.s = np.zeros(9)
+        self.columns = {k: j for j, k in enumerate(signals)}
+        self.values = np.zeros(len(signals))
+
+    def step(self, setpoint):
+        # Advance by one time step toward setpoint ((x, y, z, yaw in degrees),
+        # or None if the motors are off) and return the logged variables
+        s = self.s
+        if setpoint is None:
+            # Motors off - fall to the ground and stay there
+            u = np.array([0., 0., 0., -g])
+            p_des = np.zeros(3)
+        else:
+            x, y, z, yaw = setpoint
+            p_des = np.array([x, y, z])
+            s_des = np.array([x, y, z, np.deg2rad(yaw), 0., 0., 0., 0., 0.])
+            u = -self.K @ (s - s_des)
+        s += dt * (A @ s + B @ u)
+        if s[2] <= 0.:
+            s[2] = 0.
+            if setpoint is None:
+                s[3:] = 0.
+            else:
+                s[8] = max(s[8], 0.)
+
+        v = self.values
+        v[0:9] = s
+        v[9:12] = s[0:3]
+        v[12] = np.rad2deg(s[3])
+        v[13] = -np.rad2deg(s[4])
+        v[14] = np.rad2deg(s[5])
+        v[15:18] = R_1in0(s[3], s[4], s[5]) @ s[6:9]
+        v[18:21] = u[0:3]
+        height = max(s[2], 0.1)
+        v[21] = k_flow * (u[1] - s[6] / height)
+        v[22] = k_flow * (-u[0] - s[7] / height)
+        v[23] = s[2]
+        v[24] = u[3] + g
+        v[25:28] = s[0:3]
+        v[28:31] = p_des
+        v[31:34] = p_des
+        v[34:38] = 0. if setpoint is None else m_hover * (u[3] + g) / g
+        return v
+
+
+class Replay:
+    # A recorded flight, resampled at 100 Hz (the last sample is repeated
+    # once the recording runs out)
+    def __init__(self, filename):
+        from analysis import resample_flight_data
+        from flightlog import load_flight_log
+        t, self.recording, self.columns = resample_flight_data(load_flight_log(filename))
+        self.i = 0
+
+    def step(self, setpoint):
+        v = self.recording[min(self.i, len(self.recording) - 1)]
+        self.i += 1
+        return v
+
+
+def _load_toc(cache_dir, element_class, names=()):
+    # The TOC in cache_dir of the given kind that has the most of the given
+    # variables or parameters. Returns (crc, list of TOC elements).
+    best = None
+    for filename in glob.glob(os.path.join(cache_dir, '*.json')):
+        with open(filename, 'r') as f:
+            toc = json.load(f)
+        elements = [e for group in toc.values() for e in group.values()]
+        if not elements or elements[0]['__class__'] != element_class.__name__:
+            continue
+        key = (sum(name in toc.get(group, {}) for group, name in (n.split('.') for n in names)), filename)
+        if best is None or key > best[0]:
+            crc = int(os.path.splitext(os.path.basename(filename))[0], 16)
+            best = (key, crc, sorted(elements, key=lambda e: e['ident']))
+    if best is None:
+        raise Exception(f'Found no {element_class.__name__} TOC in {cache_dir}')
+    return best[1], best[2]
+
+
+def _type_id(types, ctype):
+    for type_id, t in types.items():
+        if t[0] == ctype:
+            return type_id
+
+
+class SimulatedDrone:
+    def __init__(self, source, speed=1., cache_dir=CACHE_DIR):
+        self.source = source
+        self.speed = speed
+        self.log_crc, self.log_toc = _load_toc(cache_dir, LogTocElement, names=signals)
+        self.param_crc, self.param_toc = _load_toc(cache_dir, ParamTocElement, names=param_names)
+        self.params = {e['ident']: 0 for e in self.param_toc}
+        self.blocks = {}
+        self.setpoint = None
+        self.lock = threading.Lock()
+        self.out_queue = queue.Queue()
+        self.num_steps = 0
+        self.num_packets = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='SimulatedDrone', daemon=True)
+        self.thread.start()
+
+    def _reply(self, port, channel, data):
+        pk = CRTPPacket()
+        pk.set_header(port, channel)
+        pk.data = data
+        self.out_queue.put(pk)
+
+    def handle(self, pk):
+        # Handle one packet from cflib
+        port, channel, data = pk.port, pk.channel, bytes(pk.data)
+        if port == CRTPPort.LINKCTRL:
+            if channel == 0:
+                # Echo (for latency measurements)
+                self._reply(port, channel, data)
+            elif channel == 1:
+                self._reply(port, channel, b'Bitcraze Crazyflie')
+        elif port == CRTPPort.PLATFORM and channel == 1 and data[:1] == b'\x00':
+            self._reply(port, channel, bytes([0, PROTOCOL_VERSION]))
+        elif port == CRTPPort.MEM and channel == 0 and data[:1] == bytes([MEM_CMD_INFO_NBR]):
+            self._reply(port, channel, bytes([MEM_CMD_INFO_NBR, 0]))
+        elif port == CRTPPort.LOGGING:
+            if channel == TOC_CHANNEL:
+                self._handle_toc(port, data, self.log_crc, self.log_toc, LogTocElement.types, 0)
+            elif channel == LOG_SETTINGS_CHANNEL:
+                self._handle_log_settings(data)
+        elif port == CRTPPort.PARAM:
+            if channel == TOC_CHANNEL:
+                self._handle_toc(port, data, self.param_crc, self.param_toc, ParamTocElement.types, 0x10)
+            else:
+                self._handle_param(channel, data)
+        elif port == CRTPPort.COMMANDER_GENERIC and channel == 0:
+            if data[0] == TYPE_POSITION:
+                with self.lock:
+                    self.setpoint = struct.unpack('<ffff', data[1:17])
+            elif data[0] == TYPE_STOP:
+                with self.lock:
+                    self.setpoint = None
+        elif port == CRTPPort.COMMANDER:
+            # (cflib sends a zero setpoint here when it closes the link)
+            with self.lock:
+                self.setpoint = None
+
+    def _handle_toc(self, port, data, crc, toc, types, extended):
+        if data[0] == CMD_TOC_INFO_V2:
+            self._reply(port, TOC_CHANNEL, struct.pack('<BHI', CMD_TOC_INFO_V2, len(toc), crc))
+        elif data[0] == CMD_TOC_ITEM_V2:
+            ident = struct.unpack('<H', data[1:3])[0]
+            e = toc[ident]
+            metadata = _type_id(types, e['ctype']) | (extended if e.get('extended') else 0) | (0x40 if e['access'] else 0)
+            name = f'{e["group"]}\0{e["name"]}\0'.encode('ISO-8859-1')
+            self._reply(port, TOC_CHANNEL, data[:3] + bytes([metadata]) + name)
+
+    def _handle_log_settings(self, data):
+        cmd = data[0]
+        if cmd == CMD_RESET_LOGGING:
+            with self.lock:
+                self.blocks = {}
+            self._reply(CRTPPort.LOGGING, LOG_SETTINGS_CHANNEL, bytes([cmd, 0, 0]))
+            return
+        block_id = data[1]
+        with self.lock:
+            if cmd == CMD_CREATE_BLOCK_V2:
+                self.blocks[block_id] = {'variables': [], 'period': None}
+            if cmd in (CMD_CREATE_BLOCK_V2, CMD_APPEND_BLOCK_V2):
+                for i in range(2, len(data) - 2, 3):
+                    fetch_as = data[i] & 0x0F
+                    ident = struct.unpack('<H', data[i + 1:i + 3])[0]
+                    self.blocks[block_id]['variables'].append((self.log_toc[ident], fetch_as))
+                self._compile_block(self.blocks[block_id])
+            elif cmd == CMD_START_LOGGING:
+                self.blocks[block_id]['period'] = max(data[2], 1)
+            elif cmd == CMD_STOP_LOGGING:
+                self.blocks[block_id]['period'] = None
+            elif cmd == CMD_DELETE_BLOCK:
+                self.blocks.pop(block_id, None)
+        self._reply(CRTPPort.LOGGING, LOG_SETTINGS_CHANNEL, bytes([cmd, block_id, 0]))
+
+    def _compile_block(self, block):
+        # Work out once how to pack a log packet for this block
+        fmt = '<'
+        block['columns'] = []
+        block['is_int'] = []
+        for e, fetch_as in block['variables']:
+            pytype = LogTocElement.types[fetch_as][1]
+            fmt += pytype[1]
+            block['columns'].append(self.source.columns.get(f'{e["group"]}.{e["name"]}', -1))
+            block['is_int'].append(pytype[1] not in 'fe')
+        block['struct'] = struct.Struct(fmt)
+
+    def _handle_param(self, channel, data):
+        ident = struct.unpack('<H', data[:2])[0] if channel != PARAM_MISC_CHANNEL else struct.unpack('<H', data[1:3])[0]
+        e = self.param_toc[ident]
+        pytype = ParamTocElement.types[_type_id(ParamTocElement.types, e['ctype'])][1]
+        if channel == PARAM_READ_CHANNEL:
+            self._reply(CRTPPort.PARAM, channel, data[:2] + b'\x00' + struct.pack(pytype, self.params[ident]))
+        elif channel == PARAM_WRITE_CHANNEL:
+            self.params[ident] = struct.unpack(pytype, data[2:])[0]
+            self._reply(CRTPPort.PARAM, channel, data[:2] + struct.pack(pytype, self.params[ident]))
+        elif data[0] == MISC_GET_EXTENDED_TYPE:
+            # (no parameter is persistent)
+            self._reply(CRTPPort.PARAM, channel, data[:3] + b'\x00')
+
+    def _send_log_data(self, values):
+        t = self.num_steps * 10
+        for block_id, block in list(self.blocks.items()):
+            if block['period'] is None or self.num_steps % block['period'] != 0:
+                continue
+            row = [values[j] if j >= 0 else 0. for j in block['columns']]
+            row = [int(min(max(x, 0), 65535)) if is_int else x for x, is_int in zip(row, block['is_int'])]
+            self._reply(
+                CRTPPort.LOGGING,
+                LOG_DATA_CHANNEL,
+                bytes([block_id, t & 0xFF, (t >> 8) & 0xFF, (t >> 16) & 0xFF]) + block['struct'].pack(*row),
+            )
+            self.num_packets += 1
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self.closed:
+            with self.lock:
+                setpoint = self.setpoint
+            values = self.source.step(setpoint)
+            with self.lock:
+                self._send_log_data(values)
+            self.num_steps += 1
+            if self.speed == 0:
+                if not any(block['period'] for block in self.blocks.values()):
+                    # (nothing is being logged yet, so run in real time)
+                    time.sleep(dt)
+                while self.out_queue.qsize() > max_queue and not self.closed:
+                    time.sleep(0.001)
+            else:
+                next_time += dt / self.speed
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+
+
+class SimDriver(CRTPDriver):
+    # Link driver for sim:// URIs
+    def __init__(self):
+        CRTPDriver.__init__(self)
+        self.needs_resending = False
+        self.drone = None
+
+    def connect(self, uri, radio_link_statistics_callback, link_error_callback):
+        if not uri.startswith('sim://'):
+            raise WrongUriType('Not a sim:// URI')
+        self.uri = uri
+        source, _, query = uri[len('sim://'):].partition('?')
+        options = {k: v[-1] for k, v in parse_qs(query).items()}
+        if source == 'model':
+            source = Model()
+        elif source.startswith('replay/'):
+            source = Replay(source[len('replay/'):])
+        else:
+            raise Exception(f'Unknown simulation "{source}" (use sim://model or sim://replay/<filename>)')
+        self.drone = SimulatedDrone(source, speed=float(options.get('speed', 1.)), cache_dir=options.get('cache', CACHE_DIR))
+
+    def send_packet(self, pk):
+        if self.drone is not None:
+            self.drone.handle(pk)
+
+    def receive_packet(self, wait=0):
+        if self.drone is None:
+            return None
+        try:
+            if wait == 0:
+                return self.drone.out_queue.get(False)
+            elif wait < 0:
+                return self.drone.out_queue.get(True)
+            else:
+                return self.drone.out_queue.get(True, wait)
+        except queue.Empty:
+            return None
+
+    def get_status(self):
+        return 'Simulated'
+
+    def get_name(self):
+        return 'sim'
+
+    def scan_interface(self, address=None):
+        return []
+
+    def close(self):
+        if self.drone is not None:
+            self.drone.close()
+            self.drone = None
+
+
+def register():
+    # Let cflib open sim:// URIs (done by SimpleClient when it is given one)
+    if SimDriver not in cflib.crtp.CLASSES:
+        cflib.crtp.CLASSES.insert(0, SimDriver)
+
+
+if __name__ == '__main__':
+    # Fly the simulated drone, as fast as possible, and report how fast log
+    # packets were received, e.g.,
+    #
+    #   python Final_Code/sim.py
+    #   python Final_Code/sim.py 'sim://replay/NOOR_flight_4.json?speed=0'
+    #
+    import sys
+    import logging
+    from flight import SimpleClient
+    logging.basicConfig(level=logging.ERROR)
+    uri = sys.argv[1] if len(sys.argv) > 1 else 'sim://model?speed=0'
+    client = SimpleClient(uri, use_controller=True)
+    while not client.is_fully_connected:
+        time.sleep(0.01)
+    drone = client.cf.link.drone
+    start_time = time.monotonic()
+    start_steps = drone.num_steps
+    client.move_smooth([0., 0., 0.], [0., 0., 0.5], 0., 0.5)
+    client.move(0., 0., 0.5, 0., 1.)
+    client.move_smooth([0., 0., 0.5], [0., 0., 0.], 0., 0.5)
+    elapsed = time.monotonic() - start_time
+    sim_time = (drone.num_steps - start_steps) * dt
+    num_packets = drone.num_packets
+    client.disconnect()
+    num_samples = sum(block.count for block in client.data.blocks.values())
+    print(f'{uri}: {sim_time:.2f} s simulated in {elapsed:.2f} s ({sim_time / elapsed:.1f}x real time)')
+    print(f' {num_packets} log packets sent ({num_packets / elapsed:.0f} per second), {num_samples} received')
+    print(f' final height {client.data["ae483log.o_z"]["data"][-1]:.3f} m')
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import queue
+import zlib
+import struct
+import threading
+import numpy as np
+
+# Append-only stream of logged data (version 1)
+#
+#   header      8-byte magic, uint16 version, uint16 reserved, uint32 length
+#               of the table, then the table itself: a utf-8 JSON list of log
+#               blocks, each of which looks like
+#               {'name': 'LogConf0', 'variables': [['ae483log.o_x', 'float'], ...], 'period_in_ms': 10}
+#               (streams written before log blocks had periods have no
+#               'period_in_ms', and were logged every 10 ms)
+#   chunks      uint32 length of the payload, uint32 crc32 of the payload,
+#               then the payload itself, which is a sequence of sections
+#               that each start with a uint16 block index and a uint32
+#               number of records, followed by that many records (a uint32
+#               drone timestamp and then every variable in the block)
+#
+# Everything is little-endian. Chunks are only ever appended, so if the
+# flight ends abruptly the file is still valid up to the last complete
+# chunk, which is what recover_stream reads back.
+MAGIC = b'AE483STR'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+CHUNK = struct.Struct('<II')
+SECTION = struct.Struct('<HI')
+EXTENSION = '.aestream'
+
+# Struct format of each type that the log subsystem knows about
+formats = {
+    'uint8_t': 'B',
+    'int8_t': 'b',
+    'uint16_t': 'H',
+    'int16_t': 'h',
+    'FP16': 'e',
+    'uint32_t': 'I',
+    'int32_t': 'i',
+    'float': 'f',
+}
+
+
+def _record_struct(variables):
+    return struct.Struct('<I' + ''.join(formats[t] for v, t in variables))
+
+
+class StreamWriter:
+    # Writes logged data to disk from a background thread while the drone
+    # is flying. The cflib callback thread only ever calls push, which puts
+    # the record in a bounded queue and returns immediately - if the queue
+    # is full (i.e., the disk cannot keep up) the record is dropped and
+    # counted rather than blocking the callback. If writing fails (e.g., the
+    # disk is full), nothing more is queued, and the error is raised by push
+    # and close.
+    def __init__(self, filename, blocks, max_queue=10000, chunk_interval=0.1, fsync_interval=1.0, periods=None):
+        # blocks is a list of (name, [(variable, type), ...]) pairs, and
+        # periods is the period of each block in ms (10 by default)
+        self.filename = filename
+        self.names = [name for name, variables in blocks]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.variables = [[v for v, t in variables] for name, variables in blocks]
+        self.structs = [_record_struct(variables) for name, variables in blocks]
+        self.chunk_interval = chunk_interval
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.num_dropped = 0
+        self.num_written = 0
+        self.closed = False
+        self.error = None
+
+        if periods is None:
+            periods = [10] * len(blocks)
+        table = [
+            {'name': name, 'variables': [list(var) for var in variables], 'period_in_ms': period}
+            for (name, variables), period in zip(blocks, periods)
+        ]
+        table_bytes = json.dumps(table).encode('utf-8')
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, len(table_bytes)))
+        self.file.write(table_bytes)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.thread = threading.Thread(target=self._run, name='StreamWriter', daemon=True)
+        self.thread.start()
+
+    def push(self, block_name, timestamp, data):
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait((self.index[block_name], timestamp, data))
+        except queue.Full:
+            self.num_dropped += 1
+
+    def _write_chunk(self, records):
+        # Group records by block so each block becomes one section
+        sections = [[] for i in range(len(self.names))]
+        for i, timestamp, data in records:
+            sections[i].append(self.structs[i].pack(timestamp, *[data[v] for v in self.variables[i]]))
+        payload = bytearray()
+        for i, section in enumerate(sections):
+            if section:
+                payload += SECTION.pack(i, len(section))
+                payload += b''.join(section)
+        self.file.write(CHUNK.pack(len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        self.num_written += len(records)
+
+    def _run(self):
+        try:
+            self._write_all()
+            self.file.close()
+        except Exception as e:
+            print(f'Could not write to {self.filename} because {e!r}')
+            self.error = e
+            try:
+                self.file.close()
+            except OSError:
+                pass
+
+    def _write_all(self):
+        last_fsync = time.monotonic()
+        done = False
+        while not done:
+            records = []
+            deadline = time.monotonic() + self.chunk_interval
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is None:
+                    done = True
+                    break
+                records.append(record)
+            if records:
+                self._write_chunk(records)
+            if done or time.monotonic() - last_fsync >= self.fsync_interval:
+                os.fsync(self.file.fileno())
+                last_fsync = time.monotonic()
+
+    def close(self):
+        # Write whatever is still in the queue and wait for it to hit the disk
+        # (raises the error that writing failed with, if it did)
+        if not self.closed:
+            self.closed = True
+            # (the queue may be full, in which case the thread makes room -
+            # unless it has stopped because of an error)
+            while self.thread.is_alive():
+                try:
+                    self.queue.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            self.thread.join()
+            if self.error is not None:
+                self.num_dropped += self.queue.qsize()
+            if self.num_dropped > 0:
+                print(f'Dropped {self.num_dropped} log records that could not be written to {self.filename} in time')
+        if self.error is not None:
+            raise self.error
+
+
+def recover_stream(filename):
+    # Read back a stream written by StreamWriter, stopping at the first
+    # chunk that is incomplete or corrupt (e.g., because the flight crashed
+    # while it was being written). Returns data in the same layout as the
+    # JSON flight logs, i.e., {variable: {'time': array, 'data': array, 'period_in_ms': 10}}.
+    with open(filename, 'rb') as f:
+        buffer = f.read()
+    magic, version, reserved, table_length = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{filename} is not a log stream')
+    if version != VERSION:
+        raise ValueError(f'{filename} has version {version} but only version {VERSION} is supported')
+    table = json.loads(buffer[HEADER.size:HEADER.size + table_length])
+    dtypes = [
+        np.dtype([('time', '<u4')] + [(v, '<' + formats[t]) for v, t in block['variables']])
+        for block in table
+    ]
+    pieces = [[] for block in table]
+
+    offset = HEADER.size + table_length
+    num_chunks = 0
+    while offset + CHUNK.size <= len(buffer):
+        length, crc = CHUNK.unpack_from(buffer, offset)
+        payload = buffer[offset + CHUNK.size:offset + CHUNK.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        position = 0
+        while position < length:
+            i, count = SECTION.unpack_from(payload, position)
+            position += SECTION.size
+            pieces[i].append(np.frombuffer(payload, dtype=dtypes[i], count=count, offset=position))
+            position += count * dtypes[i].itemsize
+        offset += CHUNK.size + length
+        num_chunks += 1
+    if offset < len(buffer):
+        print(f'Ignored {len(buffer) - offset} bytes after the last complete chunk of {filename}')
+
+    data = {}
+    for block, dtype, piece in zip(table, dtypes, pieces):
+        records = np.concatenate(piece) if piece else np.empty(0, dtype=dtype)
+        t = records['time'].astype(np.int64)
+        for v, ctype in block['variables']:
+            data[v] = {'time': t, 'data': records[v].copy(), 'period_in_ms': block.get('period_in_ms', 10)}
+    return data
+
+
+if __name__ == '__main__':
+    # Recover a (possibly truncated) stream and save it as a normal flight
+    # log, e.g.,
+    #
+    #   python Final_Code/streaming.py NOOR_flight_5.aestream NOOR_flight_5.json
+    #
+    from flightlog import EXTENSION as BINARY_EXTENSION, write_flight_log
+
+    filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        output_filename = sys.argv[2]
+    else:
+        output_filename = os.path.splitext(filename)[0] + '.json'
+    data = recover_stream(filename)
+    num_samples = max([len(val['time']) for val in data.values()], default=0)
+    print(f'Recovered {len(data)} variables ({num_samples} samples) from {filename}')
+    if output_filename.endswith(BINARY_EXTENSION):
+        write_flight_log(output_filename, data)
+    else:
+        with open(output_filename, 'w') as outfile:
+            json.dump({v: {'time': val['time'].tolist(), 'data': val['data'].tolist(), 'period_in_ms': val['period_in_ms']} for v, val in data.items()},
+                      outfile, indent=4, sort_keys=False)
+    print(f'Wrote {output_filename}')
@@ -0,0 +1,266 @@
+import os
+import time
+import json
+import threading
+import itertools
+from flight import SimpleClient
+from health import write_health
+from setpoints import Hold
+from glyphs import compile_word, drawable, fly_word
+
+# Several drones spelling one word at the same time, e.g.,
+#
+#   swarm = Swarm(['radio://0/24/2M/E7E7E7E7E7', 'radio://0/48/2M/E7E7E7E7E7'], use_controller=True)
+#   swarm.wait_until_connected()
+#   swarm.spell('NOOR', -0.8, 0.30)
+#   swarm.disconnect()
+#   swarm.write_data('NOOR_swarm_{drone}.json')
+#
+# The word is split into one piece of consecutive letters per drone (so that
+# the longest piece takes as little time as possible), each drone flies its
+# piece in its own lane (a different y), and all drones start drawing at the
+# same moment. If anything goes wrong with one drone (or one of them does not
+# reach the start of its piece in time), every drone drops what it was going
+# to fly, comes down where it is and stops its motors. Links to drones that
+# use the same radio dongle (the same N in radio://N/...) share that dongle
+# (cflib does this by itself). To try it without drones, use simulated ones
+# (see sim.py), e.g.,
+#
+#   swarm = Swarm(['sim://model', 'sim://model'], use_controller=True)
+
+
+def assign_radios(uris, num_radios):
+    # Spread drones over num_radios dongles (radio://0/... to
+    # radio://{num_radios - 1}/...) so that each dongle serves as few links
+    # as possible
+    assigned = []
+    for i, uri in enumerate(uris):
+        if uri.startswith('radio://'):
+            rest = uri[len('radio://'):].split('/', 1)[1]
+            uri = f'radio://{i % num_radios}/{rest}'
+        assigned.append(uri)
+    return assigned
+
+
+def split_word(word, num_drones, x_start, x_dim, spacing=0.1, speed=0.2):
+    # Split word into at most num_drones pieces of consecutive letters so
+    # that the longest piece takes as little time as possible. Returns a
+    # list of (piece, x position of its first letter). (This tries every way
+    # to split the word, which is fine for words of a reasonable length.)
+    word = drawable(word)
+    n = min(num_drones, len(word))
+    duration = {}
+    for i in range(len(word)):
+        for j in range(i + 1, len(word) + 1):
+            duration[i, j] = compile_word(word[i:j], 0., x_dim, spacing=spacing, speed=speed).duration
+    best = None
+    for cuts in itertools.combinations(range(1, len(word)), n - 1):
+        bounds = [0] + list(cuts) + [len(word)]
+        longest = max(duration[i, j] for i, j in zip(bounds[:-1], bounds[1:]))
+        if best is None or longest < best[0]:
+            best = (longest, bounds)
+    bounds = best[1]
+    return [(word[i:j], x_start + i * (x_dim + spacing)) for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+class Swarm:
+    def __init__(self, uris, names=None, num_radios=None, client_factory=SimpleClient, **kwargs):
+        # Every link is opened right away and connects in the background, so
+        # all drones connect at the same time. kwargs are passed on to each
+        # client (client_factory can be anything with the same interface as
+        # SimpleClient), except that "{drone}" in live or stream_to is
+        # replaced by the drone name - and if there is no "{drone}" in them,
+        # the drone name is added, so that no two drones share a live feed or
+        # a stream.
+        if num_radios is not None:
+            uris = assign_radios(uris, num_radios)
+        if names is None:
+            names = [f'cf{i}' for i in range(len(uris))]
+        if kwargs.get('live') is not None and '{drone}' not in kwargs['live']:
+            kwargs['live'] += '_{drone}'
+        if kwargs.get('stream_to') is not None and '{drone}' not in kwargs['stream_to']:
+            kwargs['stream_to'] = '_{drone}'.join(os.path.splitext(kwargs['stream_to']))
+        self.clients = {}
+        for name, uri in zip(names, uris):
+            drone_kwargs = {k: v.format(drone=name) if k in ['live', 'stream_to'] and v is not None else v for k, v in kwargs.items()}
+            self.clients[name] = client_factory(uri, **drone_kwargs)
+
+    @property
+    def data(self):
+        # Logged data of every drone, keyed by drone name
+        return {name: client.data for name, client in self.clients.items()}
+
+    def wait_until_connected(self, timeout=None):
+        start_time = time.monotonic()
+        while not all(client.is_fully_connected for client in self.clients.values()):
+            if timeout is not None and time.monotonic() - start_time > timeout:
+                missing = [name for name, client in self.clients.items() if not client.is_fully_connected]
+                raise Exception(f'Timed out waiting to connect to {", ".join(missing)}')
+            time.sleep(0.1)
+
+    def run(self, f):
+        # Call f(name, client) for every drone at the same time, each in its
+        # own thread, and wait for all of them to finish
+        errors = []
+
+        def target(name, client):
+            try:
+                f(name, client)
+            except Exception as e:
+                errors.append(e)
+                raise
+
+        threads = [
+            threading.Thread(target=target, args=(name, client), name=f'Swarm-{name}')
+            for name, client in self.clients.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def spell(self, word, x_start, x_dim, spacing=0.1, speed=0.2, lane=0.5, lead_time=1.0, z_takeoff=0.15, timeout=30.):
+        # Spell word with letter k between x_start + k * (x_dim + spacing) and
+        # that plus x_dim, exactly as one drone would. Drone i takes off from
+        # (x of its first letter, i * lane, 0), flies to the start of its
+        # piece and waits there for the others - then all of them start
+        # drawing lead_time seconds after the last one has arrived. Drones
+        # wait at most timeout seconds for each other (see above for what
+        # happens then). Returns the time from that start until the last drone
+        # finished drawing.
+        pieces = split_word(word, len(self.clients), x_start, x_dim, spacing=spacing, speed=speed)
+        plan = {}
+        for i, (name, (piece, x_piece)) in enumerate(zip(self.clients, pieces)):
+            plan[name] = compile_word(piece, x_piece, x_dim, spacing=spacing, speed=speed, y=i * lane)
+            print(f'{name} draws "{piece}" from x = {x_piece:.2f} in {plan[name].duration:.2f} seconds')
+        start = {}
+        barrier = threading.Barrier(len(plan), action=lambda: start.update(time=time.monotonic() + lead_time))
+        finish = {}
+        failed = threading.Event()
+
+        def fly(name, client):
+            if name not in plan:
+                # (more drones than letters)
+                return
+            word = plan[name]
+            x, y, z = (float(v) for v in word.p[0])
+            x_end, y_end, z_end = (float(v) for v in word.p[-1])
+            steps = [
+                lambda: client.move(x, y, z_takeoff, 0., 1.0),
+                lambda: client.move_smooth([x, y, z_takeoff], [x, y, z], 0., speed),
+                # (the start of the piece is held while waiting for the
+                # others, since the scheduler stops holding a setpoint once
+                # it has been idle for a moment)
+                lambda: client.setpoints.add(Hold(x, y, z, 0., timeout + lead_time)),
+                lambda: barrier.wait(timeout=timeout),
+                lambda: client.setpoints.cancel(),
+                lambda: fly_word(client, word, start_at=start['time']),
+                lambda: finish.update({name: time.monotonic()}),
+                lambda: client.move_smooth([x_end, y_end, z_end], [x_end, y_end, z_takeoff], 0., speed),
+                lambda: client.move_smooth([x_end, y_end, z_takeoff], [x, y, z_takeoff], 0., speed),
+                lambda: client.stop(1.0),
+            ]
+            try:
+                for step in steps:
+                    # (another drone failed, and has dropped what this one
+                    # was flying)
+                    if failed.is_set():
+                        return
+                    step()
+            except Exception as e:
+                if failed.is_set():
+                    return
+                failed.set()
+                barrier.abort()
+                for other in self.clients.values():
+                    other.setpoints.cancel()
+                if isinstance(e, threading.BrokenBarrierError):
+                    raise Exception(f'Timed out waiting {timeout} seconds for every drone to reach the start of its piece')
+                raise
+
+        try:
+            self.run(fly)
+        except Exception:
+            self.land(z_takeoff=z_takeoff, speed=speed)
+            raise
+        mission_time = max(finish.values()) - start['time']
+        print(f'Spelled "{word}" with {len(plan)} drones in {mission_time:.2f} seconds')
+        return mission_time
+
+    def land(self, z_takeoff=0.15, speed=0.2):
+        # Drop whatever every drone was going to fly, come straight down from
+        # where it is to z_takeoff and stop its motors
+        def land(name, client):
+            client.setpoints.cancel()
+            p = client.setpoints.last_setpoint
+            if p is not None:
+                x, y, z, yaw = (float(v) for v in p)
+                client.move_smooth([x, y, z], [x, y, min(z, z_takeoff)], yaw, speed)
+            client.stop(1.0)
+
+        self.run(land)
+
+    def disconnect(self):
+        self.run(lambda name, client: client.disconnect())
+
+    def write_data(self, filename='logged_data_{drone}.json'):
+        # Write the data of each drone to its own file ("{drone}" in filename
+        # is replaced by the drone name), or all of it to one JSON file keyed
+        # by drone name if there is no "{drone}" in filename - either way,
+        # with the same host events and health that SimpleClient.write_data
+        # writes (the health of every drone goes in one name.health.json)
+        if '{drone}' in filename:
+            for name, client in self.clients.items():
+                client.write_data(filename.format(drone=name))
+        else:
+            health = {name: client.stream_health() for name, client in self.clients.items() if client.health}
+            if health:
+                write_health(os.path.splitext(filename)[0] + '.health.json', health)
+            with open(filename, 'w') as outfile:
+                json.dump(
+                    {name: client.data.merged(client.host_data()).to_dict() for name, client in self.clients.items()},
+                    outfile, indent=4, sort_keys=False,
+                )
+
+
+if __name__ == '__main__':
+    # Show how a word would be split (add --fly to actually fly it), e.g.,
+    #
+    #   python Final_Code/swarm.py NOOR radio://0/24/2M/E7E7E7E7E7 radio://0/48/2M/E7E7E7E7E7
+    #
+    import logging
+    import argparse
+    import cflib.crtp
+
+    parser = argparse.ArgumentParser(description='Spell a word with several drones.')
+    parser.add_argument('word')
+    parser.add_argument('uris', nargs='+')
+    parser.add_argument('--letter-width', type=float, default=0.30)
+    parser.add_argument('--spacing', type=float, default=0.1)
+    parser.add_argument('--speed', type=float, default=0.2)
+    parser.add_argument('--radios', type=int, default=None, help='number of radio dongles to spread the drones over')
+    parser.add_argument('--fly', action='store_true')
+    args = parser.parse_args()
+
+    word = drawable(args.word)
+    x_start = -args.letter_width * len(word) / 2
+    one_drone = compile_word(word, x_start, args.letter_width, spacing=args.spacing, speed=args.speed).duration
+    pieces = split_word(word, len(args.uris), x_start, args.letter_width, spacing=args.spacing, speed=args.speed)
+    longest = max(compile_word(piece, x, args.letter_width, spacing=args.spacing, speed=args.speed).duration for piece, x in pieces)
+    uris = args.uris if args.radios is None else assign_radios(args.uris, args.radios)
+    for uri, (piece, x) in zip(uris, pieces):
+        print(f'{uri}: "{piece}" from x = {x:.2f}')
+    print(f'Drawing time: {one_drone:.2f} s with one drone, {longest:.2f} s with {len(pieces)} ({one_drone / longest:.1f}x faster)')
+
+    if args.fly:
+        logging.basicConfig(level=logging.ERROR)
+        cflib.crtp.init_drivers()
+        swarm = Swarm(uris, use_controller=True, use_observer=False)
+        swarm.wait_until_connected()
+        swarm.run(lambda name, client: client.params.set_many({'lighthouse.method': 0, 'stabilizer.estimator': 2}))
+        swarm.run(lambda name, client: client.stop(1.0))
+        swarm.spell(word, x_start, args.letter_width, spacing=args.spacing, speed=args.speed)
+        swarm.disconnect()
+        swarm.write_data(f'{args.word}_swarm_{{drone}}.json')
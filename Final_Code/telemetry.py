@@ -0,0 +1,120 @@
+from collections.abc import Mapping
+import numpy as np
+
+# Numpy type in which to store each type that the log subsystem knows about
+dtypes = {
+    'uint8_t': np.uint8,
+    'int8_t': np.int8,
+    'uint16_t': np.uint16,
+    'int16_t': np.int16,
+    'FP16': np.float16,
+    'uint32_t': np.uint32,
+    'int32_t': np.int32,
+    'float': np.float32,
+}
+
+
+class BlockColumns:
+    # Samples from one log block: a single array of drone timestamps (in
+    # milliseconds) shared by every variable in the block, and one typed
+    # array of values per variable. All arrays are preallocated and double
+    # in size whenever they fill up, so appending a sample is amortized O(1)
+    # and never creates any Python objects.
+    def __init__(self, variables, capacity=1024, period_in_ms=10):
+        self.names = [v for v, t in variables]
+        self.period_in_ms = period_in_ms
+        self.types = dict(variables)
+        self.time = np.empty(capacity, dtype=np.int64)
+        self.columns = {v: np.empty(capacity, dtype=dtypes[t]) for v, t in variables}
+        self.count = 0
+
+    def _grow(self):
+        capacity = 2 * len(self.time)
+        time = np.empty(capacity, dtype=self.time.dtype)
+        time[:self.count] = self.time[:self.count]
+        self.time = time
+        for v, column in self.columns.items():
+            new_column = np.empty(capacity, dtype=column.dtype)
+            new_column[:self.count] = column[:self.count]
+            self.columns[v] = new_column
+
+    def append(self, timestamp, data):
+        i = self.count
+        if i == len(self.time):
+            self._grow()
+        self.time[i] = timestamp
+        for v, column in self.columns.items():
+            column[i] = data[v]
+        # Only publish the new sample after it has been written, so readers
+        # on other threads never see a half-written row
+        self.count = i + 1
+
+    def extend(self, timestamps, data):
+        # Append many samples at once (data has one array per variable)
+        n = len(timestamps)
+        while self.count + n > len(self.time):
+            self._grow()
+        self.time[self.count:self.count + n] = timestamps
+        for v, column in self.columns.items():
+            column[self.count:self.count + n] = data[v]
+        self.count += n
+
+    def get_time(self):
+        return self.time[:self.count]
+
+    def get_data(self, v):
+        return self.columns[v][:self.count]
+
+
+class TelemetryStore(Mapping):
+    # Columnar store for everything that SimpleClient logs. It behaves like
+    # the dict that SimpleClient.data used to be, i.e.,
+    #
+    #   store['ae483log.o_x'] == {'time': [...], 'data': [...], 'period_in_ms': 10}
+    #
+    # except that 'time' and 'data' are numpy views of the stored samples
+    # rather than lists (no copies are made). period_in_ms is how often the
+    # variable was logged (see log_rates in flight.py).
+    def __init__(self):
+        self.blocks = {}
+        self.block_of = {}
+
+    def add_block(self, name, variables, capacity=1024, period_in_ms=10):
+        # variables is a list of (name, type) pairs, e.g. a block returned by
+        # log_blocks.pack_variables
+        self.blocks[name] = BlockColumns(variables, capacity=capacity, period_in_ms=period_in_ms)
+        for v, t in variables:
+            self.block_of[v] = name
+
+    def append(self, block_name, timestamp, data):
+        self.blocks[block_name].append(timestamp, data)
+
+    def extend(self, block_name, timestamps, data):
+        self.blocks[block_name].extend(timestamps, data)
+
+    def merged(self, other):
+        # A store with the blocks of both self and other (the arrays are
+        # shared, not copied)
+        store = TelemetryStore()
+        store.blocks = {**self.blocks, **other.blocks}
+        store.block_of = {**self.block_of, **other.block_of}
+        return store
+
+    def __getitem__(self, v):
+        block = self.blocks[self.block_of[v]]
+        return {'time': block.get_time(), 'data': block.get_data(v), 'period_in_ms': block.period_in_ms}
+
+    def __iter__(self):
+        return iter(self.block_of)
+
+    def __len__(self):
+        return len(self.block_of)
+
+    def to_dict(self):
+        # The same thing as the dict that SimpleClient.data used to be (with
+        # lists rather than arrays, and the period of each variable), e.g. for
+        # writing to JSON
+        return {
+            v: {'time': val['time'].tolist(), 'data': val['data'].tolist(), 'period_in_ms': val['period_in_ms']}
+            for v, val in self.items()
+        }